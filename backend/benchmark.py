@@ -0,0 +1,355 @@
+"""Per-stage benchmark of the image processing pipeline.
+
+Generates synthetic phone captures (text pages, receipts, photos; random
+perspective and skew on a textured background) at several resolutions, times
+each pipeline stage plus the end-to-end process_document_image, and reports
+p50/p95 latency and peak traced memory. Runs offline on the CPU only.
+
+    python backend\\benchmark.py                        # 2/8/12/48 MP, compare to baseline
+    python backend\\benchmark.py --sizes 2,8 --repeat 3
+    python backend\\benchmark.py --save-baseline        # record this machine's numbers
+
+Exits with status 1 when a stage's p50 is slower than the baseline by more
+than --threshold.
+"""
+
+import argparse
+import base64
+import json
+import math
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from copy import deepcopy
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable
+
+import cv2
+import numpy as np
+
+import page_cache
+from config import BACKEND_DIR, DEFAULT_CONFIG
+from image_processor import (
+    apply_warp,
+    auto_rotate,
+    compute_warp,
+    decode_base64_image,
+    detect_document,
+    encode_image_to_base64,
+    enhance_document,
+    four_point_transform,
+    process_document_image,
+)
+
+
+DEFAULT_SIZES_MP = [2, 8, 12, 48]
+DOCUMENT_KINDS = ["text", "receipt", "photo"]
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.15
+BASELINE_PATH = BACKEND_DIR / "benchmark_baseline.json"
+CAPTURE_JPEG_QUALITY = 90
+MB = 1024 * 1024
+
+
+# --- Synthetic captures ---------------------------------------------------
+
+def _frame_size(megapixels: float) -> tuple[int, int]:
+    # 4:3 like a phone camera
+    width = int(round(math.sqrt(megapixels * 1e6 * 4 / 3)))
+    return width, int(round(width * 3 / 4))
+
+
+def _text_lines(rng: np.random.Generator, count: int) -> list[str]:
+    words = ["invoice", "total", "amount", "date", "receipt", "tax", "item", "qty",
+             "price", "EUR", "paid", "ref", "number", "customer", "address", "2024"]
+    return [" ".join(rng.choice(words, size=rng.integers(4, 10))) for _ in range(count)]
+
+
+def _text_page(rng: np.random.Generator, width: int, height: int) -> np.ndarray:
+    page = np.full((height, width, 3), 245, np.uint8)
+    scale = width / 1400
+    line_height = max(8, int(38 * scale))
+    margin = int(0.08 * width)
+    y = margin + line_height
+    for line in _text_lines(rng, (height - 2 * margin) // line_height):
+        cv2.putText(page, line, (margin, y), cv2.FONT_HERSHEY_SIMPLEX, scale, (25, 25, 25),
+                    max(1, int(2 * scale)), cv2.LINE_AA)
+        y += line_height
+    return page
+
+
+def _receipt_page(rng: np.random.Generator, width: int, height: int) -> np.ndarray:
+    page = np.full((height, width, 3), 232, np.uint8)
+    scale = width / 700
+    line_height = max(8, int(30 * scale))
+    y = line_height * 2
+    for line in _text_lines(rng, (height - 3 * line_height) // line_height):
+        cv2.putText(page, line[:28], (int(0.06 * width), y), cv2.FONT_HERSHEY_PLAIN, 1.6 * scale,
+                    (60, 60, 60), max(1, int(1.5 * scale)), cv2.LINE_AA)
+        y += line_height
+    return page
+
+
+def _photo_page(rng: np.random.Generator, width: int, height: int) -> np.ndarray:
+    ramp = np.linspace(0, 1, width, dtype=np.float32)[None, :] * np.linspace(0.4, 1, height, dtype=np.float32)[:, None]
+    page = cv2.merge([
+        (ramp * 200 + 30).astype(np.uint8),
+        (ramp * 120 + 60).astype(np.uint8),
+        ((1 - ramp) * 180 + 40).astype(np.uint8),
+    ])
+    del ramp
+    for _ in range(40):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        color = tuple(int(value) for value in rng.integers(0, 255, size=3))
+        cv2.circle(page, center, int(rng.integers(width // 40, width // 8)), color, -1, cv2.LINE_AA)
+    return cv2.GaussianBlur(page, (0, 0), max(1.0, width / 800))
+
+
+PAGE_GENERATORS = {
+    "text": (_text_page, 1 / math.sqrt(2)),
+    "receipt": (_receipt_page, 0.5),
+    "photo": (_photo_page, 0.75),
+}
+
+
+def synthetic_capture(kind: str, megapixels: float, seed: int = 0) -> np.ndarray:
+    """A document of the given kind photographed at an angle on a desk."""
+    rng = np.random.default_rng([seed, DOCUMENT_KINDS.index(kind), int(megapixels * 10)])
+    cv2.setRNGSeed(seed)
+    frame_width, frame_height = _frame_size(megapixels)
+
+    generator, aspect = PAGE_GENERATORS[kind]
+    page_height = int(frame_height * 0.8)
+    page_width = int(page_height * aspect)
+    page = generator(rng, page_width, page_height)
+
+    # Desk: flat colour plus sensor noise
+    desk = np.empty((frame_height, frame_width, 3), np.uint8)
+    cv2.randu(desk, 0, 12)
+    desk += np.array([64, 79, 94], np.uint8)
+
+    # Random perspective (each corner jittered) and skew
+    center = np.array([frame_width / 2, frame_height / 2])
+    half = np.array([page_width / 2, page_height / 2])
+    corners = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]]) * half + center
+    corners += rng.uniform(-0.06, 0.06, size=(4, 2)) * [page_width, page_height]
+    angle = math.radians(rng.uniform(-6, 6))
+    rotation = np.array([[math.cos(angle), -math.sin(angle)], [math.sin(angle), math.cos(angle)]])
+    corners = (corners - center) @ rotation.T + center
+
+    source = np.float32([[0, 0], [page_width, 0], [page_width, page_height], [0, page_height]])
+    M = cv2.getPerspectiveTransform(source, np.float32(corners))
+    warped = cv2.warpPerspective(page, M, (frame_width, frame_height))
+    mask = cv2.warpPerspective(np.full((page_height, page_width), 255, np.uint8), M, (frame_width, frame_height))
+    np.copyto(desk, warped, where=(mask > 0)[:, :, None])
+    return desk
+
+
+def capture_data_url(image: np.ndarray) -> str:
+    ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, CAPTURE_JPEG_QUALITY])
+    if not ok:
+        raise ValueError("Could not encode synthetic capture")
+    return "data:image/jpeg;base64," + base64.b64encode(buffer).decode("ascii")
+
+
+# --- Measurement ----------------------------------------------------------
+
+def _percentile(samples: list[float], percent: float) -> float:
+    ordered = sorted(samples)
+    index = (len(ordered) - 1) * percent / 100
+    low, high = math.floor(index), math.ceil(index)
+    return ordered[low] + (ordered[high] - ordered[low]) * (index - low)
+
+
+def measure(func: Callable[[], Any], repeat: int) -> dict[str, float]:
+    """Time func `repeat` times, then run it once more under tracemalloc.
+
+    Peak memory covers Python and NumPy allocations (arrays OpenCV returns),
+    not OpenCV's internal scratch buffers. The warm-up also fills the
+    pipeline's workspace buffers, so it is the steady state of a pool worker.
+    """
+    func()  # warm-up
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "p50_ms": round(statistics.median(timings), 2),
+        "p95_ms": round(_percentile(timings, 95), 2),
+        "peak_mb": round(peak / MB, 1),
+    }
+
+
+def benchmark_capture(data_url: str, options: dict[str, Any], repeat: int) -> dict[str, dict[str, float]]:
+    """Time every stage on the previous stage's output, then end to end."""
+    max_dimension = options["detection_max_dimension"]
+    results = {}
+
+    image = decode_base64_image(data_url)
+    results["decode_base64_image"] = measure(lambda: decode_base64_image(data_url), repeat)
+
+    rotated = auto_rotate(image, max_dimension)
+    results["auto_rotate"] = measure(lambda: auto_rotate(image, max_dimension), repeat)
+
+    corners = detect_document(rotated, max_dimension)
+    results["detect_document"] = measure(lambda: detect_document(rotated, max_dimension), repeat)
+
+    if corners is not None:
+        cropped = four_point_transform(rotated, corners)
+        results["four_point_transform"] = measure(lambda: four_point_transform(rotated, corners), repeat)
+    else:
+        cropped = rotated
+
+    warp_args = (options["auto_crop"], options["auto_rotate_enabled"], max_dimension)
+    M, size = compute_warp(image, *warp_args)
+    results["compute_warp"] = measure(lambda: compute_warp(image, *warp_args), repeat)
+    if M is not None:
+        results["apply_warp"] = measure(lambda: apply_warp(image, M, size), repeat)
+
+    enhanced = enhance_document(cropped, options["doc_type"])
+    results["enhance_document"] = measure(lambda: enhance_document(cropped, options["doc_type"]), repeat)
+    tile_size = options["enhance_tile_size"]
+    results["enhance_document_tiled"] = measure(
+        lambda: enhance_document(cropped, options["doc_type"], tile_size), repeat
+    )
+
+    results["encode_image_to_base64"] = measure(lambda: encode_image_to_base64(enhanced), repeat)
+
+    results["process_document_image"] = measure(lambda: process_document_image(data_url, **options), repeat)
+    return results
+
+
+def run(sizes: list[float], kinds: list[str], repeat: int) -> dict[str, dict[str, float]]:
+    # End to end uses the default settings with enhancement switched on, so
+    # every stage is on the measured path.
+    options = deepcopy(DEFAULT_CONFIG["image_processing"])
+    options["enhance"] = True
+
+    results = {}
+    for megapixels in sizes:
+        for kind in kinds:
+            capture = synthetic_capture(kind, megapixels)
+            data_url = capture_data_url(capture)
+            del capture
+            print(f"{kind} @ {megapixels:g} MP ...", flush=True)
+            for stage, stats in benchmark_capture(data_url, options, repeat).items():
+                results[f"{kind}/{megapixels:g}MP/{stage}"] = stats
+    return results
+
+
+# --- Reporting --------------------------------------------------------------
+
+def compare(results: dict[str, dict[str, float]], baseline: dict[str, dict[str, float]],
+            threshold: float) -> list[str]:
+    """Names of the measurements whose p50 regressed beyond the threshold."""
+    regressions = []
+    for name, stats in results.items():
+        reference = baseline.get(name)
+        if reference and stats["p50_ms"] > reference["p50_ms"] * (1 + threshold):
+            regressions.append(name)
+    return regressions
+
+
+def print_report(results: dict[str, dict[str, float]], baseline: dict[str, dict[str, float]],
+                 regressions: list[str]) -> None:
+    header = f"{'measurement':<48} {'p50 ms':>10} {'p95 ms':>10} {'peak MB':>9} {'vs base':>9}"
+    print()
+    print(header)
+    print("-" * len(header))
+    for name, stats in results.items():
+        reference = baseline.get(name)
+        change = f"{(stats['p50_ms'] / reference['p50_ms'] - 1) * 100:+.0f}%" if reference else "-"
+        flag = "  REGRESSION" if name in regressions else ""
+        print(f"{name:<48} {stats['p50_ms']:>10.1f} {stats['p95_ms']:>10.1f} "
+              f"{stats['peak_mb']:>9.1f} {change:>9}{flag}")
+
+
+def machine_info() -> dict[str, Any]:
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "opencv_threads": cv2.getNumThreads(),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the image processing pipeline.")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES_MP),
+                        help="comma-separated capture sizes in megapixels (default: %(default)s)")
+    parser.add_argument("--kinds", default=",".join(DOCUMENT_KINDS),
+                        help="comma-separated document kinds (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help="timed runs per measurement (default: %(default)s)")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH,
+                        help="baseline JSON to compare against (default: %(default)s)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed p50 slowdown before failing, as a fraction (default: %(default)s)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="write these results as the new baseline")
+    parser.add_argument("--output", type=Path, help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    kinds = [kind.strip() for kind in args.kinds.split(",") if kind.strip()]
+    unknown = set(kinds) - set(DOCUMENT_KINDS)
+    if unknown:
+        parser.error(f"unknown document kinds: {', '.join(sorted(unknown))}")
+    sizes = [float(size) for size in args.sizes.split(",") if size.strip()]
+
+    # Repeated runs of the same capture must not be served from the cache
+    page_cache.disable_cache()
+
+    results = run(sizes, kinds, max(1, args.repeat))
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "machine": machine_info(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+
+    baseline = {}
+    if args.baseline.exists() and not args.save_baseline:
+        with args.baseline.open("r", encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+
+    regressions = compare(results, baseline, args.threshold)
+    print_report(results, baseline, regressions)
+
+    if args.output:
+        with args.output.open("w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
+            output_file.write("\n")
+
+    if args.save_baseline:
+        with args.baseline.open("w", encoding="utf-8") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+            baseline_file.write("\n")
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if not baseline:
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to record one.")
+        return 0
+    if regressions:
+        print(f"\n{len(regressions)} measurement(s) more than {args.threshold:.0%} slower than the baseline.")
+        return 1
+    print(f"\nNo regressions beyond {args.threshold:.0%}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
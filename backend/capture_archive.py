@@ -0,0 +1,145 @@
+# Raw captures kept next to the scans made from them (opt-in), so a scan can
+# be rendered again after the processing settings change instead of being
+# rescanned. Each saved scan gets <folder>/.captures/<name>/ holding the
+# uploads as page_NNN.bin and a capture.json manifest: the output kind, the
+# derived files, the phone's hints and the settings they were rendered with.
+# The derived files are a cache of (captures, settings); a scan is stale
+# when its settings_key no longer matches the current image_processing.
+
+import hashlib
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterator, Mapping
+
+from config import config_snapshot
+from storage import CAPTURES_DIRNAME, active_folder, scan_folder
+
+
+MANIFEST_NAME = "capture.json"
+# Per-page hint lists, in the form iter_processed_pages takes them
+HINT_KEYS = ("cropped", "corners", "angles")
+
+
+class CaptureNotFound(KeyError):
+    pass
+
+
+def archive_config() -> Mapping[str, Any]:
+    return config_snapshot()["capture_archive"]
+
+
+def settings_key(settings: dict[str, Any] | None) -> str | None:
+    if settings is None:
+        return None
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def captures_root(folder: Path) -> Path:
+    return folder / CAPTURES_DIRNAME
+
+
+def page_path(directory: Path, index: int) -> Path:
+    return directory / f"page_{index:03d}.bin"
+
+
+def output_folder(directory: Path) -> Path:
+    """Folder holding the scan files derived from a capture directory."""
+    return directory.parent.parent
+
+
+def resolve_folder(folder: str | None = None) -> Path:
+    """A folder inside the active folder (the scan folder by default)."""
+    path = Path(folder).expanduser() if folder else scan_folder()
+    resolved = path.resolve()
+    if not resolved.is_relative_to(active_folder().resolve()):
+        raise ValueError("Folder must be inside the active folder")
+    return resolved
+
+
+def read_manifest(directory: Path) -> dict[str, Any] | None:
+    try:
+        with (directory / MANIFEST_NAME).open("r", encoding="utf-8") as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, json.JSONDecodeError):
+        return None
+    return manifest if isinstance(manifest, dict) else None
+
+
+def write_manifest(directory: Path, manifest: dict[str, Any]) -> None:
+    manifest_path = directory / MANIFEST_NAME
+    temp_path = manifest_path.with_suffix(".tmp")
+    with temp_path.open("w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, ensure_ascii=False)
+        manifest_file.write("\n")
+    temp_path.replace(manifest_path)
+
+
+def load_pages(directory: Path, manifest: dict[str, Any]) -> list[bytes]:
+    return [page_path(directory, index).read_bytes() for index in range(1, manifest["pages"] + 1)]
+
+
+def iter_captures(folder: Path) -> Iterator[tuple[Path, dict[str, Any]]]:
+    """Capture directories of a folder with their manifests, oldest first."""
+    root = captures_root(folder)
+    if not root.is_dir():
+        return
+    for directory in sorted(root.iterdir()):
+        manifest = read_manifest(directory) if directory.is_dir() else None
+        if manifest is not None:
+            yield directory, manifest
+
+
+def find_capture(path: Path) -> Path:
+    """Capture directory that a derived scan file was rendered from."""
+    for directory, manifest in iter_captures(path.parent):
+        if path.name in manifest["files"]:
+            return directory
+    raise CaptureNotFound(str(path))
+
+
+def _capture_name(result: dict[str, Any]) -> str:
+    if "file" in result:
+        return Path(result["file"]).stem
+    return f"doc_{result['timestamp']}"
+
+
+def keep_capture(result: dict[str, Any], output: str, pages: list[bytes], data: dict[str, Any],
+                 settings: dict[str, Any] | None) -> None:
+    """Archive the uploads behind a saved scan, when capture_archive is on.
+
+    ``data`` holds the per-page hint lists; ``settings`` is the
+    image_processing config the scan was rendered with (None if unknown,
+    which marks it stale). The scan is already saved, so a failure here is
+    only reported.
+    """
+    if not archive_config()["enabled"]:
+        return
+    files = [Path(result["file"])] if "file" in result else [Path(path) for path in result["files"]]
+    directory = captures_root(files[0].parent) / _capture_name(result)
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        for index, page in enumerate(pages, start=1):
+            page_path(directory, index).write_bytes(page)
+        write_manifest(directory, {
+            "output": output,
+            "pages": len(pages),
+            "files": [path.name for path in files],
+            "data": {key: data.get(key) for key in HINT_KEYS},
+            "settings": settings,
+            "settings_key": settings_key(settings),
+            "rendered_at": datetime.now().isoformat(timespec="seconds"),
+        })
+    except OSError as exc:
+        print(f"Could not keep the captures of {directory.name}: {exc}")
+
+
+def capture_summary(directory: Path, manifest: dict[str, Any], current_key: str | None) -> dict[str, Any]:
+    return {
+        "name": directory.name,
+        "output": manifest["output"],
+        "pages": manifest["pages"],
+        "files": manifest["files"],
+        "rendered_at": manifest.get("rendered_at"),
+        "stale": manifest.get("settings_key") != current_key,
+    }
@@ -1,7 +1,10 @@
 import json
+import os
+import threading
 from copy import deepcopy
 from pathlib import Path
-from typing import Any
+from types import MappingProxyType
+from typing import Any, Mapping, NamedTuple
 
 
 BACKEND_DIR = Path(__file__).resolve().parent
@@ -30,6 +33,57 @@ DEFAULT_CONFIG: dict[str, Any] = {
         "doc_type": "mixed",
         "auto_crop": True,
         "auto_rotate_enabled": True,
+        "detection_max_dimension": 1000,
+        "enhance_tile_size": 1024,
+    },
+    "quality_gate": {
+        "min_sharpness": 50,
+        "min_brightness": 70,
+        "max_brightness": 245,
+        "max_highlight_clipping": 0.02,
+        "max_shadow_clipping": 0.3,
+        "require_document": False,
+    },
+    "capture_archive": {
+        "enabled": False,
+        "rerender_on_change": True,
+        "workers": 2,
+    },
+    "dedup": {
+        "mode": "link",
+        "hash_workers": 4,
+    },
+    "folder_watcher": {
+        "enabled": True,
+        "backend": "auto",
+        "debounce_ms": 300,
+        "max_delay_ms": 2000,
+        "poll_interval_ms": 1000,
+    },
+    "processing_pool": {
+        "workers": 0,
+        "opencv_threads": 1,
+    },
+    "scan_queue": {
+        "workers": 2,
+        "max_queue": 8,
+    },
+    "scan_sessions": {
+        "max_pages": 200,
+        "max_processing": 0,
+    },
+    "detection_service": {
+        "workers": 1,
+        "max_batch": 8,
+        "max_wait_ms": 4,
+        "latency_budget_ms": 250,
+        "max_pending": 64,
+        "max_dimension": 480,
+    },
+    "page_cache": {
+        "enabled": True,
+        "memory_mb": 256,
+        "disk_mb": 1024,
     },
     "sources": {
         "scanner": {"enabled": True, "subfolder": "scans"},
@@ -51,38 +105,113 @@ def _deep_merge(base: dict[str, Any], overrides: dict[str, Any]) -> dict[str, An
     return merged
 
 
-def load_config() -> dict[str, Any]:
-    if not CONFIG_PATH.exists():
+class ConfigSnapshot(NamedTuple):
+    # (mtime_ns, size, inode) of config.json when it was read
+    stamp: tuple[int, int, int] | None
+    config: Mapping[str, Any]
+
+
+# Process-wide read-only copy of the merged config; config.json is only read
+# again once its stamp changes. The lock serialises reloads and
+# read-modify-write updates.
+_snapshot: ConfigSnapshot | None = None
+_lock = threading.RLock()
+
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _thaw(value: Any) -> Any:
+    if isinstance(value, Mapping):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+
+def _stamp() -> tuple[int, int, int] | None:
+    try:
+        stat = CONFIG_PATH.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def _reload() -> ConfigSnapshot:
+    # Caller holds the lock
+    global _snapshot
+    stamp = _stamp()
+    if _snapshot is not None and _snapshot.stamp == stamp:
+        return _snapshot
+    if stamp is None:
         save_config(DEFAULT_CONFIG)
-        return deepcopy(DEFAULT_CONFIG)
+        return _snapshot
 
-    with CONFIG_PATH.open("r", encoding="utf-8") as config_file:
-        loaded = json.load(config_file)
+    try:
+        with CONFIG_PATH.open("r", encoding="utf-8") as config_file:
+            loaded = json.load(config_file)
+    except (OSError, json.JSONDecodeError) as exc:
+        if _snapshot is None:
+            raise
+        # A hand edit gone wrong: keep running on the last good settings
+        print(f"Could not read {CONFIG_PATH}, keeping the previous settings: {exc}")
+        _snapshot = ConfigSnapshot(stamp, _snapshot.config)
+        return _snapshot
+
+    _snapshot = ConfigSnapshot(stamp, _freeze(_deep_merge(DEFAULT_CONFIG, loaded)))
+    return _snapshot
+
+
+def config_snapshot() -> Mapping[str, Any]:
+    """Read-only view of the current config (nested sections are read-only
+    mappings, lists are tuples). Costs a stat of config.json; the file is
+    only parsed again when its mtime, size or inode changed."""
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.stamp == _stamp():
+        return snapshot.config
+    with _lock:
+        return _reload().config
 
-    return _deep_merge(DEFAULT_CONFIG, loaded)
+
+def load_config() -> dict[str, Any]:
+    """Mutable copy of the current config."""
+    return _thaw(config_snapshot())
 
 
 def save_config(config: dict[str, Any]) -> dict[str, Any]:
+    global _snapshot
     merged = _deep_merge(DEFAULT_CONFIG, config)
-    CONFIG_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with CONFIG_PATH.open("w", encoding="utf-8") as config_file:
-        json.dump(merged, config_file, indent=2)
-        config_file.write("\n")
+    with _lock:
+        CONFIG_PATH.parent.mkdir(parents=True, exist_ok=True)
+        # Write aside and rename over, so no reader ever sees a partial file
+        temp_path = CONFIG_PATH.with_name(f"{CONFIG_PATH.name}.{os.getpid()}.tmp")
+        with temp_path.open("w", encoding="utf-8") as config_file:
+            json.dump(merged, config_file, indent=2)
+            config_file.write("\n")
+        temp_path.replace(CONFIG_PATH)
+        _snapshot = ConfigSnapshot(_stamp(), _freeze(merged))
     return merged
 
 
 def update_config(updates: dict[str, Any]) -> dict[str, Any]:
-    current = load_config()
-    updated = _deep_merge(current, updates)
-    return save_config(updated)
+    with _lock:
+        current = load_config()
+        updated = _deep_merge(current, updates)
+        return save_config(updated)
 
 
 def get_image_processing_config() -> dict[str, Any]:
-    return load_config()["image_processing"]
+    return _thaw(config_snapshot()["image_processing"])
 
 
 def update_image_processing_config(updates: dict[str, Any]) -> dict[str, Any]:
-    config = load_config()
-    image_processing = config["image_processing"]
-    image_processing.update(updates)
-    return save_config(config)["image_processing"]
+    with _lock:
+        config = load_config()
+        image_processing = config["image_processing"]
+        image_processing.update(updates)
+        return save_config(config)["image_processing"]
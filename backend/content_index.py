@@ -0,0 +1,183 @@
+# Content hashes (SHA-256) of the documents under the active folder, used to
+# catch invoices that arrive twice: by Outlook attachment and from a provider
+# portal, or again when a job is re-run. Hashes are cached in the file index
+# next to each file's size and mtime and are only trusted while both still
+# match, so a file is hashed once until it changes. Only files that share
+# their size with another one can be duplicates; nothing else is hashed.
+
+import hashlib
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Collection, Mapping
+
+import file_index
+from config import config_snapshot
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# What happens to a file whose content the folder already has elsewhere
+# (a duplicate in the same folder, e.g. invoice_2.pdf, is always skipped)
+DEDUP_MODES = ("link", "skip", "off")
+
+
+def dedup_config() -> Mapping[str, Any]:
+    return config_snapshot()["dedup"]
+
+
+def hash_bytes(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as source:
+        while chunk := source.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _current_hash(row: tuple[str, int, int, str | None]) -> tuple[str, int, int, str] | None:
+    """(path, size, mtime_ns, sha256) of a file as it is on disk now; the
+    cached hash is reused while size and mtime still match. None if the
+    file is gone."""
+    path, size, mtime_ns, digest = row
+    try:
+        stat = os.stat(path)
+        if digest is None or (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+            digest = hash_file(Path(path))
+            # A rewrite while hashing would leave a hash of mixed content
+            if os.stat(path).st_mtime_ns != stat.st_mtime_ns:
+                return None
+    except OSError:
+        return None
+    return path, stat.st_size, stat.st_mtime_ns, digest
+
+
+def current_hashes(rows: list[tuple[str, int, int, str | None]]) -> list[tuple[str, int, int, str]]:
+    """Hash the given index rows where needed (in parallel; hashlib and file
+    reads release the GIL) and cache the new hashes."""
+    workers = max(1, int(dedup_config()["hash_workers"]))
+    if workers > 1 and sum(row[3] is None for row in rows) > 1:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hash") as executor:
+            hashed = list(executor.map(_current_hash, rows))
+    else:
+        hashed = [_current_hash(row) for row in rows]
+    current = [entry for entry in hashed if entry is not None]
+    cached = {(path, size, mtime_ns, digest) for path, size, mtime_ns, digest in rows}
+    file_index.store_hashes([entry for entry in current if entry not in cached])
+    return current
+
+
+def partial_path(destination: Path) -> Path:
+    """Where to write a file meant for destination before it is complete.
+    Not a document name, so neither the index nor the watcher see it."""
+    return destination.with_name(f".{destination.name}.part")
+
+
+def find_copy(root: Path, digest: str, size: int, near: Path | None = None,
+              exclude: Collection[Path] = ()) -> Path | None:
+    """A file under root with exactly this content, if there is one;
+    ``near`` itself or a file in its folder if possible. Paths in
+    ``exclude`` never count as a copy."""
+    copies = [Path(path) for path, _, _, other in current_hashes(file_index.files_with_size(root, size))
+              if other == digest and Path(path) not in exclude]
+    if near is not None:
+        copies.sort(key=lambda path: (path != near, path.parent != near.parent))
+    return copies[0] if copies else None
+
+
+def _place(root: Path, destination: Path, digest: str, size: int, write: Callable[[], None],
+           exclude: Collection[Path] = ()) -> dict[str, Any]:
+    mode = dedup_config()["mode"]
+    if mode not in DEDUP_MODES:
+        raise ValueError(f"dedup.mode must be one of: {', '.join(DEDUP_MODES)}")
+
+    copy = None
+    if mode != "off" and file_index.is_indexed(root, destination):
+        copy = find_copy(root, digest, size, near=destination, exclude=exclude)
+    # Includes the destination itself already holding this content
+    if copy is not None and (mode == "skip" or copy.parent == destination.parent):
+        return {"path": copy, "action": "skipped", "duplicate_of": str(copy)}
+
+    action = "written"
+    if copy is not None and not destination.exists():
+        try:
+            os.link(copy, destination)
+            action = "linked"
+        except OSError as exc:
+            # e.g. FAT volumes, or the copy is on another drive
+            print(f"Could not hard-link {destination.name} to {copy}, writing a copy: {exc}")
+    if action == "written":
+        write()
+    file_index.record(root, destination)
+    stat = destination.stat()
+    file_index.store_hashes([(str(destination), stat.st_size, stat.st_mtime_ns, digest)])
+    return {"path": destination, "action": action, "duplicate_of": str(copy) if copy is not None else None}
+
+
+def place_file(root: Path, temp_path: Path, destination: Path) -> dict[str, Any]:
+    """Move a just-downloaded file to its destination, unless root already
+    holds the same content: then it is skipped (same folder, or mode
+    "skip") or the destination becomes a hard link to the existing copy.
+
+    Returns ``path`` (where the content now is), ``action`` (written,
+    linked or skipped) and ``duplicate_of``. The temporary file is gone
+    afterwards either way.
+    """
+    try:
+        result = _place(
+            root, destination, hash_file(temp_path), temp_path.stat().st_size,
+            lambda: temp_path.replace(destination),
+        )
+    finally:
+        temp_path.unlink(missing_ok=True)
+    return result
+
+
+def place_bytes(root: Path, content: bytes, destination: Path, exclude: Collection[Path] = ()) -> dict[str, Any]:
+    """place_file for content already in memory. Files in ``exclude`` (e.g.
+    the earlier pages of the same save) are not taken as existing copies."""
+
+    def write() -> None:
+        # Written aside and renamed over, so a destination hard-linked to
+        # other files is replaced rather than changed for all of them
+        partial = partial_path(destination)
+        partial.write_bytes(content)
+        partial.replace(destination)
+
+    return _place(root, destination, hash_bytes(content), len(content), write, exclude)
+
+
+def duplicate_report(root: Path) -> dict[str, Any]:
+    """Groups of files under root with identical content, largest waste
+    first. Files hard-linked to each other take no extra space, so they do
+    not count as wasted."""
+    groups: dict[str, list[tuple[str, int, os.stat_result]]] = defaultdict(list)
+    for path, size, _, digest in current_hashes(file_index.files_sharing_size(root)):
+        try:
+            groups[digest].append((path, size, os.stat(path)))
+        except OSError:
+            continue
+
+    duplicates = [(digest, members) for digest, members in groups.items() if len(members) > 1]
+    described = file_index.describe_files(root, [path for _, members in duplicates for path, _, _ in members])
+    report = []
+    for digest, members in duplicates:
+        size = members[0][1]
+        copies = len({(stat.st_dev, stat.st_ino) for _, _, stat in members})
+        report.append({
+            "sha256": digest,
+            "size": size,
+            "copies": copies,
+            "wasted_bytes": size * (copies - 1),
+            "files": [described[path] for path, _, _ in members if path in described],
+        })
+    report.sort(key=lambda group: (-group["wasted_bytes"], group["sha256"]))
+    return {
+        "active_folder": str(root),
+        "groups": report,
+        "duplicate_files": sum(len(group["files"]) - 1 for group in report),
+        "wasted_bytes": sum(group["wasted_bytes"] for group in report),
+    }
@@ -0,0 +1,187 @@
+# Micro-batched document detection for the phone's live preview, for phones
+# that cannot run (or are still loading) the in-browser model. Phones post
+# small JPEG thumbnails; frames that arrive within a few milliseconds of each
+# other are taken as one batch by the detection threads. A client's older
+# frames are dropped once a newer one is waiting, and frames that waited past
+# the latency budget are answered as expired instead of being processed late,
+# so a slow moment never builds a backlog.
+
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any
+
+import numpy as np
+
+from config import config_snapshot
+from image_processor import decode_image_proxy, detect_document, order_points
+from metrics import DETECT_BATCH_SIZE, DETECT_FRAMES, gauge_lines, registry, span
+from scan_output import UnreadablePageError
+
+
+_service: "DetectionService | None" = None
+_service_lock = threading.Lock()
+
+
+class DetectionBusy(RuntimeError):
+    def __init__(self):
+        super().__init__("Too many preview frames waiting for detection.")
+        self.retry_after = 1
+
+
+@dataclass
+class _Frame:
+    img_bytes: bytes
+    client: str | None
+    future: Future = field(default_factory=Future)
+    received_at: float = field(default_factory=time.monotonic)
+
+
+def detect_frame(img_bytes: bytes, max_dimension: int) -> dict[str, Any]:
+    """Corners of the document in a preview frame, as four [x, y] points
+    (top-left, top-right, bottom-right, bottom-left) normalized to 0..1 like
+    the phone's own detector, or None."""
+    with span("detect_frame"):
+        image = decode_image_proxy(img_bytes, max_dimension)
+        if image is None:
+            raise UnreadablePageError("Frame is not a readable image")
+        corners = detect_document(image, max_dimension)
+    height, width = image.shape[:2]
+    if corners is not None:
+        corners = np.round(order_points(corners.astype("float32")) / [width - 1, height - 1], 4).tolist()
+    return {"status": "ok", "corners": corners, "width": width, "height": height}
+
+
+class DetectionService:
+    """Collects concurrent frames into batches of up to ``max_batch``,
+    waiting at most ``max_wait`` seconds after the first one.
+
+    OpenCV's contour detection has no batched form, so a batch is worked
+    through on the detection threads; what batching buys is one wake-up per
+    batch, bounded concurrency however many phones are streaming, and a
+    point at which stale frames are dropped.
+    """
+
+    def __init__(self, workers: int, max_batch: int, max_wait: float, latency_budget: float,
+                 max_pending: int, max_dimension: int):
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.latency_budget = latency_budget
+        self.max_pending = max_pending
+        self.max_dimension = max_dimension
+        self._pending: deque[_Frame] = deque()
+        # Newest frame seen per client; older ones are superseded
+        self._latest: dict[str, _Frame] = {}
+        self._condition = threading.Condition()
+        self._threads: list[threading.Thread] = []
+
+    def _start(self) -> None:
+        # Caller holds the condition
+        if not self._threads:
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"detect-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, img_bytes: bytes, client: str | None = None) -> Future:
+        frame = _Frame(img_bytes, client)
+        with self._condition:
+            if len(self._pending) >= self.max_pending:
+                raise DetectionBusy()
+            self._start()
+            self._pending.append(frame)
+            if client is not None:
+                self._latest[client] = frame
+            self._condition.notify()
+        if client is not None:
+            # However the frame ends (answered, failed or cancelled), it
+            # stops being its client's latest
+            frame.future.add_done_callback(lambda _: self._forget(frame))
+        return frame.future
+
+    def _forget(self, frame: _Frame) -> None:
+        with self._condition:
+            if self._latest.get(frame.client) is frame:
+                del self._latest[frame.client]
+
+    async def detect(self, img_bytes: bytes, client: str | None = None) -> dict[str, Any]:
+        return await asyncio.wrap_future(self.submit(img_bytes, client))
+
+    def _next_batch(self) -> list[_Frame]:
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            # Let frames arriving right behind the first one join its batch
+            deadline = self._pending[0].received_at + self.max_wait
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return [self._pending.popleft() for _ in range(min(self.max_batch, len(self._pending)))]
+
+    def _superseded(self, frame: _Frame) -> bool:
+        if frame.client is None:
+            return False
+        with self._condition:
+            latest = self._latest.get(frame.client)
+            return latest is not None and latest is not frame
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            DETECT_BATCH_SIZE.observe(len(batch))
+            for frame in batch:
+                if not frame.future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    if self._superseded(frame):
+                        result = {"status": "superseded", "corners": None}
+                    elif time.monotonic() - frame.received_at > self.latency_budget:
+                        result = {"status": "expired", "corners": None}
+                    else:
+                        result = detect_frame(frame.img_bytes, self.max_dimension)
+                except BaseException as exc:
+                    frame.future.set_exception(exc)
+                    continue
+                if result["status"] == "ok":
+                    DETECT_FRAMES.inc(result="detected" if result["corners"] else "none")
+                else:
+                    DETECT_FRAMES.inc(result=result["status"])
+                frame.future.set_result(result)
+
+    def pending(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+
+def get_detection_service() -> DetectionService:
+    global _service
+    with _service_lock:
+        if _service is None:
+            service_config = config_snapshot()["detection_service"]
+            _service = DetectionService(
+                workers=max(1, int(service_config["workers"])),
+                max_batch=max(1, int(service_config["max_batch"])),
+                max_wait=max(0.0, float(service_config["max_wait_ms"])) / 1000,
+                latency_budget=max(0.0, float(service_config["latency_budget_ms"])) / 1000,
+                max_pending=max(1, int(service_config["max_pending"])),
+                max_dimension=max(1, int(service_config["max_dimension"])),
+            )
+        return _service
+
+
+def _collect_metrics():
+    service = _service
+    yield from gauge_lines(
+        "scanner_detect_pending",
+        "Preview frames waiting for a detection batch.",
+        [({}, service.pending() if service is not None else 0)],
+    )
+
+
+registry.add_collector(_collect_metrics)
@@ -0,0 +1,532 @@
+# Persistent index of the document files under the active folder (SQLite in
+# the backend dir), so listings are an indexed query instead of a full walk
+# with a stat() per file. Refreshing is incremental: every directory is
+# stat()ed, but only those whose mtime changed since the last refresh are
+# listed again. Files the server writes itself are recorded as they are
+# written, so they show up without waiting for a refresh. (A file rewritten
+# in place by something else keeps its old size and date in the index until
+# its directory changes.)
+#
+# Every change bumps a generation counter; rows remember the generation that
+# last changed them and removed files leave a tombstone, so clients can ask
+# for what changed since the generation they last saw. Rows also cache the
+# file's SHA-256 (see content_index); a changed row loses it. Rows are keyed
+# by (root, path): a folder nested in another indexed folder is indexed once
+# for each root.
+
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from config import BACKEND_DIR, config_snapshot
+
+
+DOCUMENT_EXTENSIONS = {
+    ".bmp",
+    ".gif",
+    ".jpeg",
+    ".jpg",
+    ".pdf",
+    ".png",
+    ".tif",
+    ".tiff",
+    ".webp",
+}
+# Raw captures kept next to the scans made from them (see capture_archive)
+CAPTURES_DIRNAME = ".captures"
+INDEX_PATH = BACKEND_DIR / "file_index.sqlite3"
+# Bumped whenever the tables change; an index with another version is
+# rebuilt from scratch (it is only a cache of the folder)
+SCHEMA_VERSION = 5
+# Listings refresh the index at most this often; our own writes are
+# recorded immediately regardless
+REFRESH_INTERVAL_SECONDS = 2.0
+# A directory modified this recently may still change within the same mtime
+# tick (FAT and some network shares have coarse timestamps), so it is listed
+# again on the next refresh rather than trusted
+RACY_MTIME_NS = 2_000_000_000
+# Tombstones kept for deltas; clients further behind get a reset
+MAX_TOMBSTONES = 5000
+# Deltas larger than this are answered with a reset instead
+MAX_DELTA_FILES = 1000
+
+# Sort name -> column; ties are broken by path
+SORT_COLUMNS = {"modified": "mtime_ns", "name": "name", "size": "size"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT NOT NULL,
+    root TEXT NOT NULL,
+    dir TEXT NOT NULL,
+    top TEXT NOT NULL,
+    name TEXT NOT NULL,
+    extension TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    generation INTEGER NOT NULL,
+    sha256 TEXT,
+    PRIMARY KEY (root, path)
+);
+CREATE INDEX IF NOT EXISTS files_modified ON files (root, mtime_ns, path);
+CREATE INDEX IF NOT EXISTS files_name ON files (root, name, path);
+CREATE INDEX IF NOT EXISTS files_size ON files (root, size, path);
+CREATE INDEX IF NOT EXISTS files_top ON files (root, top, mtime_ns, path);
+CREATE INDEX IF NOT EXISTS files_dir ON files (root, dir);
+CREATE INDEX IF NOT EXISTS files_path ON files (path);
+CREATE INDEX IF NOT EXISTS files_generation ON files (root, generation);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT NOT NULL,
+    root TEXT NOT NULL,
+    parent TEXT,
+    mtime_ns INTEGER NOT NULL,
+    PRIMARY KEY (root, path)
+);
+CREATE INDEX IF NOT EXISTS dirs_path ON dirs (path);
+CREATE TABLE IF NOT EXISTS removed (
+    path TEXT NOT NULL,
+    root TEXT NOT NULL,
+    generation INTEGER NOT NULL,
+    PRIMARY KEY (root, path)
+);
+CREATE INDEX IF NOT EXISTS removed_generation ON removed (root, generation);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+_FILE_COLUMNS = "path, name, extension, size, mtime_ns, top"
+
+_local = threading.local()
+# Serialises writers; SQLite would otherwise answer concurrent ones with
+# "database is locked". Reentrant because opening a connection may rebuild
+# the tables while a writer holds it
+_write_lock = threading.RLock()
+_refreshed_at: dict[str, float] = {}
+# Folders a watcher keeps current (see folder_watcher); listings skip their
+# own refresh for these
+_watched: set[str] = set()
+
+
+@dataclass(frozen=True)
+class FileQuery:
+    """Filter and order for a listing."""
+    source: str | None = None
+    extensions: tuple[str, ...] = ()
+    # Only files directly in this folder
+    directory: str | None = None
+    sort: str = "modified"
+    descending: bool = True
+
+    def __post_init__(self):
+        if self.sort not in SORT_COLUMNS:
+            raise ValueError(f"sort must be one of: {', '.join(SORT_COLUMNS)}")
+
+
+def _create(conn: sqlite3.Connection) -> None:
+    conn.executescript(
+        "DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS dirs;"
+        "DROP TABLE IF EXISTS removed; DROP TABLE IF EXISTS meta;"
+    )
+    conn.executescript(_SCHEMA)
+    # Generations start from the clock, so they keep increasing across a
+    # rebuild and clients holding an older one are told to reset
+    start = time.time_ns() // 1_000_000
+    with conn:
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", [("generation", start), ("removed_floor", start)])
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def _connection() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != INDEX_PATH:
+        INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(INDEX_PATH, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with _write_lock:
+            if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                _create(conn)
+        _local.conn = conn
+        _local.path = INDEX_PATH
+    return conn
+
+
+def _meta(conn: sqlite3.Connection, key: str) -> int:
+    return conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()[0]
+
+
+class _Changes:
+    """Writes made in one transaction; they all share one new generation,
+    taken only once something actually changes."""
+
+    def __init__(self, conn: sqlite3.Connection, root: str):
+        self.conn = conn
+        self.root = root
+        self.generation: int | None = None
+
+    def _next(self) -> int:
+        if self.generation is None:
+            self.generation = _meta(self.conn, "generation") + 1
+            self.conn.execute("UPDATE meta SET value = ? WHERE key = 'generation'", (self.generation,))
+        return self.generation
+
+    def upsert(self, row: tuple) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (*row, self._next(), None)
+        )
+        self.conn.execute("DELETE FROM removed WHERE root = ? AND path = ?", (self.root, row[0]))
+
+    def remove(self, path: str) -> None:
+        self.conn.execute("DELETE FROM files WHERE root = ? AND path = ?", (self.root, path))
+        self.conn.execute("INSERT OR REPLACE INTO removed VALUES (?, ?, ?)", (path, self.root, self._next()))
+
+    def prune(self) -> None:
+        if self.generation is None:
+            return
+        row = self.conn.execute(
+            "SELECT generation FROM removed ORDER BY generation DESC LIMIT 1 OFFSET ?", (MAX_TOMBSTONES,)
+        ).fetchone()
+        if row is not None:
+            self.conn.execute("DELETE FROM removed WHERE generation <= ?", row)
+            self.conn.execute("UPDATE meta SET value = MAX(value, ?) WHERE key = 'removed_floor'", row)
+
+
+def _file_row(root: str, path: str, top: str, stat: os.stat_result) -> tuple:
+    name = os.path.basename(path)
+    return (path, root, os.path.dirname(path), top, name, os.path.splitext(name)[1].lower(),
+            stat.st_size, stat.st_mtime_ns)
+
+
+def _top(root: str, directory: str) -> str:
+    """First path component below the root ('' for files in the root)."""
+    relative = os.path.relpath(directory, root)
+    return "" if relative == "." else relative.split(os.sep, 1)[0]
+
+
+def _scan_directory(root: str, directory: str) -> tuple[list[tuple], list[str]]:
+    files, subdirs = [], []
+    top = _top(root, directory)
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != CAPTURES_DIRNAME:
+                        subdirs.append(entry.path)
+                elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in DOCUMENT_EXTENSIONS:
+                    files.append(_file_row(root, entry.path, top, entry.stat()))
+            except OSError:
+                # Vanished or unreadable while listing
+                continue
+    return files, subdirs
+
+
+def _sync_directory(changes: _Changes, directory: str, files: list[tuple]) -> None:
+    existing = {
+        path: (size, mtime_ns)
+        for path, size, mtime_ns in changes.conn.execute(
+            "SELECT path, size, mtime_ns FROM files WHERE root = ? AND dir = ?", (changes.root, directory)
+        )
+    }
+    for row in files:
+        if existing.pop(row[0], None) != (row[6], row[7]):
+            changes.upsert(row)
+    for path in existing:
+        changes.remove(path)
+
+
+def refresh(root: Path) -> int:
+    """Bring the index for a folder up to date; returns how many
+    directories had to be listed again."""
+    root_path = str(root)
+    with _write_lock:
+        conn = _connection()
+        known = dict(conn.execute("SELECT path, mtime_ns FROM dirs WHERE root = ?", (root_path,)))
+        children: dict[str, list[str]] = {}
+        for path, parent in conn.execute("SELECT path, parent FROM dirs WHERE root = ?", (root_path,)):
+            children.setdefault(parent, []).append(path)
+
+        seen = set()
+        rescanned = 0
+        stack = [root_path]
+        now = time.time_ns()
+        with conn:
+            changes = _Changes(conn, root_path)
+            while stack:
+                directory = stack.pop()
+                try:
+                    mtime_ns = os.stat(directory).st_mtime_ns
+                    if known.get(directory) == mtime_ns:
+                        seen.add(directory)
+                        stack.extend(children.get(directory, []))
+                        continue
+                    files, subdirs = _scan_directory(root_path, directory)
+                except OSError:
+                    continue
+                seen.add(directory)
+                rescanned += 1
+                _sync_directory(changes, directory, files)
+                if now - mtime_ns < RACY_MTIME_NS:
+                    mtime_ns = -1
+                parent = os.path.dirname(directory) if directory != root_path else None
+                conn.execute(
+                    "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)",
+                    (directory, root_path, parent, mtime_ns),
+                )
+                stack.extend(subdirs)
+
+            # Directories that disappeared (or are no longer reachable)
+            for directory in known.keys() - seen:
+                conn.execute("DELETE FROM dirs WHERE root = ? AND path = ?", (root_path, directory))
+                _sync_directory(changes, directory, [])
+            changes.prune()
+    _refreshed_at[root_path] = time.monotonic()
+    return rescanned
+
+
+def set_watched(root: Path, watched: bool) -> None:
+    if watched:
+        _watched.add(str(root))
+    else:
+        _watched.discard(str(root))
+
+
+def is_watched(root: Path) -> bool:
+    return str(root) in _watched
+
+
+def _ensure_fresh(root: str) -> None:
+    if root in _watched:
+        return
+    refreshed_at = _refreshed_at.get(root)
+    if refreshed_at is None or time.monotonic() - refreshed_at >= REFRESH_INTERVAL_SECONDS:
+        refresh(Path(root))
+
+
+def is_indexed(root: Path, path: Path) -> bool:
+    """Whether files at this path belong in the index of root."""
+    return path.is_relative_to(root) and CAPTURES_DIRNAME not in path.relative_to(root).parts
+
+
+def is_known_directory(path: str) -> bool:
+    """Whether the index has this path as a directory (of any root); tells
+    a deleted directory apart from a deleted file."""
+    return _connection().execute("SELECT 1 FROM dirs WHERE path = ? LIMIT 1", (path,)).fetchone() is not None
+
+
+def record(root: Path, path: Path) -> None:
+    """Index a document file just written under root (by the server, or
+    rewritten in place as reported by a watcher)."""
+    if not is_indexed(root, path) or path.suffix.lower() not in DOCUMENT_EXTENSIONS:
+        return
+    try:
+        stat = path.stat()
+    except OSError:
+        return
+    if not path.is_file():
+        return
+    with _write_lock:
+        conn = _connection()
+        existing = conn.execute(
+            "SELECT size, mtime_ns FROM files WHERE root = ? AND path = ?", (str(root), str(path))
+        ).fetchone()
+        if existing == (stat.st_size, stat.st_mtime_ns):
+            return
+        with conn:
+            _Changes(conn, str(root)).upsert(
+                _file_row(str(root), str(path), _top(str(root), str(path.parent)), stat)
+            )
+
+
+def forget(root: Path, path: Path) -> None:
+    """Drop a file the server has just removed from the index."""
+    if not is_indexed(root, path):
+        return
+    with _write_lock:
+        conn = _connection()
+        with conn:
+            if conn.execute("SELECT 1 FROM files WHERE root = ? AND path = ?", (str(root), str(path))).fetchone():
+                _Changes(conn, str(root)).remove(str(path))
+
+
+def generation(root: Path) -> int:
+    """Current generation, after refreshing the index if it is due."""
+    _ensure_fresh(str(root))
+    return _meta(_connection(), "generation")
+
+
+def files_with_size(root: Path, size: int) -> list[tuple[str, int, int, str | None]]:
+    """(path, size, mtime_ns, sha256) of the files of exactly this size."""
+    root = str(root)
+    _ensure_fresh(root)
+    return _connection().execute(
+        "SELECT path, size, mtime_ns, sha256 FROM files WHERE root = ? AND size = ? ORDER BY path",
+        (root, size),
+    ).fetchall()
+
+
+def files_sharing_size(root: Path) -> list[tuple[str, int, int, str | None]]:
+    """(path, size, mtime_ns, sha256) of the non-empty files whose size
+    another file has too; only these can have a duplicate."""
+    root = str(root)
+    _ensure_fresh(root)
+    return _connection().execute(
+        "SELECT path, size, mtime_ns, sha256 FROM files WHERE root = ? AND size > 0 AND size IN "
+        "(SELECT size FROM files WHERE root = ? GROUP BY size HAVING COUNT(*) > 1) ORDER BY size, path",
+        (root, root),
+    ).fetchall()
+
+
+def store_hashes(hashes: list[tuple[str, int, int, str]]) -> None:
+    """Cache (path, size, mtime_ns, sha256); ignored for rows that changed
+    in the meantime. Not a change of the folder, so no new generation."""
+    if not hashes:
+        return
+    with _write_lock:
+        conn = _connection()
+        with conn:
+            conn.executemany(
+                "UPDATE files SET sha256 = ? WHERE path = ? AND size = ? AND mtime_ns = ?",
+                [(digest, path, size, mtime_ns) for path, size, mtime_ns, digest in hashes],
+            )
+
+
+def _source_top(source: str) -> str:
+    source_config = config_snapshot().get("sources", {}).get(source, {})
+    return source_config.get("subfolder", source)
+
+
+def _sources_by_top() -> dict[str, str]:
+    return {
+        source_config.get("subfolder", source): source
+        for source, source_config in config_snapshot().get("sources", {}).items()
+    }
+
+
+def _file_info(row: tuple, sources: dict[str, str]) -> dict[str, Any]:
+    path, name, extension, size, mtime_ns, top = row
+    return {
+        "name": name,
+        "path": path,
+        "extension": extension,
+        "size": size,
+        "modified_at": datetime.fromtimestamp(mtime_ns / 1e9).isoformat(timespec="seconds"),
+        "source": sources.get(top),
+    }
+
+
+def _where(root: str, query: FileQuery) -> tuple[list[str], list]:
+    clauses, params = ["root = ?"], [root]
+    if query.source is not None:
+        clauses.append("top = ?")
+        params.append(_source_top(query.source))
+    if query.extensions:
+        clauses.append(f"extension IN ({', '.join('?' * len(query.extensions))})")
+        params.extend(query.extensions)
+    if query.directory is not None:
+        clauses.append("dir = ?")
+        params.append(query.directory)
+    return clauses, params
+
+
+def _encode_cursor(query: FileQuery, value: Any, path: str) -> str:
+    payload = json.dumps([query.sort, query.descending, value, path], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(query: FileQuery, cursor: str) -> tuple[Any, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort, descending, value, path = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor") from None
+    if sort != query.sort or descending != query.descending:
+        raise ValueError("Cursor belongs to a different sort order")
+    return value, path
+
+
+def query_files(root: Path, query: FileQuery = FileQuery(), limit: int | None = None,
+                cursor: str | None = None, offset: int = 0) -> tuple[list[dict[str, Any]], str | None]:
+    """One page of document files under root, plus the cursor for the next
+    page (None on the last one). Pages are keyset-paginated on the sort
+    column and path, so they stay consistent while files are added."""
+    root = str(root)
+    _ensure_fresh(root)
+    column = SORT_COLUMNS[query.sort]
+    direction = "DESC" if query.descending else "ASC"
+    clauses, params = _where(root, query)
+    if cursor is not None:
+        value, path = _decode_cursor(query, cursor)
+        clauses.append(f"({column}, path) {'<' if query.descending else '>'} (?, ?)")
+        params.extend([value, path])
+    sql = (f"SELECT {_FILE_COLUMNS}, {column} FROM files WHERE {' AND '.join(clauses)} "
+           f"ORDER BY {column} {direction}, path {direction} LIMIT ? OFFSET ?")
+    # One row more than asked tells whether there is a next page
+    rows = _connection().execute(sql, (*params, -1 if limit is None else limit + 1, offset)).fetchall()
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(query, rows[-1][-1], rows[-1][0])
+    sources = _sources_by_top()
+    return [_file_info(row[:-1], sources) for row in rows], next_cursor
+
+
+def describe_files(root: Path, paths: list[str]) -> dict[str, dict[str, Any]]:
+    """Listing entries (as query_files returns them) for indexed paths."""
+    conn = _connection()
+    sources = _sources_by_top()
+    described = {}
+    for start in range(0, len(paths), 500):
+        chunk = paths[start:start + 500]
+        rows = conn.execute(
+            f"SELECT {_FILE_COLUMNS} FROM files WHERE root = ? AND path IN ({', '.join('?' * len(chunk))})",
+            (str(root), *chunk),
+        )
+        described.update((row[0], _file_info(row, sources)) for row in rows)
+    return described
+
+
+def count_files(root: Path, query: FileQuery = FileQuery()) -> int:
+    root = str(root)
+    _ensure_fresh(root)
+    clauses, params = _where(root, query)
+    return _connection().execute(f"SELECT COUNT(*) FROM files WHERE {' AND '.join(clauses)}", params).fetchone()[0]
+
+
+def changes_since(root: Path, since: int) -> dict[str, Any]:
+    """Files added or changed and paths removed after generation ``since``.
+
+    ``reset`` is set (with no files) when the index no longer has enough
+    history, or the delta is too large to be worth it; the client should
+    then list from scratch.
+    """
+    root = str(root)
+    _ensure_fresh(root)
+    conn = _connection()
+    current = _meta(conn, "generation")
+    delta = {"generation": current, "since": since, "reset": False, "added": [], "removed": []}
+    if since < _meta(conn, "removed_floor") or since > current:
+        return {**delta, "reset": True}
+
+    rows = conn.execute(
+        f"SELECT {_FILE_COLUMNS} FROM files WHERE root = ? AND generation > ? ORDER BY generation LIMIT ?",
+        (root, since, MAX_DELTA_FILES + 1),
+    ).fetchall()
+    removed = [
+        path for (path,) in conn.execute(
+            "SELECT path FROM removed WHERE root = ? AND generation > ? ORDER BY generation LIMIT ?",
+            (root, since, MAX_DELTA_FILES + 1),
+        )
+    ]
+    if len(rows) + len(removed) > MAX_DELTA_FILES:
+        return {**delta, "reset": True}
+    sources = _sources_by_top()
+    return {**delta, "added": [_file_info(row, sources) for row in rows], "removed": removed}
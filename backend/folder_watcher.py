@@ -0,0 +1,211 @@
+# Background watcher on the active folder. It keeps the file index current
+# and pushes a debounced summary of each burst of changes to SSE subscribers
+# (the desktop controller), so nothing has to poll. Native change
+# notifications come from watchfiles (inotify on Linux, ReadDirectoryChanges
+# on Windows, FSEvents on macOS). Without it, or on folders it cannot watch
+# (some network shares), the index is refreshed on a timer instead, which
+# only costs a stat per directory.
+
+import asyncio
+import threading
+import time
+from pathlib import Path
+from typing import Any, Mapping
+
+import file_index
+from config import config_snapshot
+from file_index import CAPTURES_DIRNAME, DOCUMENT_EXTENSIONS
+from storage import active_folder, refresh_file_index
+
+try:
+    import watchfiles
+except ImportError:
+    watchfiles = None
+
+
+# How often a native watch wakes up with no changes, to notice a new
+# active folder or shutdown
+IDLE_TIMEOUT_MS = 1000
+
+_subscribers: list[tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = []
+_lock = threading.Lock()
+_stop = threading.Event()
+_thread: threading.Thread | None = None
+# What subscribers were last told about
+_published: dict[str, Any] = {"active_folder": None, "generation": None}
+
+
+def watcher_config() -> Mapping[str, Any]:
+    return config_snapshot()["folder_watcher"]
+
+
+def _relevant(change, path: str) -> bool:
+    """Changes worth waking up for: document files and directories (a
+    renamed or deleted directory takes its files with it), never the kept
+    captures. A directory is recognised on disk, or once deleted by the
+    index; its name may have a dot (e.g. 2024.03) like a file's."""
+    path = Path(path)
+    if CAPTURES_DIRNAME in path.parts:
+        return False
+    if path.suffix.lower() in DOCUMENT_EXTENSIONS:
+        return True
+    if change == watchfiles.Change.deleted:
+        return file_index.is_known_directory(str(path))
+    return path.is_dir()
+
+
+def _send(message: dict[str, Any] | None) -> None:
+    with _lock:
+        subscribers = list(_subscribers)
+    for loop, queue in subscribers:
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, message)
+        except RuntimeError:
+            # Subscriber's event loop already closed
+            pass
+
+
+def current_state() -> dict[str, Any]:
+    """What a new subscriber starts from."""
+    folder = active_folder()
+    return {
+        "active_folder": str(folder),
+        "generation": file_index.generation(folder) if folder.exists() else 0,
+        "watching": file_index.is_watched(folder),
+    }
+
+
+def _publish(folder: Path) -> None:
+    """Tell subscribers what changed since the last event (a reset when the
+    active folder changed or the delta is too large to send)."""
+    since = _published["generation"]
+    if _published["active_folder"] != str(folder) or since is None:
+        delta = {"generation": file_index.generation(folder), "since": since, "reset": True,
+                 "added": [], "removed": []}
+    else:
+        delta = file_index.changes_since(folder, since)
+        if not delta["reset"] and not delta["added"] and not delta["removed"]:
+            return
+    _published.update(active_folder=str(folder), generation=delta["generation"])
+    _send({
+        "event": "changes",
+        "data": {**delta, "active_folder": str(folder), "document_count": file_index.count_files(folder)},
+    })
+
+
+def _watch_native(folder: Path) -> None:
+    settings = watcher_config()
+    refreshed = False
+    for changes in watchfiles.watch(
+        folder,
+        watch_filter=_relevant,
+        # Changes are collected until none arrive for debounce_ms, but for
+        # no longer than max_delay_ms
+        debounce=int(settings["max_delay_ms"]),
+        step=int(settings["debounce_ms"]),
+        stop_event=_stop,
+        rust_timeout=IDLE_TIMEOUT_MS,
+        yield_on_timeout=True,
+        raise_interrupt=False,
+    ):
+        if not refreshed:
+            # Catch up on anything that changed before the watch started
+            file_index.refresh(folder)
+            file_index.set_watched(folder, True)
+            refreshed = True
+        if changes:
+            file_index.refresh(folder)
+            # Files rewritten in place leave their directory's mtime alone,
+            # so the refresh alone would miss them
+            added = {path for change, path in changes if change == watchfiles.Change.added}
+            for change, path in changes:
+                if change == watchfiles.Change.modified and path not in added:
+                    file_index.record(folder, Path(path))
+        _publish(folder)
+        if active_folder() != folder:
+            return
+
+
+def _watch_polling(folder: Path) -> None:
+    settings = watcher_config()
+    interval = int(settings["poll_interval_ms"]) / 1000
+    step = int(settings["debounce_ms"]) / 1000
+    max_delay = int(settings["max_delay_ms"]) / 1000
+    file_index.refresh(folder)
+    file_index.set_watched(folder, True)
+    _publish(folder)
+
+    last = file_index.generation(folder)
+    burst_started = None
+    while not _stop.wait(interval if burst_started is None else step):
+        if active_folder() != folder:
+            return
+        file_index.refresh(folder)
+        current = file_index.generation(folder)
+        now = time.monotonic()
+        if current != last:
+            # Still changing: wait for the burst to settle, within max_delay
+            last = current
+            burst_started = burst_started or now
+            if now - burst_started < max_delay:
+                continue
+        if burst_started is not None:
+            burst_started = None
+            _publish(folder)
+
+
+def _run() -> None:
+    while not _stop.is_set():
+        folder = active_folder()
+        if not folder.is_dir():
+            _stop.wait(IDLE_TIMEOUT_MS / 1000)
+            continue
+        try:
+            if watchfiles is not None and watcher_config()["backend"] != "poll":
+                try:
+                    _watch_native(folder)
+                except Exception as exc:
+                    print(f"Cannot watch {folder} ({exc}), polling it instead")
+                    _watch_polling(folder)
+            else:
+                _watch_polling(folder)
+        except Exception as exc:
+            print(f"Folder watcher stopped: {exc}")
+            return
+        finally:
+            file_index.set_watched(folder, False)
+
+
+def start_watcher() -> None:
+    """Start watching the active folder (once per process). With the
+    watcher off, the index is only brought up to date in the background."""
+    global _thread
+    with _lock:
+        if _thread is not None:
+            return
+        if watcher_config()["enabled"]:
+            _thread = threading.Thread(target=_run, name="folder-watcher", daemon=True)
+        else:
+            # The first walk of a large folder can take a while; keep it off
+            # the event loop and out of the first listing
+            _thread = threading.Thread(target=refresh_file_index, name="file-index", daemon=True)
+    _thread.start()
+
+
+def stop_watcher() -> None:
+    """Stop watching and end every event stream."""
+    _stop.set()
+    _send(None)
+
+
+def subscribe() -> asyncio.Queue:
+    """Queue receiving folder change events on the calling event loop."""
+    queue: asyncio.Queue = asyncio.Queue()
+    with _lock:
+        _subscribers.append((asyncio.get_running_loop(), queue))
+    return queue
+
+
+def unsubscribe(queue: asyncio.Queue) -> None:
+    with _lock:
+        _subscribers[:] = [entry for entry in _subscribers if entry[1] is not queue]
@@ -3,32 +3,93 @@ import numpy as np
 from PIL import Image
 import io
 import base64
+import math
 from typing import Optional, Tuple, List
 
-def decode_base64_image(base64_string: str) -> np.ndarray:
-    """Decode base64 string to OpenCV image"""
-    # Remove data URL prefix if present
-    if ',' in base64_string:
-        base64_string = base64_string.split(',')[1]
-    
-    # Decode base64
-    img_bytes = base64.b64decode(base64_string)
-    
-    # Convert to numpy array
+from metrics import PAGES_PROCESSED, span
+from workspace import get_workspace
+
+# Longest side of the proxy image used for document detection and skew
+# estimation; geometry found on the proxy is scaled back to full resolution.
+DEFAULT_DETECTION_MAX_DIMENSION = 1000
+
+# A document must cover at least this share of the frame
+MIN_DOCUMENT_AREA_RATIO = 0.2
+
+# Tile edge for tiled enhancement, and how far each tile reads past its edge
+# (covers the adaptive threshold's 21 px block and the unsharp blur)
+DEFAULT_ENHANCE_TILE_SIZE = 1024
+ENHANCE_TILE_OVERLAP = 16
+
+# Skew angles (degrees) outside this range are not treated as skew
+MIN_SKEW_ANGLE = 0.5
+MAX_SKEW_ANGLE = 10
+
+# Longest side of the processed preview
+PREVIEW_MAX_DIMENSION = 800
+
+# Longest side of the proxy the capture quality check runs on
+QUALITY_MAX_DIMENSION = 800
+
+# Gray levels counted as blown-out highlights (glare) and crushed shadows
+HIGHLIGHT_CLIP_LEVEL = 250
+SHADOW_CLIP_LEVEL = 5
+
+# JPEG captures can be decoded straight at 1/2, 1/4 or 1/8 of their size
+_REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+def decode_data_url(data_url: str) -> bytes:
+    """Decode a base64 string (with or without data URL prefix) to raw bytes"""
+    if ',' in data_url:
+        data_url = data_url.split(',', 1)[1]
+    return base64.b64decode(data_url)
+
+def decode_image_bytes(img_bytes: bytes) -> Optional[np.ndarray]:
+    """Decode encoded image bytes (PNG, JPEG, ...) to OpenCV image"""
+    # Wrap the bytes without copying
     nparr = np.frombuffer(img_bytes, np.uint8)
+    return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+def decode_image_proxy(img_bytes: bytes, max_dimension: int) -> Optional[np.ndarray]:
+    """Decode encoded image bytes at a reduced size for quick analysis.
     
-    # Decode image
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    return img
+    Uses the largest decoder downscale that keeps the longest side at or
+    above max_dimension (JPEG scales in the DCT, far cheaper than a full
+    decode), so the result is at most twice max_dimension.
+    """
+    try:
+        with Image.open(io.BytesIO(img_bytes)) as img:
+            longest = max(img.size)
+    except Exception:
+        return None
+    
+    flags = cv2.IMREAD_COLOR
+    for factor, reduced in _REDUCED_DECODE_FLAGS:
+        if longest // factor >= max_dimension:
+            flags = reduced
+            break
+    return cv2.imdecode(np.frombuffer(img_bytes, np.uint8), flags)
+
+def encode_image(image: np.ndarray, ext: str = '.jpg', quality: int = 95) -> bytes:
+    """Encode OpenCV image to bytes in the format given by ext"""
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if ext in ('.jpg', '.jpeg') else []
+    ok, buffer = cv2.imencode(ext, image, params)
+    if not ok:
+        raise ValueError(f"Could not encode image as {ext}")
+    return buffer.tobytes()
+
+def decode_base64_image(base64_string: str) -> np.ndarray:
+    """Decode base64 string to OpenCV image"""
+    return decode_image_bytes(decode_data_url(base64_string))
 
 def encode_image_to_base64(image: np.ndarray, quality: int = 95) -> str:
     """Encode OpenCV image to base64 string"""
-    # Encode image to JPEG
-    _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
-    
-    # Convert to base64
-    base64_bytes = base64.b64encode(buffer)
-    base64_string = base64_bytes.decode('utf-8')
+    with span("encode"):
+        base64_string = base64.b64encode(encode_image(image, '.jpg', quality)).decode('utf-8')
     
     # Add data URL prefix
     return f"data:image/jpeg;base64,{base64_string}"
@@ -51,26 +112,66 @@ def order_points(pts: np.ndarray) -> np.ndarray:
     
     return rect
 
-def detect_document(image: np.ndarray) -> Optional[np.ndarray]:
-    """Detect document edges and return corner points"""
+def make_proxy(image: np.ndarray, max_dimension: Optional[int]) -> Tuple[np.ndarray, float]:
+    """Downscale image so its longest side is at most max_dimension.
+    
+    Returns the proxy and the scale factor from full resolution to proxy.
+    A downscaled proxy is workspace scratch, valid until the next call.
+    """
+    height, width = image.shape[:2]
+    longest = max(height, width)
+    if not max_dimension or longest <= max_dimension:
+        return image, 1.0
+    
+    scale = max_dimension / float(longest)
+    size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+    proxy = get_workspace().buffer("proxy", (size[1], size[0]) + image.shape[2:], image.dtype)
+    return cv2.resize(image, size, dst=proxy, interpolation=cv2.INTER_AREA), scale
+
+def detect_document(image: np.ndarray,
+                    max_dimension: Optional[int] = None) -> Optional[np.ndarray]:
+    """Detect document edges and return corner points.
+    
+    Detection runs on a proxy no larger than max_dimension; the returned
+    corners are in full-resolution coordinates.
+    """
+    proxy, scale = make_proxy(image, max_dimension)
+    corners = _detect_document_corners(proxy)
+    if corners is None or scale == 1.0:
+        return corners
+    return corners.astype("float32") / scale
+
+def _median(gray: np.ndarray) -> float:
+    """np.median of an 8-bit image from its histogram, without sorting a copy"""
+    count = gray.size
+    if count >= 1 << 24:
+        # calcHist counts in float32, exact only below 2**24
+        return float(np.median(gray))
+    cumulative = np.cumsum(cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel())
+    low = np.searchsorted(cumulative, (count - 1) // 2, side='right')
+    high = np.searchsorted(cumulative, count // 2, side='right')
+    return (low + high) / 2.0
+
+def _detect_document_corners(image: np.ndarray) -> Optional[np.ndarray]:
+    workspace = get_workspace()
+    
     # Get image dimensions
     height, width = image.shape[:2]
     
     # Convert to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=workspace.buffer("gray", (height, width)))
     
     # Apply Gaussian blur to reduce noise
-    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0, dst=workspace.like("blurred", gray))
     
     # Edge detection with auto-threshold
-    v = np.median(blurred)
+    v = _median(blurred)
     lower = int(max(0, (1.0 - 0.33) * v))
     upper = int(min(255, (1.0 + 0.33) * v))
-    edges = cv2.Canny(blurred, lower, upper)
+    edges = cv2.Canny(blurred, lower, upper, edges=workspace.like("edges", gray))
     
-    # Dilate edges to close gaps
-    kernel = np.ones((3, 3), np.uint8)
-    dilated = cv2.dilate(edges, kernel, iterations=1)
+    # Dilate edges to close gaps (into the grayscale buffer, no longer needed)
+    dilated = cv2.dilate(edges, workspace.kernel(3), dst=gray, iterations=1)
     
     # Find contours
     contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -88,14 +189,14 @@ def detect_document(image: np.ndarray) -> Optional[np.ndarray]:
         if len(approx) == 4:
             # Check if area is significant (at least 20% of image)
             area = cv2.contourArea(approx)
-            if area > (width * height * 0.2):
+            if area > (width * height * MIN_DOCUMENT_AREA_RATIO):
                 # Reshape and return corners
                 return approx.reshape(4, 2)
     
     return None
 
-def four_point_transform(image: np.ndarray, pts: np.ndarray) -> np.ndarray:
-    """Apply perspective transform to get top-down view"""
+def perspective_geometry(pts: np.ndarray) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """Homography and output size that flatten the quadrilateral pts"""
     # Order points
     rect = order_points(pts)
     (tl, tr, br, bl) = rect
@@ -120,136 +221,486 @@ def four_point_transform(image: np.ndarray, pts: np.ndarray) -> np.ndarray:
     # Calculate perspective transform matrix
     M = cv2.getPerspectiveTransform(rect, dst)
     
-    # Apply transform
-    warped = cv2.warpPerspective(image, M, (maxWidth, maxHeight))
-    
-    return warped
+    return M, (maxWidth, maxHeight)
+
+def four_point_transform(image: np.ndarray, pts: np.ndarray) -> np.ndarray:
+    """Apply perspective transform to get top-down view"""
+    M, size = perspective_geometry(pts)
+    return cv2.warpPerspective(image, M, size)
+
+def _threshold_text(gray: np.ndarray, dst: Optional[np.ndarray] = None) -> np.ndarray:
+    # Adaptive threshold for text; stays single-channel so the output stage
+    # can store it as 1-bit
+    return cv2.adaptiveThreshold(
+        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+        cv2.THRESH_BINARY, 21, 10, dst=dst
+    )
+
+def _create_clahe(doc_type: str):
+    # Keep the scan natural-looking; aggressive CLAHE/sharpening creates
+    # halos and posterized receipts.
+    clip_limit = 1.4 if doc_type == 'photo' else 1.8
+    return get_workspace().clahe(clip_limit, (8, 8))
+
+def _unsharp(image: np.ndarray) -> np.ndarray:
+    # Mild unsharp mask keeps text crisp without the synthetic edge look
+    # of a hard convolution kernel. Sharpens in place.
+    blurred = cv2.GaussianBlur(image, (0, 0), 1.0, dst=get_workspace().like("blurred", image))
+    return cv2.addWeighted(image, 1.15, blurred, -0.15, 0, dst=image)
 
-def enhance_document(image: np.ndarray, doc_type: str = 'mixed') -> np.ndarray:
-    """Enhance document for better readability"""
-    enhanced = image.copy()
+def enhance_document(image: np.ndarray, doc_type: str = 'mixed', tile_size: Optional[int] = None) -> np.ndarray:
+    """
+    Enhance document for better readability
+    
+    'text' returns a single-channel black/white image (see is_bilevel);
+    'mixed' and 'photo' return BGR. With tile_size, images larger than one
+    tile are processed tile by tile (see _enhance_tiled) for the same result
+    with far less memory.
+    """
+    if tile_size and max(image.shape[:2]) > tile_size:
+        return _enhance_tiled(image, doc_type, tile_size)
+    
+    workspace = get_workspace()
     
     if doc_type == 'text':
         # Convert to grayscale for text documents
-        if len(enhanced.shape) == 3:
-            enhanced = cv2.cvtColor(enhanced, cv2.COLOR_BGR2GRAY)
-        
-        # Apply adaptive threshold for text
-        enhanced = cv2.adaptiveThreshold(
-            enhanced, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-            cv2.THRESH_BINARY, 21, 10
-        )
-        
-        # Convert back to BGR for consistency
-        enhanced = cv2.cvtColor(enhanced, cv2.COLOR_GRAY2BGR)
-        
-    else:  # 'mixed' or 'photo'
-        # Enhance contrast and brightness
-        lab = cv2.cvtColor(enhanced, cv2.COLOR_BGR2LAB)
-        l, a, b = cv2.split(lab)
-        
-        # Keep the scan natural-looking; aggressive CLAHE/sharpening creates
-        # halos and posterized receipts.
-        clip_limit = 1.4 if doc_type == 'photo' else 1.8
-        clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=(8, 8))
-        l = clahe.apply(l)
+        gray = image
+        if len(image.shape) == 3:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=workspace.buffer("gray", image.shape[:2]))
         
-        # Merge channels
-        enhanced = cv2.merge([l, a, b])
-        enhanced = cv2.cvtColor(enhanced, cv2.COLOR_LAB2BGR)
-        
-        if doc_type != 'photo':
-            # Mild unsharp mask keeps text crisp without the synthetic edge look
-            # of a hard convolution kernel.
-            blurred = cv2.GaussianBlur(enhanced, (0, 0), 1.0)
-            enhanced = cv2.addWeighted(enhanced, 1.15, blurred, -0.15, 0)
-        
-        # Ensure values are in valid range
-        enhanced = np.clip(enhanced, 0, 255).astype(np.uint8)
+        return _threshold_text(gray)
+    
+    # 'mixed' or 'photo': enhance contrast and brightness on the lightness
+    # channel, in place in the LAB scratch image
+    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB, dst=workspace.like("lab", image))
+    l = cv2.extractChannel(lab, 0, dst=workspace.buffer("lightness", image.shape[:2]))
+    _create_clahe(doc_type).apply(l, l)
+    cv2.insertChannel(l, lab, 0)
+    enhanced = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+    
+    if doc_type != 'photo':
+        _unsharp(enhanced)
     
     return enhanced
 
-def auto_rotate(image: np.ndarray) -> np.ndarray:
-    """Detect and correct image rotation"""
+def _tiles(height: int, width: int, tile_size: int, overlap: int = 0):
+    """Yield (inner, padded) tile slices covering the image; padded extends
+    inner by overlap pixels where the image allows."""
+    for y0 in range(0, height, tile_size):
+        y1 = min(y0 + tile_size, height)
+        for x0 in range(0, width, tile_size):
+            x1 = min(x0 + tile_size, width)
+            py0, px0 = max(0, y0 - overlap), max(0, x0 - overlap)
+            py1, px1 = min(height, y1 + overlap), min(width, x1 + overlap)
+            inner = (slice(y0, y1), slice(x0, x1))
+            padded = (slice(py0, py1), slice(px0, px1))
+            within = (slice(y0 - py0, y1 - py0), slice(x0 - px0, x1 - px0))
+            yield inner, padded, within
+
+def _enhance_tiled(image: np.ndarray, doc_type: str, tile_size: int) -> np.ndarray:
+    """
+    Tile-by-tile enhance_document with the same output.
+    
+    Colour conversions are per pixel; the unsharp mask and the adaptive
+    threshold only look ENHANCE_TILE_OVERLAP pixels around each tile, and at
+    the image edges the tiles share the image's own border handling. CLAHE
+    needs whole-image statistics, so its single lightness plane is the one
+    full-size intermediate besides the output.
+    """
+    height, width = image.shape[:2]
+    workspace = get_workspace()
+    
+    if doc_type == 'text':
+        enhanced = np.empty((height, width), np.uint8)
+        for inner, padded, within in _tiles(height, width, tile_size, ENHANCE_TILE_OVERLAP):
+            tile = image[padded]
+            if tile.ndim == 3:
+                tile = cv2.cvtColor(tile, cv2.COLOR_BGR2GRAY, dst=workspace.buffer("gray", tile.shape[:2]))
+            enhanced[inner] = _threshold_text(tile, workspace.like("threshold", tile))[within]
+        return enhanced
+    
+    lightness = workspace.buffer("lightness", (height, width))
+    for inner, _, _ in _tiles(height, width, tile_size):
+        tile = image[inner]
+        lab = cv2.cvtColor(tile, cv2.COLOR_BGR2LAB, dst=workspace.like("lab", tile))
+        cv2.extractChannel(lab, 0, dst=lightness[inner])
+    _create_clahe(doc_type).apply(lightness, lightness)
+    
+    enhanced = np.empty_like(image)
+    for inner, padded, within in _tiles(height, width, tile_size, ENHANCE_TILE_OVERLAP):
+        tile = image[padded]
+        lab = cv2.cvtColor(tile, cv2.COLOR_BGR2LAB, dst=workspace.like("lab", tile))
+        cv2.insertChannel(lightness[padded], lab, 0)
+        tile = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR, dst=workspace.like("tile", tile))
+        if doc_type != 'photo':
+            _unsharp(tile)
+        enhanced[inner] = tile[within]
+    return enhanced
+
+def is_bilevel(image: np.ndarray) -> bool:
+    """True for single-channel images holding only black and white"""
+    return image.ndim == 2 and cv2.countNonZero(cv2.inRange(image, 1, 254)) == 0
+
+def measure_quality(image: np.ndarray,
+                    corners=None,
+                    max_dimension: Optional[int] = QUALITY_MAX_DIMENSION) -> dict:
+    """
+    Cheap capture quality measurements on a small proxy.
+    
+    Measured on the document region (from a valid corner hint, else
+    detection) when one is found, so the desk around it does not count:
+    sharpness is the variance of the Laplacian, brightness the mean gray
+    level, and highlight/shadow clipping the share of blown-out and
+    crushed pixels.
+    """
+    proxy, _ = make_proxy(image, max_dimension)
+    
+    rect = corners_from_hint(corners, proxy.shape) if corners is not None else None
+    if rect is None:
+        with span("detect_document"):
+            detected = _detect_document_corners(proxy)
+        rect = None if detected is None else detected.astype("float32")
+    region = proxy if rect is None else four_point_transform(proxy, rect)
+    
+    gray = region if region.ndim == 2 else cv2.cvtColor(region, cv2.COLOR_BGR2GRAY)
+    _, stddev = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_64F))
+    pixels = float(gray.size)
+    return {
+        "document_found": rect is not None,
+        "sharpness": round(float(stddev[0, 0]) ** 2, 1),
+        "brightness": round(float(cv2.mean(gray)[0]), 1),
+        "highlight_clipping": round(cv2.countNonZero(cv2.compare(gray, HIGHLIGHT_CLIP_LEVEL, cv2.CMP_GE)) / pixels, 4),
+        "shadow_clipping": round(cv2.countNonZero(cv2.compare(gray, SHADOW_CLIP_LEVEL, cv2.CMP_LE)) / pixels, 4),
+    }
+
+def estimate_skew_angle(image: np.ndarray,
+                        max_dimension: Optional[int] = None) -> float:
+    """Estimate small skew angle in degrees (0.0 if none or not a skew)"""
+    proxy, scale = make_proxy(image, max_dimension)
+    return _estimate_skew_angle(proxy, scale)
+
+def _estimate_skew_angle(proxy: np.ndarray, scale: float) -> float:
+    workspace = get_workspace()
+    
     # Convert to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray = cv2.cvtColor(proxy, cv2.COLOR_BGR2GRAY, dst=workspace.buffer("gray", proxy.shape[:2]))
     
     # Detect edges
-    edges = cv2.Canny(gray, 50, 150, apertureSize=3)
+    edges = cv2.Canny(gray, 50, 150, edges=workspace.like("edges", gray), apertureSize=3)
     
-    # Detect lines using Hough transform
-    lines = cv2.HoughLines(edges, 1, np.pi/180, 200)
+    # Detect lines using Hough transform; the vote threshold is a line
+    # length in pixels, so it shrinks with the proxy
+    threshold = max(100, int(round(200 * scale)))
+    lines = cv2.HoughLines(edges, 1, np.pi/180, threshold)
     
-    if lines is not None:
-        # Calculate angles of detected lines
-        angles = []
-        for rho, theta in lines[:, 0]:
-            angle = np.degrees(theta) - 90
-            angles.append(angle)
-        
-        # Find median angle
-        median_angle = np.median(angles)
-        
-        # Only rotate if angle is significant but small (likely skew)
-        if 0.5 < abs(median_angle) < 10:
-            # Get image center
-            (h, w) = image.shape[:2]
-            center = (w // 2, h // 2)
-            
-            # Rotate image
-            M = cv2.getRotationMatrix2D(center, median_angle, 1.0)
-            rotated = cv2.warpAffine(image, M, (w, h), 
-                                   flags=cv2.INTER_CUBIC,
-                                   borderMode=cv2.BORDER_REPLICATE)
-            return rotated
+    if lines is None:
+        return 0.0
+    
+    # Median angle of detected lines
+    angles = np.degrees(lines[:, 0, 1]) - 90
+    median_angle = float(np.median(angles))
+    
+    # Only rotate if angle is significant but small (likely skew)
+    if MIN_SKEW_ANGLE < abs(median_angle) < MAX_SKEW_ANGLE:
+        return median_angle
+    return 0.0
+
+def corners_from_hint(hint, shape: Tuple[int, ...]) -> Optional[np.ndarray]:
+    """Convert client corner hints to pixel corners.
     
+    The hint is four [x, y] points normalized to 0..1 of the uploaded image
+    (as produced by the in-browser detector). Returns None when the hint is
+    malformed, out of bounds, not convex or too small to be a document.
+    """
+    try:
+        pts = np.asarray(hint, dtype="float32").reshape(4, 2)
+    except (TypeError, ValueError):
+        return None
+    
+    if not np.all(np.isfinite(pts)) or pts.min() < -0.02 or pts.max() > 1.02:
+        return None
+    
+    height, width = shape[:2]
+    rect = order_points(np.clip(pts, 0.0, 1.0) * [width - 1, height - 1])
+    if not cv2.isContourConvex(rect.reshape(-1, 1, 2)):
+        return None
+    if cv2.contourArea(rect) < width * height * MIN_DOCUMENT_AREA_RATIO:
+        return None
+    return rect
+
+def skew_from_hint(hint) -> Optional[float]:
+    """Validate a client skew angle hint (degrees); 0.0 means no correction"""
+    try:
+        angle = float(hint)
+    except (TypeError, ValueError):
+        return None
+    if not np.isfinite(angle) or abs(angle) >= MAX_SKEW_ANGLE:
+        return None
+    return angle if abs(angle) > MIN_SKEW_ANGLE else 0.0
+
+def rotation_matrix(width: int, height: int, angle: float) -> np.ndarray:
+    """3x3 matrix rotating by angle degrees around the image center"""
+    M = np.eye(3)
+    M[:2] = cv2.getRotationMatrix2D((width // 2, height // 2), angle, 1.0)
+    return M
+
+def rotate_image(image: np.ndarray, angle: float) -> np.ndarray:
+    """Rotate image around its center, keeping the original size"""
+    (h, w) = image.shape[:2]
+    M = rotation_matrix(w, h, angle)
+    return cv2.warpAffine(image, M[:2], (w, h),
+                          flags=cv2.INTER_CUBIC,
+                          borderMode=cv2.BORDER_REPLICATE)
+
+def auto_rotate(image: np.ndarray, max_dimension: Optional[int] = None) -> np.ndarray:
+    """Detect and correct image rotation"""
+    angle = estimate_skew_angle(image, max_dimension)
+    if angle:
+        return rotate_image(image, angle)
     return image
 
-def process_document_image(base64_image: str, 
-                         enhance: bool = True,
-                         doc_type: str = 'mixed',
-                         auto_crop: bool = True,
-                         auto_rotate_enabled: bool = True) -> str:
+def compute_warp(image: np.ndarray,
+                 auto_crop: bool = True,
+                 auto_rotate_enabled: bool = True,
+                 detection_max_dimension: Optional[int] = DEFAULT_DETECTION_MAX_DIMENSION,
+                 corners=None,
+                 skew_angle=None) -> Tuple[Optional[np.ndarray], Tuple[int, int]]:
     """
-    Main processing pipeline for document images
+    Work out deskew and perspective crop as geometry only.
+    
+    Returns a single 3x3 matrix mapping the source image to the output
+    (rotation and homography composed) and the output size, or None if the
+    page needs no warp. Detection runs on a rotated proxy, so no full-size
+    intermediate image is produced.
+    """
+    h, w = image.shape[:2]
+    
+    if auto_crop and corners is not None:
+        hinted_corners = corners_from_hint(corners, image.shape)
+        if hinted_corners is not None:
+            # The perspective warp also removes any skew
+            print("Using client corner hint, cropping...")
+            return perspective_geometry(hinted_corners)
+        print("Corner hint failed sanity check, detecting document")
+    
+    if not (auto_crop or auto_rotate_enabled):
+        return None, (w, h)
+    
+    proxy, scale = make_proxy(image, detection_max_dimension)
+    
+    # Deskew angle, from the client hint if valid
+    angle = 0.0
+    if auto_rotate_enabled:
+        angle = skew_from_hint(skew_angle) if skew_angle is not None else None
+        if angle is None:
+            with span("estimate_skew"):
+                angle = _estimate_skew_angle(proxy, scale)
+    rotation = rotation_matrix(w, h, angle) if angle else None
+    
+    if auto_crop:
+        if rotation is not None:
+            # Same rotation expressed in proxy coordinates
+            S = np.diag([scale, scale, 1.0])
+            proxy_rotation = S @ rotation @ np.linalg.inv(S)
+            proxy = cv2.warpAffine(proxy, proxy_rotation[:2], (proxy.shape[1], proxy.shape[0]),
+                                   dst=get_workspace().like("proxy_rotated", proxy),
+                                   borderMode=cv2.BORDER_REPLICATE)
+        
+        with span("detect_document"):
+            detected = _detect_document_corners(proxy)
+        if detected is not None:
+            print(f"Document detected, cropping...")
+            M, size = perspective_geometry(detected.astype("float32") / scale)
+            if rotation is not None:
+                M = M @ rotation
+            return M, size
+        print("No document detected, processing full image")
+    
+    return rotation, (w, h)
+
+def apply_warp(image: np.ndarray, M: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    """Resample image once through the matrix from compute_warp"""
+    if np.allclose(M[2], [0, 0, 1]):
+        # Pure rotation/affine: keep the higher quality deskew interpolation
+        return cv2.warpAffine(image, M[:2], size,
+                              flags=cv2.INTER_CUBIC,
+                              borderMode=cv2.BORDER_REPLICATE)
+    return cv2.warpPerspective(image, M, size, borderMode=cv2.BORDER_REPLICATE)
+
+def warp_hints(M: Optional[np.ndarray], size: Tuple[int, int], shape: Tuple[int, ...]) -> dict:
+    """
+    Express compute_warp's result as the hints the phone sends.
+    
+    Returns {"cropped", "corners", "angle"}: a crop becomes the normalized
+    source quadrilateral, a plain deskew an angle with auto-crop skipped
+    ("cropped"), and no warp a 0.0 angle with auto-crop skipped. Passing them
+    with the same upload reproduces the geometry at any resolution without
+    detection or skew estimation. A crop that would not pass as a hint
+    gives no hints at all.
+    """
+    h, w = shape[:2]
+    if M is None:
+        return {"cropped": True, "corners": None, "angle": 0.0}
+    
+    if tuple(size) != (w, h) or not np.allclose(M[2], [0, 0, 1]):
+        out_w, out_h = size
+        rect = np.float32([[0, 0], [out_w - 1, 0], [out_w - 1, out_h - 1], [0, out_h - 1]])
+        quad = cv2.perspectiveTransform(rect.reshape(-1, 1, 2), np.linalg.inv(M)).reshape(4, 2)
+        normalized = quad / [w - 1, h - 1]
+        if corners_from_hint(normalized, shape) is None:
+            return {"cropped": False, "corners": None, "angle": None}
+        return {"cropped": False, "corners": np.round(normalized, 5).tolist(), "angle": None}
+    
+    # Rotation about the center, as built by rotation_matrix
+    return {"cropped": True, "corners": None, "angle": round(math.degrees(math.atan2(M[0, 1], M[0, 0])), 3)}
+
+def _scaling_matrix(scale: float) -> np.ndarray:
+    """Pixel-centre aligned scaling, matching cv2.resize"""
+    offset = 0.5 * scale - 0.5
+    return np.array([[scale, 0, offset], [0, scale, offset], [0, 0, 1.0]])
+
+def scale_to_output(image: np.ndarray,
+                    M: Optional[np.ndarray],
+                    size: Tuple[int, int],
+                    max_dimension: int) -> Tuple[np.ndarray, Optional[np.ndarray], Tuple[int, int]]:
+    """
+    Plan the warp so it lands directly on the output size.
+    
+    The source is first area-averaged by the largest whole factor that fits
+    (a cheap, alias-free path in OpenCV); the warp then covers the rest, at
+    most a further 2x. Nothing after this touches pixels the output would
+    throw away. Returns the source to warp with the matrix and output size
+    adjusted to it.
+    """
+    scale = max_dimension / float(max(size))
+    out_size = (max(1, int(round(size[0] * scale))), max(1, int(round(size[1] * scale))))
+    
+    factor = int(1 / scale)
+    if factor >= 2:
+        h, w = image.shape[:2]
+        # Exact multiples keep OpenCV on the integer area path
+        image = cv2.resize(image[:h - h % factor, :w - w % factor],
+                           (w // factor, h // factor),
+                           interpolation=cv2.INTER_AREA)
+    
+    if M is None:
+        if image.shape[1] == out_size[0] and image.shape[0] == out_size[1]:
+            return image, None, out_size
+        return image, _scaling_matrix(out_size[0] / image.shape[1]), out_size
+    
+    return image, _scaling_matrix(scale) @ M @ np.linalg.inv(_scaling_matrix(1.0 / factor)), out_size
+
+def process_document_array(image: np.ndarray,
+                           enhance: bool = True,
+                           doc_type: str = 'mixed',
+                           auto_crop: bool = True,
+                           auto_rotate_enabled: bool = True,
+                           detection_max_dimension: Optional[int] = DEFAULT_DETECTION_MAX_DIMENSION,
+                           corners=None,
+                           skew_angle=None,
+                           max_output_dimension: Optional[int] = None,
+                           enhance_tile_size: Optional[int] = DEFAULT_ENHANCE_TILE_SIZE) -> np.ndarray:
+    """
+    Main processing pipeline for decoded document images
     
     Args:
-        base64_image: Base64 encoded image string
+        image: Decoded BGR image
         enhance: Whether to apply enhancement
         doc_type: Type of document ('text', 'mixed', 'photo')
         auto_crop: Whether to detect and crop to document
         auto_rotate_enabled: Whether to auto-rotate skewed images
+        detection_max_dimension: Longest side of the proxy used for
+            detection and skew estimation (None/0 = full resolution)
+        corners: Optional client corner hint (see corners_from_hint); when
+            valid, detection and deskew are skipped
+        skew_angle: Optional client skew hint in degrees; when valid,
+            skew estimation is skipped
+        max_output_dimension: Longest side of the output; the page is
+            warped straight to that size and enhanced at it (None = keep
+            the full resolution)
+        enhance_tile_size: Enhance images larger than this tile by tile to
+            bound memory (None/0 = whole image at once)
+    
+    Returns:
+        Processed BGR image
+    """
+    # Deskew and crop in a single resample
+    M, size = compute_warp(image, auto_crop, auto_rotate_enabled,
+                           detection_max_dimension, corners, skew_angle)
+    return render_document(image, M, size, enhance, doc_type,
+                           max_output_dimension, enhance_tile_size)
+
+def render_document(image: np.ndarray,
+                    M: Optional[np.ndarray],
+                    size: Tuple[int, int],
+                    enhance: bool = True,
+                    doc_type: str = 'mixed',
+                    max_output_dimension: Optional[int] = None,
+                    enhance_tile_size: Optional[int] = DEFAULT_ENHANCE_TILE_SIZE) -> np.ndarray:
+    """Warp and enhance with geometry from compute_warp (see
+    process_document_array for the options)"""
+    if max_output_dimension and max(size) > max_output_dimension:
+        with span("downscale"):
+            image, M, size = scale_to_output(image, M, size, max_output_dimension)
+    if M is not None:
+        with span("warp"):
+            image = apply_warp(image, M, size)
+    
+    # Enhance image if enabled
+    if enhance:
+        print(f"Enhancing image as {doc_type} document")
+        with span("enhance"):
+            image = enhance_document(image, doc_type, enhance_tile_size)
+    
+    return image
+
+def process_document_bytes(img_bytes: bytes, **kwargs) -> Optional[np.ndarray]:
+    """
+    Decode raw upload bytes and run the processing pipeline on them.
+    
+    Returns the processed image, or the decoded original if processing
+    fails, or None if the bytes cannot be decoded at all.
+    """
+    with span("decode"):
+        image = decode_image_bytes(img_bytes)
+    if image is None:
+        print("Failed to decode image")
+        return None
+    
+    try:
+        return process_document_array(image, **kwargs)
+    except Exception as e:
+        print(f"Error processing image: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        # Return original image if processing fails
+        return image
+
+def process_document_image(base64_image: str, **kwargs) -> str:
+    """
+    Process a base64 encoded image (see process_document_array for options)
     
     Returns:
         Base64 encoded processed image
     """
+    from page_cache import cache_key, get_cache
+    
     try:
-        # Decode image
-        image = decode_base64_image(base64_image)
+        img_bytes = decode_data_url(base64_image)
         
+        # Reuse the result for identical uploads with identical settings
+        cache = get_cache()
+        key = cache_key(img_bytes, kwargs) if cache is not None else None
+        image = cache.get(key) if cache is not None else None
         if image is None:
-            print("Failed to decode image")
-            return base64_image
-        
-        # Auto-rotate if enabled
-        if auto_rotate_enabled:
-            image = auto_rotate(image)
-        
-        # Detect and crop document if enabled
-        if auto_crop:
-            corners = detect_document(image)
-            if corners is not None:
-                print(f"Document detected, cropping...")
-                image = four_point_transform(image, corners)
-            else:
-                print("No document detected, processing full image")
-        
-        # Enhance image if enabled
-        if enhance:
-            print(f"Enhancing image as {doc_type} document")
-            image = enhance_document(image, doc_type)
-        
-        # Encode and return
+            image = process_document_bytes(img_bytes, **kwargs)
+            if image is None:
+                return base64_image
+            PAGES_PROCESSED.inc(source="pipeline")
+            if cache is not None:
+                cache.put(key, image)
+        else:
+            PAGES_PROCESSED.inc(source="cache")
         return encode_image_to_base64(image)
         
     except Exception as e:
@@ -261,25 +712,21 @@ def process_document_image(base64_image: str,
 
 def process_pil_image(pil_image: Image.Image, **kwargs) -> Image.Image:
     """Process a PIL Image object"""
-    # Convert PIL to base64
-    buffered = io.BytesIO()
-    pil_image.save(buffered, format="JPEG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-    base64_image = f"data:image/jpeg;base64,{img_str}"
-    
-    # Process
-    processed_base64 = process_document_image(base64_image, **kwargs)
-    
-    # Convert back to PIL
-    img_data = base64.b64decode(processed_base64.split(',')[1])
-    return Image.open(io.BytesIO(img_data))
+    image = cv2.cvtColor(np.asarray(pil_image.convert("RGB")), cv2.COLOR_RGB2BGR)
+    processed = process_document_array(image, **kwargs)
+    if processed.ndim == 2:
+        return Image.fromarray(processed)
+    return Image.fromarray(cv2.cvtColor(processed, cv2.COLOR_BGR2RGB))
 
 # Optional: Batch processing function
 def process_multiple_pages(pages: List[str], **kwargs) -> List[str]:
-    """Process multiple pages with same settings"""
-    processed_pages = []
-    for i, page in enumerate(pages):
-        print(f"Processing page {i + 1} of {len(pages)}...")
-        processed = process_document_image(page, **kwargs)
-        processed_pages.append(processed)
-    return processed_pages
+    """Process multiple pages with same settings in the worker pool"""
+    from processing_pool import process_pages
+    
+    print(f"Processing {len(pages)} pages...")
+    page_bytes = [decode_data_url(page) for page in pages]
+    processed_pages = process_pages(page_bytes, [kwargs] * len(pages))
+    return [
+        page if image is None else encode_image_to_base64(image)
+        for page, image in zip(pages, processed_pages)
+    ]
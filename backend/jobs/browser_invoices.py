@@ -9,7 +9,7 @@ from pathlib import Path
 from typing import Any, Callable
 
 from config import BACKEND_DIR
-from storage import source_folder
+from storage import download_path, place_download, source_folder
 
 
 PDF_EXTENSION = ".pdf"
@@ -102,17 +102,25 @@ def accept_common_consent(page: Any) -> None:
     )
 
 
-def save_download(download: Any, output_dir: Path, suggested_name: str | None = None) -> dict[str, Any]:
+def save_download(download: Any, output_dir: Path, suggested_name: str | None = None) -> dict[str, Any] | None:
+    """Save a browser download into output_dir, placed like the other job
+    downloads (see storage.place_download). Returns None when the folder
+    already had its content; callers count that in skipped_duplicates."""
     filename = suggested_name or download.suggested_filename or "invoice.pdf"
     if Path(filename).suffix.lower() != PDF_EXTENSION:
         filename = f"{Path(filename).stem}.pdf"
     destination = unique_path(output_dir, filename)
-    download.save_as(str(destination))
+    partial = download_path(destination)
+    download.save_as(str(partial))
+    placed = place_download(partial, destination)
+    if placed["action"] == "skipped":
+        return None
     return {
-        "filename": destination.name,
-        "path": str(destination),
+        "filename": placed["path"].name,
+        "path": str(placed["path"]),
+        "linked_to": placed["duplicate_of"],
         "suggested_filename": download.suggested_filename,
-        "size": destination.stat().st_size,
+        "size": placed["path"].stat().st_size,
     }
 
 
@@ -9,6 +9,7 @@ from jobs.browser_invoices import (
     click_first,
     fill_first,
 )
+from storage import place_bytes
 
 START_URL = "https://www.dropbox.com/manage/billing"
 
@@ -63,6 +64,7 @@ def collect(page: Any, date_from: date, date_to: date, output_dir: Path) -> dict
     downloaded: list[dict[str, Any]] = []
     errors: list[dict[str, str]] = []
     inspected_rows = 0
+    skipped_duplicates = 0
 
     # browser_invoices.py already navigated to START_URL before calling collect()
     page.wait_for_selector("button[data-testid='billing-history-more-menu-trigger-button']", timeout=30000)
@@ -120,11 +122,15 @@ def collect(page: Any, date_from: date, date_to: date, output_dir: Path) -> dict
                 inv_page.close()
 
             filename = f"dropbox_invoice_{bill_id}.pdf"
-            out_path = output_dir / filename
-            out_path.write_bytes(pdf_bytes)
+            placed = place_bytes(pdf_bytes, output_dir / filename)
+            if placed["action"] == "skipped":
+                # Already in the folder, from an earlier run or another source
+                skipped_duplicates += 1
+                continue
             downloaded.append({
-                "filename": filename,
-                "path": str(out_path),
+                "filename": placed["path"].name,
+                "path": str(placed["path"]),
+                "linked_to": placed["duplicate_of"],
                 "bill_id": bill_id,
                 "date": str(row_date),
                 "description": row_info.get("dateText", ""),
@@ -136,6 +142,7 @@ def collect(page: Any, date_from: date, date_to: date, output_dir: Path) -> dict
     return {
         "downloaded": downloaded,
         "inspected_rows": inspected_rows,
+        "skipped_duplicates": skipped_duplicates,
         "errors": errors,
     }
 
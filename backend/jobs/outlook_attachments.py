@@ -6,7 +6,7 @@ from datetime import date, datetime, time, timedelta
 from pathlib import Path
 from typing import Any
 
-from storage import source_folder
+from storage import download_path, place_download, source_folder
 
 
 PDF_EXTENSION = ".pdf"
@@ -164,6 +164,9 @@ def _scan_folder(folder, date_from: datetime, date_to_exclusive: datetime, outpu
             "downloaded": [],
             "inspected_messages": 0,
             "skipped_non_pdf": 0,
+            "skipped_excluded_sender": 0,
+            "skipped_outside_date_range": 0,
+            "skipped_duplicates": 0,
             "errors": [{"folder": folder_name, "message": str(exc)}],
         }
 
@@ -172,6 +175,7 @@ def _scan_folder(folder, date_from: datetime, date_to_exclusive: datetime, outpu
     skipped_non_pdf = 0
     skipped_excluded_sender = 0
     skipped_outside_date_range = 0
+    skipped_duplicates = 0
 
     for item in items:
         try:
@@ -205,12 +209,19 @@ def _scan_folder(folder, date_from: datetime, date_to_exclusive: datetime, outpu
                     continue
 
                 destination = _unique_path(output_dir, original_name)
-                attachment.SaveAsFile(str(destination))
-                zone_identifier = _remove_zone_identifier(destination)
+                partial = download_path(destination)
+                attachment.SaveAsFile(str(partial))
+                zone_identifier = _remove_zone_identifier(partial)
+                # Re-runs and invoices the portals already delivered are
+                # not saved again
+                placed = place_download(partial, destination)
+                if placed["action"] == "skipped":
+                    skipped_duplicates += 1
+                    continue
                 downloaded_item = {
-                    "filename": destination.name,
+                    "filename": placed["path"].name,
                     "original_filename": original_name,
-                    "path": str(destination),
+                    "path": str(placed["path"]),
                     "sender": sender_email,
                     "sender_name": sender_name,
                     "subject": str(getattr(item, "Subject", "") or ""),
@@ -220,6 +231,8 @@ def _scan_folder(folder, date_from: datetime, date_to_exclusive: datetime, outpu
                 }
                 if "error" in zone_identifier:
                     downloaded_item["zone_identifier_error"] = zone_identifier["error"]
+                if placed["action"] == "linked":
+                    downloaded_item["linked_to"] = placed["duplicate_of"]
                 downloaded.append(downloaded_item)
         except Exception as exc:
             errors.append(
@@ -236,6 +249,7 @@ def _scan_folder(folder, date_from: datetime, date_to_exclusive: datetime, outpu
         "skipped_non_pdf": skipped_non_pdf,
         "skipped_excluded_sender": skipped_excluded_sender,
         "skipped_outside_date_range": skipped_outside_date_range,
+        "skipped_duplicates": skipped_duplicates,
         "errors": errors,
     }
 
@@ -273,6 +287,7 @@ def download_outlook_pdf_attachments(
         skipped_non_pdf = 0
         skipped_excluded_sender = 0
         skipped_outside_date_range = 0
+        skipped_duplicates = 0
         inspected_folders = []
         errors = []
 
@@ -284,6 +299,7 @@ def download_outlook_pdf_attachments(
             skipped_non_pdf += folder_result["skipped_non_pdf"]
             skipped_excluded_sender += folder_result["skipped_excluded_sender"]
             skipped_outside_date_range += folder_result["skipped_outside_date_range"]
+            skipped_duplicates += folder_result["skipped_duplicates"]
             errors.extend(folder_result["errors"])
     finally:
         pythoncom.CoUninitialize()
@@ -302,6 +318,7 @@ def download_outlook_pdf_attachments(
         "skipped_non_pdf": skipped_non_pdf,
         "skipped_excluded_sender": skipped_excluded_sender,
         "skipped_outside_date_range": skipped_outside_date_range,
+        "skipped_duplicates": skipped_duplicates,
         "excluded_sender_contains": EXCLUDED_SENDER_CONTAINS,
         "error_count": len(errors),
         "errors": errors,
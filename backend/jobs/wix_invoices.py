@@ -8,6 +8,7 @@ from jobs.browser_invoices import (
     click_first,
     fill_first,
 )
+from storage import place_bytes
 
 START_URL = "https://manage.wix.com/studio/billing-history"
 
@@ -131,6 +132,7 @@ def collect(page: Any, date_from: date, date_to: date, output_dir: Path) -> dict
     downloaded: list[dict[str, Any]] = []
     errors: list[dict[str, str]] = []
     inspected_rows = 0
+    skipped_duplicates = 0
 
     # browser_invoices.py already navigated to START_URL before calling collect()
     page.wait_for_selector("button[data-hook='invoice-number']", timeout=30000)
@@ -162,11 +164,15 @@ def collect(page: Any, date_from: date, date_to: date, output_dir: Path) -> dict
                 raise RuntimeError(f"HTTP {response.status} for invoice {invoice_id}")
             pdf_bytes = response.body()
             filename = f"wix_invoice_{invoice_id}.pdf"
-            out_path = output_dir / filename
-            out_path.write_bytes(pdf_bytes)
+            placed = place_bytes(pdf_bytes, output_dir / filename)
+            if placed["action"] == "skipped":
+                # Already in the folder, from an earlier run or another source
+                skipped_duplicates += 1
+                continue
             downloaded.append({
-                "filename": filename,
-                "path": str(out_path),
+                "filename": placed["path"].name,
+                "path": str(placed["path"]),
+                "linked_to": placed["duplicate_of"],
                 "invoice_id": invoice_id,
                 "date": str(invoice_date),
                 "url": pdf_url,
@@ -179,6 +185,7 @@ def collect(page: Any, date_from: date, date_to: date, output_dir: Path) -> dict
     return {
         "downloaded": downloaded,
         "inspected_rows": inspected_rows,
+        "skipped_duplicates": skipped_duplicates,
         "errors": errors,
         "subscriptions": subscriptions,
         "next_invoice": _next_invoice_summary(subscriptions),
@@ -0,0 +1,281 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator
+
+
+# Upper bounds (seconds) for latency histograms; +Inf is implicit
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# One (stage, seconds) pair per finished span
+Span = tuple[str, float]
+# Yields complete exposition lines at scrape time
+Collector = Callable[[], Iterable[str]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _label_text(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def expose(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_label_text(self.labels, key)} {_number(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per-bucket counts (+Inf last), sum]
+        self._series: dict[tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def expose(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+        bounds = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_label_text((*self.labels, 'le'), (*key, bound))} {cumulative}"
+            labels = _label_text(self.labels, key)
+            yield f"{self.name}_sum{labels} {total:.6f}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    """Metrics recorded on the hot path are plain locked adds; everything
+    derived from other components' state (queues, cache) is only gathered by
+    collectors when /api/metrics is scraped."""
+
+    def __init__(self):
+        self._metrics: list[Counter | Histogram] = []
+        self._collectors: list[Collector] = []
+
+    def counter(self, name: str, help_text: str, labels: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labels: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Collector) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.expose())
+        for collector in self._collectors:
+            try:
+                lines.extend(collector())
+            except Exception as exc:
+                print(f"Metrics collector failed: {exc}")
+        return "\n".join(lines) + "\n"
+
+
+def gauge_lines(name: str, help_text: str, samples: Iterable[tuple[dict[str, str], float]],
+                kind: str = "gauge") -> Iterator[str]:
+    """Exposition lines for a value read at scrape time."""
+    yield f"# HELP {name} {help_text}"
+    yield f"# TYPE {name} {kind}"
+    for labels, value in samples:
+        yield f"{name}{_label_text(tuple(labels), tuple(labels.values()))} {_number(value)}"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    "scanner_pipeline_stage_seconds",
+    "Time spent in each image pipeline stage.",
+    ("stage",),
+)
+PAGES_PROCESSED = registry.counter(
+    "scanner_pages_processed_total",
+    "Pages run through the pipeline or served from the page cache.",
+    ("source",),
+)
+QUALITY_CHECKS = registry.counter(
+    "scanner_quality_checks_total",
+    "Capture quality checks by outcome.",
+    ("result",),
+)
+CAPTURE_RENDERS = registry.counter(
+    "scanner_capture_renders_total",
+    "Scans rendered again from their raw captures, by trigger (lazy, job).",
+    ("trigger",),
+)
+DETECT_BATCH_SIZE = registry.histogram(
+    "scanner_detect_batch_size",
+    "Frames taken per detection batch.",
+    buckets=(1, 2, 4, 8, 16, 32),
+)
+DETECT_FRAMES = registry.counter(
+    "scanner_detect_frames_total",
+    "Preview frames by outcome (detected, none, superseded, expired).",
+    ("result",),
+)
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "scanner_http_request_seconds",
+    "HTTP request latency until the response is complete.",
+    ("router", "route", "method"),
+)
+HTTP_REQUESTS = registry.counter(
+    "scanner_http_requests_total",
+    "HTTP requests by response status.",
+    ("router", "route", "method", "status"),
+)
+HTTP_REQUEST_BYTES = registry.counter(
+    "scanner_http_request_bytes_total",
+    "Request body bytes received.",
+    ("router", "route"),
+)
+HTTP_RESPONSE_BYTES = registry.counter(
+    "scanner_http_response_bytes_total",
+    "Response body bytes sent.",
+    ("router", "route"),
+)
+
+
+_local = threading.local()
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time a pipeline stage.
+
+    Recorded straight into the stage histogram, or into the list opened by
+    captured_spans() (pool workers ship theirs back to the server process).
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        sink = getattr(_local, "sink", None)
+        if sink is not None:
+            sink.append((stage, elapsed))
+        else:
+            STAGE_SECONDS.observe(elapsed, stage=stage)
+
+
+@contextmanager
+def captured_spans() -> Iterator[list[Span]]:
+    previous = getattr(_local, "sink", None)
+    _local.sink = spans = []
+    try:
+        yield spans
+    finally:
+        _local.sink = previous
+
+
+def record_spans(spans: Iterable[Span]) -> None:
+    for stage, elapsed in spans:
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency, status and body sizes.
+
+    Counts bytes as they stream through, so nothing is buffered; routes are
+    labelled by their path template (unmatched paths share one label).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        received = 0
+        sent = 0
+        status = 500
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal sent, status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            router, route = _route_labels(scope)
+            method = scope["method"]
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, router=router, route=route, method=method)
+            HTTP_REQUESTS.inc(router=router, route=route, method=method, status=status)
+            if received:
+                HTTP_REQUEST_BYTES.inc(received, router=router, route=route)
+            if sent:
+                HTTP_RESPONSE_BYTES.inc(sent, router=router, route=route)
+
+
+def _route_labels(scope) -> tuple[str, str]:
+    endpoint = scope.get("endpoint")
+    route = scope.get("route")
+    path = getattr(route, "path", None) or getattr(route, "path_format", None)
+    if endpoint is None and path is None:
+        return "none", "unmatched"
+    module = getattr(endpoint, "__module__", "") or ""
+    router = module.rsplit(".", 1)[-1] if module.startswith("routes.") else "static"
+    return router, path or getattr(endpoint, "__name__", "unknown")
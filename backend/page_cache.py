@@ -0,0 +1,232 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+import cv2
+import numpy as np
+
+from config import BACKEND_DIR, config_snapshot
+from metrics import gauge_lines, registry
+
+
+CACHE_DIR = BACKEND_DIR / "page_cache"
+CACHE_EXTENSION = ".png"
+PNG_COMPRESSION = 1
+MB = 1024 * 1024
+
+_cache: "PageCache | None" = None
+_cache_lock = threading.Lock()
+_cache_disabled = False
+
+
+def cache_key(img_bytes: bytes, options: dict[str, Any]) -> str:
+    """Hash of the upload bytes plus the effective processing options
+    (including any corner/skew hints)."""
+    digest = hashlib.sha256(img_bytes)
+    digest.update(json.dumps(options, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def write_cache_file(path: Path, image: np.ndarray) -> None:
+    """Write a processed page losslessly; atomic so readers never see a partial file."""
+    temp_path = path.with_name(f"{path.stem}.tmp{CACHE_EXTENSION}")
+    if not cv2.imwrite(str(temp_path), image, [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]):
+        raise OSError(f"Could not write cache file {temp_path}")
+    os.replace(temp_path, path)
+
+
+class PageCache:
+    """Two-tier LRU cache of processed pages, bounded by size in bytes."""
+
+    def __init__(self, directory: Path, memory_bytes: int, disk_bytes: int):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._memory_used = 0
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_used = 0
+        self._lock = threading.Lock()
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self._load_disk_index()
+
+    def _load_disk_index(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entries = []
+        for path in self.directory.glob(f"*{CACHE_EXTENSION}"):
+            if ".tmp" in path.name:
+                path.unlink(missing_ok=True)
+                continue
+            stat = path.stat()
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_used += size
+        self._evict_disk()
+
+    def disk_path(self, key: str) -> Path:
+        return self.directory / f"{key}{CACHE_EXTENSION}"
+
+    def get(self, key: str) -> np.ndarray | None:
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None:
+                self._memory.move_to_end(key)
+                self.hits["memory"] += 1
+                return image
+            on_disk = key in self._disk
+
+        if on_disk:
+            path = self.disk_path(key)
+            image = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
+            if image is not None:
+                os.utime(path)
+                with self._lock:
+                    self.hits["disk"] += 1
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                    self._remember(key, image)
+                return image
+            self._forget_disk(key)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, image: np.ndarray, written_to_disk: bool = False) -> None:
+        """Store a processed page. Pass written_to_disk when a worker already
+        wrote disk_path(key) so the page isn't encoded twice."""
+        if not written_to_disk:
+            try:
+                write_cache_file(self.disk_path(key), image)
+                written_to_disk = True
+            except OSError as exc:
+                print(f"Page cache write failed: {exc}")
+
+        with self._lock:
+            self._remember(key, image)
+            if written_to_disk:
+                try:
+                    size = self.disk_path(key).stat().st_size
+                except OSError:
+                    return
+                self._disk_used += size - self._disk.pop(key, 0)
+                self._disk[key] = size
+                self._evict_disk()
+
+    def _remember(self, key: str, image: np.ndarray) -> None:
+        if image.nbytes > self.memory_bytes:
+            return
+        # Cached arrays are shared between requests
+        image.flags.writeable = False
+        self._memory_used += image.nbytes - (self._memory[key].nbytes if key in self._memory else 0)
+        self._memory[key] = image
+        self._memory.move_to_end(key)
+        while self._memory_used > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= evicted.nbytes
+
+    def _evict_disk(self) -> None:
+        while self._disk_used > self.disk_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_used -= size
+            self.disk_path(key).unlink(missing_ok=True)
+
+    def _forget_disk(self, key: str) -> None:
+        with self._lock:
+            size = self._disk.pop(key, None)
+            if size is not None:
+                self._disk_used -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._memory_used = 0
+            for key in self._disk:
+                self.disk_path(key).unlink(missing_ok=True)
+            self._disk.clear()
+            self._disk_used = 0
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            hits = self.hits["memory"] + self.hits["disk"]
+            lookups = hits + self.misses
+            return {
+                "enabled": True,
+                "hits": hits,
+                "memory_hits": self.hits["memory"],
+                "disk_hits": self.hits["disk"],
+                "misses": self.misses,
+                "hit_ratio": round(hits / lookups, 3) if lookups else None,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_used,
+                "memory_limit_bytes": self.memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_used,
+                "disk_limit_bytes": self.disk_bytes,
+            }
+
+
+def disable_cache() -> None:
+    """Bypass the cache for the rest of this process, whatever the config says
+    (the benchmark has to time the pipeline, not cache hits)."""
+    global _cache_disabled
+    _cache_disabled = True
+
+
+def get_cache() -> PageCache | None:
+    """The process-wide page cache, or None when disabled in the config."""
+    global _cache
+    with _cache_lock:
+        if _cache_disabled:
+            return None
+        if _cache is None:
+            cache_config = config_snapshot()["page_cache"]
+            if not cache_config["enabled"]:
+                return None
+            _cache = PageCache(
+                CACHE_DIR,
+                int(cache_config["memory_mb"]) * MB,
+                int(cache_config["disk_mb"]) * MB,
+            )
+        return _cache
+
+
+def cache_stats() -> dict[str, Any]:
+    cache = get_cache()
+    if cache is None:
+        return {"enabled": False}
+    return cache.stats()
+
+
+def _collect_metrics():
+    stats = cache_stats()
+    if not stats["enabled"]:
+        return
+    yield from gauge_lines(
+        "scanner_page_cache_hits_total",
+        "Page cache hits by tier.",
+        [({"tier": "memory"}, stats["memory_hits"]), ({"tier": "disk"}, stats["disk_hits"])],
+        kind="counter",
+    )
+    yield from gauge_lines(
+        "scanner_page_cache_misses_total", "Page cache misses.", [({}, stats["misses"])], kind="counter"
+    )
+    yield from gauge_lines(
+        "scanner_page_cache_entries",
+        "Entries held by the page cache.",
+        [({"tier": "memory"}, stats["memory_entries"]), ({"tier": "disk"}, stats["disk_entries"])],
+    )
+    yield from gauge_lines(
+        "scanner_page_cache_bytes",
+        "Bytes held by the page cache.",
+        [({"tier": "memory"}, stats["memory_bytes"]), ({"tier": "disk"}, stats["disk_bytes"])],
+    )
+
+
+registry.add_collector(_collect_metrics)
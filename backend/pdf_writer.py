@@ -0,0 +1,169 @@
+from pathlib import Path
+
+
+# A4 in PDF points (1/72 inch)
+A4 = (595.2756, 841.8898)
+PAGE_MARGIN = 50
+
+
+def fit_image(img_width: int, img_height: int, page_size: tuple[float, float] = A4) -> tuple[float, float, float, float]:
+    """Position (x, y, width, height) that fits an image inside the page margins."""
+    page_width, page_height = page_size
+    aspect = img_height / float(img_width)
+    available_width = page_width - (2 * PAGE_MARGIN)
+    available_height = page_height - (2 * PAGE_MARGIN)
+
+    if img_width > img_height:
+        new_width = available_width
+        new_height = new_width * aspect
+        if new_height > available_height:
+            new_height = available_height
+            new_width = new_height / aspect
+    else:
+        new_height = available_height
+        new_width = new_height / aspect
+        if new_width > available_width:
+            new_width = available_width
+            new_height = new_width * aspect
+
+    x = (page_width - new_width) / 2
+    y = (page_height - new_height) / 2
+    return x, y, new_width, new_height
+
+
+class StreamingPdfWriter:
+    """Write a PDF one page at a time.
+
+    Each page image is embedded as-is (JPEG data goes in with DCTDecode, no
+    decode/re-encode) and written straight to the file, so memory use does
+    not grow with the page count; only object offsets are kept.
+    """
+
+    CATALOG_ID = 1
+    PAGES_ID = 2
+
+    def __init__(self, path: Path, page_size: tuple[float, float] = A4):
+        self.path = Path(path)
+        self.page_size = page_size
+        self._file = self.path.open("wb")
+        self._offsets: dict[int, int] = {}
+        self._page_ids: list[int] = []
+        self._next_id = self.PAGES_ID + 1
+        self._file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def __enter__(self) -> "StreamingPdfWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        if exc_type is None:
+            self.close()
+            return
+        # Don't leave a truncated PDF behind
+        self._file.close()
+        self.path.unlink(missing_ok=True)
+
+    @property
+    def page_count(self) -> int:
+        return len(self._page_ids)
+
+    def _allocate(self) -> int:
+        object_id = self._next_id
+        self._next_id += 1
+        return object_id
+
+    def _write_object(self, object_id: int, body: bytes, stream: bytes | None = None) -> None:
+        self._offsets[object_id] = self._file.tell()
+        self._file.write(f"{object_id} 0 obj\n".encode("ascii"))
+        self._file.write(body)
+        if stream is not None:
+            self._file.write(b"\nstream\n")
+            self._file.write(stream)
+            self._file.write(b"\nendstream")
+        self._file.write(b"\nendobj\n")
+
+    def add_jpeg_page(self, jpeg_bytes: bytes, width: int, height: int, grayscale: bool = False) -> None:
+        """Add a page showing an encoded JPEG, centred within the margins."""
+        color_space = "/DeviceGray" if grayscale else "/DeviceRGB"
+        self.add_image_page(
+            jpeg_bytes,
+            width,
+            height,
+            f"/ColorSpace {color_space} /BitsPerComponent 8 /Filter /DCTDecode",
+        )
+
+    def add_ccitt_page(self, g4_bytes: bytes, width: int, height: int) -> None:
+        """Add a page showing a bilevel image coded as CCITT Group 4
+        (ink as black runs, so the default BlackIs1 false applies)."""
+        self.add_image_page(
+            g4_bytes,
+            width,
+            height,
+            "/ColorSpace /DeviceGray /BitsPerComponent 1 /Filter /CCITTFaxDecode "
+            f"/DecodeParms << /K -1 /Columns {width} /Rows {height} >>",
+        )
+
+    def add_bilevel_page(self, packed_bytes: bytes, width: int, height: int) -> None:
+        """Add a page showing zlib-compressed 1-bit rows (1 = white)."""
+        self.add_image_page(
+            packed_bytes,
+            width,
+            height,
+            "/ColorSpace /DeviceGray /BitsPerComponent 1 /Filter /FlateDecode",
+        )
+
+    def add_image_page(self, data: bytes, width: int, height: int, image_params: str) -> None:
+        """Add a page showing one already-encoded image XObject.
+
+        image_params carries the colour space, bit depth and filter entries
+        of the image dictionary.
+        """
+        image_id = self._allocate()
+        content_id = self._allocate()
+        page_id = self._allocate()
+
+        self._write_object(
+            image_id,
+            (
+                f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                f"{image_params} /Length {len(data)} >>"
+            ).encode("ascii"),
+            data,
+        )
+
+        x, y, draw_width, draw_height = fit_image(width, height, self.page_size)
+        content = f"q {draw_width:.2f} 0 0 {draw_height:.2f} {x:.2f} {y:.2f} cm /Im0 Do Q".encode("ascii")
+        self._write_object(content_id, f"<< /Length {len(content)} >>".encode("ascii"), content)
+
+        page_width, page_height = self.page_size
+        self._write_object(
+            page_id,
+            (
+                f"<< /Type /Page /Parent {self.PAGES_ID} 0 R "
+                f"/MediaBox [0 0 {page_width:.4f} {page_height:.4f}] "
+                f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> "
+                f"/Contents {content_id} 0 R >>"
+            ).encode("ascii"),
+        )
+        self._page_ids.append(page_id)
+        self._file.flush()
+
+    def close(self) -> None:
+        kids = " ".join(f"{page_id} 0 R" for page_id in self._page_ids)
+        self._write_object(
+            self.PAGES_ID,
+            f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>".encode("ascii"),
+        )
+        self._write_object(
+            self.CATALOG_ID,
+            f"<< /Type /Catalog /Pages {self.PAGES_ID} 0 R >>".encode("ascii"),
+        )
+
+        xref_offset = self._file.tell()
+        size = self._next_id
+        lines = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        for object_id in range(1, size):
+            lines.append(f"{self._offsets[object_id]:010d} 00000 n \n")
+        lines.append(f"trailer\n<< /Size {size} /Root {self.CATALOG_ID} 0 R >>\n")
+        lines.append(f"startxref\n{xref_offset}\n%%EOF\n")
+        self._file.write("".join(lines).encode("ascii"))
+        self._file.close()
@@ -0,0 +1,197 @@
+# Process pool for the OpenCV pipeline. Pages go in as encoded upload bytes;
+# processed arrays come back through a shared-memory block the parent
+# allocates (sized from the image header) and owns, so it stays alive on
+# Windows, where a segment vanishes once its last handle is closed.
+
+import io
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Any
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from config import config_snapshot
+from metrics import PAGES_PROCESSED, captured_spans, gauge_lines, record_spans, registry
+from page_cache import cache_key, get_cache, write_cache_file
+
+
+_executor: ProcessPoolExecutor | None = None
+_executor_lock = threading.Lock()
+# Pages submitted to the pool and not yet collected
+_in_flight = 0
+
+
+def worker_count(configured: int = 0) -> int:
+    if configured > 0:
+        return configured
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+def pool_size() -> int:
+    return worker_count(int(config_snapshot()["processing_pool"]["workers"]))
+
+
+def _init_worker(opencv_threads: int) -> None:
+    # One pool worker per core already saturates the CPU; OpenCV's own thread
+    # pool on top of that only oversubscribes it.
+    cv2.setNumThreads(opencv_threads)
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            pool_config = config_snapshot()["processing_pool"]
+            _executor = ProcessPoolExecutor(
+                max_workers=worker_count(int(pool_config["workers"])),
+                initializer=_init_worker,
+                initargs=(int(pool_config["opencv_threads"]),),
+            )
+        return _executor
+
+
+def shutdown() -> None:
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _decoded_size(img_bytes: bytes) -> int:
+    """Bytes needed for the decoded BGR image, read from the header only."""
+    try:
+        with Image.open(io.BytesIO(img_bytes)) as img:
+            width, height = img.size
+    except Exception:
+        return 0
+    return width * height * 3
+
+
+def _process_in_worker(
+    img_bytes: bytes,
+    shm_name: str,
+    options: dict[str, Any],
+    cache_path: str | None = None,
+):
+    with captured_spans() as spans:
+        return spans, *_process_page(img_bytes, shm_name, options, cache_path)
+
+
+def _process_page(img_bytes: bytes, shm_name: str, options: dict[str, Any], cache_path: str | None):
+    """Returns (whether the disk cache entry was written, result)."""
+    from image_processor import process_document_bytes
+
+    image = process_document_bytes(img_bytes, **options)
+    if image is None:
+        return False, None
+
+    written = False
+    if cache_path is not None:
+        # Encode the disk cache entry here, in parallel, not in the server.
+        try:
+            write_cache_file(Path(cache_path), image)
+            written = True
+        except OSError as exc:
+            print(f"Page cache write failed: {exc}")
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        if image.nbytes <= shm.size:
+            np.ndarray(image.shape, image.dtype, buffer=shm.buf)[...] = image
+            return written, ("shared", image.shape, image.dtype.str)
+    finally:
+        shm.close()
+
+    # Output larger than the decoded input (rare): fall back to pickling.
+    return written, ("inline", image)
+
+
+def _read_result(result, shm: shared_memory.SharedMemory) -> tuple[bool, np.ndarray | None]:
+    spans, written, result = result
+    # Stage timings measured in the worker
+    record_spans(spans)
+    if result is None:
+        return False, None
+    if result[0] == "inline":
+        return written, result[1]
+    _, shape, dtype = result
+    return written, np.ndarray(shape, np.dtype(dtype), buffer=shm.buf).copy()
+
+
+def submit_page(img_bytes: bytes, **options) -> Future:
+    """Process one page in the pool.
+
+    The returned future resolves to the processed array, or None when the
+    bytes are not a readable image.
+    """
+    result: Future = Future()
+    cache = get_cache()
+    key = cache_key(img_bytes, options) if cache is not None else None
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            PAGES_PROCESSED.inc(source="cache")
+            result.set_result(cached)
+            return result
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, _decoded_size(img_bytes)))
+    cache_path = str(cache.disk_path(key)) if cache is not None else None
+
+    def collect(done: Future) -> None:
+        global _in_flight
+        with _executor_lock:
+            _in_flight -= 1
+        try:
+            written, image = _read_result(done.result(), shm)
+            result.set_result(image)
+        except BaseException as exc:
+            result.set_exception(exc)
+            return
+        finally:
+            shm.close()
+            shm.unlink()
+        if image is not None:
+            PAGES_PROCESSED.inc(source="pipeline")
+        if cache is not None and image is not None:
+            # A failed worker write is retried here rather than recorded
+            cache.put(key, image, written_to_disk=written)
+
+    global _in_flight
+    try:
+        future = get_executor().submit(_process_in_worker, img_bytes, shm.name, options, cache_path)
+        with _executor_lock:
+            _in_flight += 1
+        future.add_done_callback(collect)
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    return result
+
+
+def process_pages(pages: list[bytes], options: list[dict[str, Any]]) -> list[np.ndarray | None]:
+    """Process pages in parallel and return the results in page order."""
+    futures = [submit_page(page, **page_options) for page, page_options in zip(pages, options)]
+    return [future.result() for future in futures]
+
+
+def _collect_metrics():
+    yield from gauge_lines(
+        "scanner_processing_pool_pages_in_flight",
+        "Pages submitted to the worker pool and not finished yet.",
+        [({}, _in_flight)],
+    )
+    yield from gauge_lines(
+        "scanner_processing_pool_workers",
+        "Configured worker processes.",
+        [({}, pool_size())],
+    )
+
+
+registry.add_collector(_collect_metrics)
@@ -0,0 +1,94 @@
+# Capture quality gate: a cheap check on a reduced decode of the upload that
+# runs before any pipeline work, so blurry, badly exposed or glare-ruined
+# pages can be retaken instead of processed and saved.
+
+from typing import Any, Mapping
+
+from config import config_snapshot
+from image_processor import QUALITY_MAX_DIMENSION, decode_image_proxy, measure_quality
+from metrics import QUALITY_CHECKS, span
+from scan_output import UnreadablePageError
+
+
+_ISSUES = {
+    "min_sharpness": "blurry",
+    "min_brightness": "too_dark",
+    "max_brightness": "too_bright",
+    "max_highlight_clipping": "glare",
+    "max_shadow_clipping": "underexposed",
+}
+
+
+def quality_thresholds() -> Mapping[str, Any]:
+    return config_snapshot()["quality_gate"]
+
+
+def _at_least(value: float, limit: float) -> float:
+    return 0.5 * value / limit if limit > 0 else 1.0
+
+
+def _at_most(value: float, limit: float) -> float:
+    if limit <= 0:
+        return 1.0 if value <= 0 else 0.0
+    return 1.0 - 0.5 * value / limit
+
+
+def _components(measurements: dict[str, Any], thresholds: Mapping[str, Any]) -> dict[str, float]:
+    """Per-setting scores in 0..1, where 0.5 is exactly at the threshold."""
+    brightness = measurements["brightness"]
+    components = {
+        "min_sharpness": _at_least(measurements["sharpness"], float(thresholds["min_sharpness"])),
+        "min_brightness": _at_least(brightness, float(thresholds["min_brightness"])),
+        # Headroom below white, against the headroom the limit leaves
+        "max_brightness": _at_least(255.0 - brightness, 255.0 - float(thresholds["max_brightness"])),
+        "max_highlight_clipping": _at_most(measurements["highlight_clipping"],
+                                           float(thresholds["max_highlight_clipping"])),
+        "max_shadow_clipping": _at_most(measurements["shadow_clipping"],
+                                        float(thresholds["max_shadow_clipping"])),
+    }
+    return {setting: min(1.0, max(0.0, score)) for setting, score in components.items()}
+
+
+def assess(measurements: dict[str, Any], thresholds: Mapping[str, Any]) -> dict[str, Any]:
+    """Score measurements from measure_quality against the thresholds.
+
+    The score is the weakest component, so it drops below 0.5 exactly when a
+    check fails; ``issues`` names the failed checks.
+    """
+    components = _components(measurements, thresholds)
+    issues = [_ISSUES[setting] for setting, score in components.items() if score < 0.5]
+    score = min(components.values())
+    if not measurements["document_found"] and thresholds.get("require_document"):
+        issues.append("no_document")
+        score = min(score, 0.0)
+    return {
+        "ok": not issues,
+        "score": round(score, 3),
+        "issues": issues,
+        "measurements": measurements,
+    }
+
+
+def check_page(img_bytes: bytes, corners=None, thresholds: Mapping[str, Any] | None = None) -> dict[str, Any]:
+    """Quality report for one encoded capture; corners is the phone's
+    outline hint, as for the save endpoints."""
+    with span("quality_check"):
+        image = decode_image_proxy(img_bytes, QUALITY_MAX_DIMENSION)
+        if image is None:
+            raise UnreadablePageError("Page is not a readable image")
+        report = assess(measure_quality(image, corners), thresholds or quality_thresholds())
+    QUALITY_CHECKS.inc(result="pass" if report["ok"] else "fail")
+    return report
+
+
+def check_pages(pages: list[bytes], corners: list) -> list[dict[str, Any]]:
+    """Quality reports for several captures, with one corner hint (or None)
+    per page."""
+    thresholds = quality_thresholds()
+    reports = []
+    for index, (page, page_corners) in enumerate(zip(pages, corners)):
+        try:
+            reports.append(check_page(page, page_corners, thresholds))
+        except UnreadablePageError:
+            raise UnreadablePageError(f"Page {index + 1} is not a readable image") from None
+    return reports
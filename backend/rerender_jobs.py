@@ -0,0 +1,260 @@
+# Re-rendering kept captures (see capture_archive) after the processing
+# settings change. A capture is rendered again either lazily, when one of its
+# files is requested while stale, or by a background job that works through a
+# folder a few captures at a time. Jobs are persisted and resumed after a
+# restart; captures already rendered with the job's settings are skipped, so
+# a resumed job only does the remaining work.
+
+import json
+import re
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any
+
+from capture_archive import (
+    CaptureNotFound,
+    archive_config,
+    find_capture,
+    iter_captures,
+    load_pages,
+    output_folder,
+    read_manifest,
+    resolve_folder,
+    settings_key,
+    write_manifest,
+)
+from config import BACKEND_DIR, get_image_processing_config
+from metrics import CAPTURE_RENDERS, span
+from scan_output import render_scan
+from storage import file_removed, file_written
+
+
+RERENDER_JOBS_DIR = BACKEND_DIR / "rerender_jobs"
+JOB_RETENTION = timedelta(days=7)
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+TERMINAL_STATUSES = {"done", "error", "superseded"}
+
+_jobs: dict[str, "RerenderJob"] = {}
+_lock = threading.Lock()
+# One lock per capture directory, so a lazy render and a job never write
+# the same scan at once
+_capture_locks: dict[str, threading.Lock] = {}
+_resumed = False
+
+
+@dataclass
+class RerenderJob:
+    job_id: str
+    folder: str
+    settings: dict[str, Any]
+    status: str = "queued"
+    captures_total: int = 0
+    captures_done: int = 0
+    captures_rendered: int = 0
+    errors: list[dict[str, str]] = field(default_factory=list)
+    created_at: str = field(default_factory=lambda: datetime.now().isoformat(timespec="seconds"))
+    updated_at: str | None = None
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+def _capture_lock(directory: Path) -> threading.Lock:
+    with _lock:
+        return _capture_locks.setdefault(str(directory), threading.Lock())
+
+
+def render_capture(directory: Path, settings: dict[str, Any], trigger: str = "lazy") -> bool:
+    """Render a capture's scan files again unless they already match these
+    settings; returns whether anything was rendered.
+
+    The files are written to a staging folder inside the capture first and
+    then moved over the old ones, so a scan is never left half-written. File
+    names can change (a page turning bilevel becomes a PNG); files the new
+    rendering no longer has are removed.
+    """
+    key = settings_key(settings)
+    with _capture_lock(directory):
+        manifest = read_manifest(directory)
+        if manifest is None:
+            raise CaptureNotFound(str(directory))
+        if manifest.get("settings_key") == key:
+            return False
+
+        folder = output_folder(directory)
+        staging = directory / "render"
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir()
+        with span("rerender"):
+            rendered = render_scan(
+                manifest["output"],
+                load_pages(directory, manifest),
+                manifest["data"],
+                settings,
+                staging / directory.name,
+            )
+        files = [path.name for path in rendered]
+        for path in rendered:
+            path.replace(folder / path.name)
+            file_written(folder / path.name)
+        for name in manifest["files"]:
+            if name not in files:
+                (folder / name).unlink(missing_ok=True)
+                file_removed(folder / name)
+        shutil.rmtree(staging, ignore_errors=True)
+
+        manifest.update(
+            files=files,
+            settings=settings,
+            settings_key=key,
+            rendered_at=datetime.now().isoformat(timespec="seconds"),
+        )
+        write_manifest(directory, manifest)
+    CAPTURE_RENDERS.inc(trigger=trigger)
+    return True
+
+
+def current_file(path: Path) -> Path:
+    """A kept scan's file under the current settings, rendering its capture
+    again first when it is stale. Follows renames by page position."""
+    directory = find_capture(path)
+    index = read_manifest(directory)["files"].index(path.name)
+    render_capture(directory, get_image_processing_config())
+    files = read_manifest(directory)["files"]
+    return path.parent / files[min(index, len(files) - 1)]
+
+
+def _job_path(job_id: str) -> Path:
+    return RERENDER_JOBS_DIR / f"{job_id}.json"
+
+
+def _write_state(job: RerenderJob) -> None:
+    job.updated_at = datetime.now().isoformat(timespec="seconds")
+    RERENDER_JOBS_DIR.mkdir(parents=True, exist_ok=True)
+    state_path = _job_path(job.job_id)
+    temp_path = state_path.with_suffix(".tmp")
+    with temp_path.open("w", encoding="utf-8") as state_file:
+        json.dump(job.to_dict(), state_file, indent=2, ensure_ascii=False)
+        state_file.write("\n")
+    temp_path.replace(state_path)
+
+
+def _superseded(job: RerenderJob) -> bool:
+    with _lock:
+        return job.status == "superseded"
+
+
+def _run_job(job: RerenderJob) -> None:
+    directories = [directory for directory, _ in iter_captures(Path(job.folder))]
+    with _lock:
+        if job.status == "superseded":
+            return
+        job.status = "processing"
+        job.captures_total = len(directories)
+        job.captures_done = 0
+        job.captures_rendered = 0
+    _write_state(job)
+
+    def render(directory: Path) -> bool:
+        # Captures still waiting when a newer job takes over are left to it
+        if _superseded(job):
+            return False
+        return render_capture(directory, job.settings, trigger="job")
+
+    workers = max(1, int(archive_config()["workers"]))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rerender") as executor:
+        futures = {executor.submit(render, directory): directory for directory in directories}
+        for future in as_completed(futures):
+            with _lock:
+                job.captures_done += 1
+                try:
+                    job.captures_rendered += future.result()
+                except Exception as exc:
+                    job.errors.append({"capture": futures[future].name, "error": str(exc)})
+            _write_state(job)
+
+    with _lock:
+        if job.status != "superseded":
+            job.status = "error" if job.errors else "done"
+    _write_state(job)
+    print(f"Re-render of {job.folder}: {job.captures_rendered} of {job.captures_total} scans rendered, "
+          f"{len(job.errors)} failed")
+
+
+def _start(job: RerenderJob) -> None:
+    with _lock:
+        # A newer job for the same folder replaces any still running there
+        for other in _jobs.values():
+            if other.folder == job.folder and other.status not in TERMINAL_STATUSES:
+                other.status = "superseded"
+        _jobs[job.job_id] = job
+    _write_state(job)
+    threading.Thread(target=_run_job, args=(job,), name=f"rerender-{job.job_id[:8]}", daemon=True).start()
+
+
+def start_rerender(folder: str | None = None) -> dict[str, Any]:
+    """Re-render every kept capture of a folder (the scan folder by
+    default) with the current settings, in the background."""
+    job = RerenderJob(uuid.uuid4().hex, str(resolve_folder(folder)), get_image_processing_config())
+    _start(job)
+    return job.to_dict()
+
+
+def get_job(job_id: str) -> dict[str, Any] | None:
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+
+    if not JOB_ID_PATTERN.fullmatch(job_id):
+        return None
+    try:
+        with _job_path(job_id).open("r", encoding="utf-8") as state_file:
+            return json.load(state_file)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def resume_pending_jobs() -> None:
+    """Restart re-renders interrupted by a restart and drop old finished ones."""
+    global _resumed
+    with _lock:
+        if _resumed:
+            return
+        _resumed = True
+
+    if not RERENDER_JOBS_DIR.exists():
+        return
+
+    cutoff = datetime.now() - JOB_RETENTION
+    pending = []
+    for state_path in RERENDER_JOBS_DIR.glob("*.json"):
+        try:
+            with state_path.open("r", encoding="utf-8") as state_file:
+                job = RerenderJob(**json.load(state_file))
+        except (OSError, TypeError, json.JSONDecodeError):
+            continue
+
+        if job.status in TERMINAL_STATUSES:
+            if datetime.fromisoformat(job.updated_at or job.created_at) < cutoff:
+                state_path.unlink(missing_ok=True)
+            continue
+        pending.append(job)
+
+    # Only the newest unfinished job per folder still matters
+    newest: dict[str, RerenderJob] = {}
+    for job in sorted(pending, key=lambda job: job.created_at):
+        newest[job.folder] = job
+    for job in pending:
+        if newest[job.folder] is not job:
+            job.status = "superseded"
+            _write_state(job)
+    for job in newest.values():
+        print(f"Resuming re-render of {job.folder}")
+        job.status = "queued"
+        _start(job)
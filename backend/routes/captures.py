@@ -0,0 +1,75 @@
+from pathlib import Path
+
+from fastapi import APIRouter, Request
+from fastapi.responses import FileResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+from capture_archive import CaptureNotFound, capture_summary, iter_captures, resolve_folder, settings_key
+from config import get_image_processing_config
+from rerender_jobs import current_file, get_job, start_rerender
+
+
+router = APIRouter(prefix="/api/captures")
+
+
+def _error(exc: Exception) -> JSONResponse:
+    if isinstance(exc, CaptureNotFound):
+        return JSONResponse({"status": "error", "message": "No kept capture for that file"}, status_code=404)
+    if isinstance(exc, ValueError):
+        return JSONResponse({"status": "error", "message": str(exc)}, status_code=400)
+    return JSONResponse({"status": "error", "message": str(exc)}, status_code=500)
+
+
+@router.get("")
+async def list_captures(folder: str | None = None):
+    """Scans of a folder that have their raw captures kept, and whether each
+    is stale under the current processing settings."""
+    try:
+        path = resolve_folder(folder)
+        current_key = settings_key(get_image_processing_config())
+        captures = [capture_summary(directory, manifest, current_key) for directory, manifest in iter_captures(path)]
+        return JSONResponse({
+            "folder": str(path),
+            "captures": captures,
+            "stale": sum(capture["stale"] for capture in captures),
+        })
+    except Exception as exc:
+        return _error(exc)
+
+
+@router.get("/file")
+async def capture_file(path: str):
+    """Serve a scan file, rendering it again first if its capture is stale.
+    The file name may have changed in the process (e.g. JPEG to PNG)."""
+    try:
+        requested = Path(path).expanduser()
+        resolve_folder(str(requested.parent))
+        return FileResponse(await run_in_threadpool(current_file, requested))
+    except Exception as exc:
+        return _error(exc)
+
+
+@router.post("/rerender")
+async def rerender(req: Request):
+    """Start re-rendering a folder's kept captures (``{"folder": ...}``, the
+    scan folder by default) with the current settings."""
+    try:
+        body = await req.body()
+        data = await req.json() if body else {}
+        job = await run_in_threadpool(start_rerender, data.get("folder"))
+        status_url = f"/api/captures/rerender/{job['job_id']}"
+        return JSONResponse(
+            {"status": "accepted", "job": job, "status_url": status_url},
+            status_code=202,
+            headers={"Location": status_url},
+        )
+    except Exception as exc:
+        return _error(exc)
+
+
+@router.get("/rerender/{job_id}")
+async def rerender_status(job_id: str):
+    job = get_job(job_id)
+    if job is None:
+        return JSONResponse({"status": "error", "message": "Unknown re-render job"}, status_code=404)
+    return JSONResponse(job)
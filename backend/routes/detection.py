@@ -0,0 +1,43 @@
+import time
+
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+from detection_service import DetectionBusy, get_detection_service
+
+
+router = APIRouter(prefix="/api")
+
+
+async def _read_frame(req: Request) -> bytes:
+    # Raw JPEG body is the fast path; a multipart "image" part also works
+    if req.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await req.form()
+        upload = form.get("image")
+        if upload is None or isinstance(upload, str):
+            raise ValueError("No image provided")
+        return await upload.read()
+    return await req.body()
+
+
+@router.post("/detect")
+async def detect(req: Request):
+    """Document corners for a live-preview thumbnail. Pass a per-phone
+    ``client`` id so stale frames from the same phone can be dropped."""
+    started = time.perf_counter()
+    try:
+        frame = await _read_frame(req)
+        if not frame:
+            raise ValueError("No image provided")
+        result = await get_detection_service().detect(frame, req.query_params.get("client"))
+        return JSONResponse({**result, "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)})
+    except DetectionBusy as exc:
+        return JSONResponse(
+            {"status": "busy", "message": str(exc), "retry_after": exc.retry_after},
+            status_code=503,
+            headers={"Retry-After": str(exc.retry_after)},
+        )
+    except ValueError as exc:
+        return JSONResponse({"status": "error", "message": str(exc)}, status_code=400)
+    except Exception as exc:
+        return JSONResponse({"status": "error", "message": str(exc)}, status_code=500)
@@ -1,21 +1,187 @@
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
+import asyncio
+import hashlib
+import json
 
+from fastapi import APIRouter, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+import folder_watcher
 from config import get_image_processing_config
-from storage import folder_status, list_document_files, scan_folder
+from file_index import FileQuery
+from storage import (
+    RECENT_FILES_LIMIT,
+    active_folder,
+    count_document_files,
+    duplicate_report,
+    file_changes,
+    file_generation,
+    folder_status,
+    job_state_version,
+    list_document_files,
+    scan_folder,
+)
 
 
 router = APIRouter()
 
+MAX_PAGE_SIZE = 1000
+KEEPALIVE_SECONDS = 15
+
+
+def _sse(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def _file_query(sort: str, order: str, source: str | None, extension: str | None) -> FileQuery:
+    if order not in ("asc", "desc"):
+        raise ValueError("order must be asc or desc")
+    extensions = tuple(sorted({
+        f".{item.strip().lower().lstrip('.')}" for item in (extension or "").split(",") if item.strip()
+    }))
+    return FileQuery(source=source, extensions=extensions, sort=sort, descending=order == "desc")
+
+
+def _page_size(limit: int | None) -> int | None:
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+
+def _etag(*parts) -> str:
+    """Weak validator for a listing: the file index generation plus whatever
+    else the response depends on (folders, job state, query parameters)."""
+    digest = hashlib.sha1(json.dumps(parts, default=str).encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def _not_modified(req: Request, etag: str) -> Response | None:
+    if_none_match = req.headers.get("if-none-match", "")
+    if etag in (tag.strip() for tag in if_none_match.split(",")) or if_none_match.strip() == "*":
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return None
+
+
+def _conditional(req: Request, etag: str, build) -> Response:
+    """Answer a poll whose ETag still matches with an empty 304; otherwise
+    build the body. ``no-cache`` makes browsers revalidate every time, so
+    fetch() gets the cached body back on a 304."""
+    not_modified = _not_modified(req, etag)
+    if not_modified is not None:
+        return not_modified
+    return JSONResponse(build(), headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
+def _bad_request(exc: ValueError) -> JSONResponse:
+    return JSONResponse({"status": "error", "message": str(exc)}, status_code=400)
+
 
 @router.get("/api/folder/status")
-async def get_folder_status():
-    return JSONResponse(folder_status())
+async def get_folder_status(
+    req: Request,
+    limit: int = RECENT_FILES_LIMIT,
+    cursor: str | None = None,
+    scans_cursor: str | None = None,
+    sort: str = "modified",
+    order: str = "desc",
+    source: str | None = None,
+    extension: str | None = None,
+):
+    try:
+        query = _file_query(sort, order, source, extension)
+        page_size = _page_size(limit)
+        generation = await run_in_threadpool(file_generation)
+        etag = _etag(
+            generation, job_state_version(), str(active_folder()), str(scan_folder()),
+            query, page_size, cursor, scans_cursor,
+        )
+        return await run_in_threadpool(
+            _conditional, req, etag, lambda: folder_status(query, page_size, cursor, scans_cursor)
+        )
+    except ValueError as exc:
+        return _bad_request(exc)
 
 
 @router.get("/api/folder/files")
-async def get_folder_files(limit: int | None = None):
-    return JSONResponse({"files": list_document_files(limit=limit)})
+async def get_folder_files(
+    req: Request,
+    limit: int | None = None,
+    cursor: str | None = None,
+    offset: int = 0,
+    sort: str = "modified",
+    order: str = "desc",
+    source: str | None = None,
+    extension: str | None = None,
+):
+    """Document files of the active folder, a page at a time: pass the
+    returned ``next_cursor`` back as ``cursor`` for the next page."""
+    try:
+        query = _file_query(sort, order, source, extension)
+        page_size = _page_size(limit)
+        generation = await run_in_threadpool(file_generation)
+        etag = _etag(generation, str(active_folder()), query, page_size, cursor, offset)
+
+        def build():
+            files, next_cursor = list_document_files(query, limit=page_size, cursor=cursor, offset=offset)
+            return {
+                "generation": generation,
+                "files": files,
+                "next_cursor": next_cursor,
+                "total": count_document_files(query),
+            }
+
+        return await run_in_threadpool(_conditional, req, etag, build)
+    except ValueError as exc:
+        return _bad_request(exc)
+
+
+@router.get("/api/folder/changes")
+async def get_folder_changes(since: int):
+    """Files added or changed and paths removed since a generation (from a
+    listing's ``generation``). ``reset`` means the client is too far behind
+    and should list again."""
+    return JSONResponse(await run_in_threadpool(file_changes, since))
+
+
+@router.get("/api/folder/duplicates")
+async def get_folder_duplicates(req: Request):
+    """Files of the active folder with identical content, grouped. The first
+    call hashes every file that shares its size with another; later ones
+    reuse the cached hashes."""
+    generation = await run_in_threadpool(file_generation)
+    etag = _etag("duplicates", generation, str(active_folder()))
+    return await run_in_threadpool(_conditional, req, etag, duplicate_report)
+
+
+@router.get("/api/folder/events")
+async def folder_events():
+    """Server-sent events for the active folder: ``ready`` with the current
+    generation on connect, then ``changes`` (the same shape as
+    /api/folder/changes, plus ``document_count``) after each burst of
+    changes settles."""
+
+    async def stream():
+        # Subscribe before taking the snapshot so no change falls in between
+        queue = folder_watcher.subscribe()
+        try:
+            yield _sse("ready", await run_in_threadpool(folder_watcher.current_state))
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is None:
+                    return
+                yield _sse(message["event"], message["data"])
+        finally:
+            folder_watcher.unsubscribe(queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.get("/health")
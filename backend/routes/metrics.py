@@ -0,0 +1,15 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+
+from metrics import registry
+
+
+router = APIRouter(prefix="/api")
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@router.get("/metrics")
+async def metrics():
+    return Response(registry.render(), media_type=CONTENT_TYPE)
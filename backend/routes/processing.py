@@ -1,7 +1,12 @@
 from fastapi import APIRouter, Request
 from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 
+from capture_archive import archive_config
 from config import get_image_processing_config, update_image_processing_config
+from page_cache import cache_stats, get_cache
+from rerender_jobs import start_rerender
+from scan_queue import get_scan_queue
 
 
 router = APIRouter()
@@ -9,10 +14,20 @@ router = APIRouter()
 
 @router.post("/configure-processing")
 async def configure_processing(req: Request):
+    """Update the image_processing settings. With kept captures, scans
+    already saved are re-rendered in the background: those of
+    ``rerender_folder`` if given, else of the scan folder when
+    ``capture_archive.rerender_on_change`` is on."""
     try:
         config = await req.json()
+        rerender_folder = config.pop("rerender_folder", None)
+        previous = get_image_processing_config()
         updated = update_image_processing_config(config)
-        return JSONResponse({"status": "updated", "config": updated})
+        archive = archive_config()
+        rerender = None
+        if archive["enabled"] and (rerender_folder or (archive["rerender_on_change"] and updated != previous)):
+            rerender = await run_in_threadpool(start_rerender, rerender_folder)
+        return JSONResponse({"status": "updated", "config": updated, "rerender": rerender})
     except Exception as exc:
         return JSONResponse({"status": "error", "message": str(exc)}, status_code=500)
 
@@ -20,3 +35,21 @@ async def configure_processing(req: Request):
 @router.get("/processing-config")
 async def processing_config():
     return JSONResponse(get_image_processing_config())
+
+
+@router.get("/processing-cache")
+async def processing_cache():
+    return JSONResponse(cache_stats())
+
+
+@router.post("/processing-cache/clear")
+async def clear_processing_cache():
+    cache = get_cache()
+    if cache is not None:
+        cache.clear()
+    return JSONResponse({"status": "cleared", "cache": cache_stats()})
+
+
+@router.get("/processing-queue")
+async def processing_queue():
+    return JSONResponse(get_scan_queue().stats())
@@ -0,0 +1,57 @@
+import asyncio
+import json
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from scan_jobs import TERMINAL_STATUSES, get_job, subscribe, unsubscribe
+
+
+router = APIRouter(prefix="/api/scan-jobs")
+
+KEEPALIVE_SECONDS = 15
+
+
+def _sse(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+@router.get("/{job_id}")
+async def scan_job_status(job_id: str):
+    job = get_job(job_id)
+    if job is None:
+        return JSONResponse({"status": "error", "message": "Unknown scan job"}, status_code=404)
+    return JSONResponse(job)
+
+
+@router.get("/{job_id}/events")
+async def scan_job_events(job_id: str):
+    if get_job(job_id) is None:
+        return JSONResponse({"status": "error", "message": "Unknown scan job"}, status_code=404)
+
+    async def stream():
+        # Subscribe before taking the snapshot so no event falls in between
+        queue = subscribe(job_id)
+        try:
+            job = get_job(job_id)
+            yield _sse("status", job)
+            if job["status"] in TERMINAL_STATUSES:
+                return
+
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield _sse(message["event"], message["job"])
+                if message["job"]["status"] in TERMINAL_STATUSES:
+                    return
+        finally:
+            unsubscribe(job_id, queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"},
+    )
@@ -1,94 +1,138 @@
-import base64
-import io
-from datetime import datetime
+import asyncio
+import json
 
 from fastapi import APIRouter, Request
 from fastapi.responses import JSONResponse
-from PIL import Image
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.utils import ImageReader
-from reportlab.pdfgen import canvas
+from starlette.concurrency import run_in_threadpool
 
-from config import get_image_processing_config
-from image_processor import process_document_image
-from storage import save_scan_bytes, scan_folder
+from image_processor import decode_data_url
+from quality_gate import check_page, check_pages
+import scan_sessions
+from scan_jobs import create_job
+from scan_preview import PREVIEW_OVERRIDES, render_preview
+from scan_output import UnreadablePageError, per_page, save_scan_image, save_scan_pages, save_scan_pdf
+from scan_queue import ScanQueueFull, get_scan_queue
 
 
 router = APIRouter()
 
-PDF_IMAGE_MAX_DIMENSION = 1800
-PDF_IMAGE_JPEG_QUALITY = 85
-PAGE_IMAGE_MAX_DIMENSION = 2400
-PAGE_IMAGE_JPEG_QUALITY = 92
 
+def _field_value(value: str):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+async def _read_scan_upload(req: Request, field: str) -> tuple[list[bytes], dict]:
+    """Read scanned pages as raw image bytes plus the remaining form fields.
+
+    Accepts the legacy JSON body with data URLs, ``multipart/form-data`` with
+    one file part per page, or a single page as the raw request body
+    (``application/octet-stream`` / ``image/*``, options in the query string).
+    """
+    content_type = req.headers.get("content-type", "")
+
+    if content_type.startswith("multipart/form-data"):
+        form = await req.form()
+        pages = [await upload.read() for upload in form.getlist(field)]
+        fields = {
+            key: _field_value(value)
+            for key, value in form.multi_items()
+            if key != field and isinstance(value, str)
+        }
+        return pages, fields
+
+    if content_type.startswith(("application/octet-stream", "image/")):
+        fields = {key: _field_value(value) for key, value in req.query_params.items()}
+        return [await req.body()], fields
+
+    data = await req.json()
+    value = data.pop(field, None)
+    if value is None:
+        raise KeyError(field)
+    values = value if isinstance(value, list) else [value]
+    return [decode_data_url(page) for page in values], data
+
+
+def _busy_response(exc: ScanQueueFull) -> JSONResponse:
+    return JSONResponse(
+        {
+            "status": "busy",
+            "message": str(exc),
+            "retry_after": exc.retry_after,
+            "queue": get_scan_queue().stats(),
+        },
+        status_code=503,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
-def _decode_data_url(data_url: str) -> bytes:
-    return base64.b64decode(data_url.split(",", 1)[1])
 
+def _flag(req: Request, data: dict, name: str) -> bool:
+    value = data.get(name, req.query_params.get(name))
+    return value in (True, 1, "1", "true")
 
-def _process_pages(pages: list[str], cropped_flags: list[bool]) -> list[str]:
-    """Process scanned pages, skipping auto-crop for pages the phone already
-    perspective-cropped (re-cropping a clean scan risks cutting into content)."""
-    config = get_image_processing_config()
-    processed = []
-    for index, page in enumerate(pages):
-        page_config = dict(config)
-        if index < len(cropped_flags) and cropped_flags[index]:
-            page_config["auto_crop"] = False
-        processed.append(process_document_image(page, **page_config))
-    return processed
 
+def _is_async(req: Request, data: dict) -> bool:
+    return _flag(req, data, "async")
+
+
+def _page_corners(data: dict, field: str, count: int) -> list:
+    # /save-image sends its one page's outline unwrapped
+    if field == "image":
+        return [data.get("corners")]
+    return [per_page(data.get("corners"), index) for index in range(count)]
 
-def _prepare_pdf_image(page_data: str):
-    img = Image.open(io.BytesIO(_decode_data_url(page_data))).convert("RGB")
-    img.thumbnail(
-        (PDF_IMAGE_MAX_DIMENSION, PDF_IMAGE_MAX_DIMENSION),
-        Image.Resampling.LANCZOS,
-    )
 
-    compressed = io.BytesIO()
-    img.save(
-        compressed,
-        format="JPEG",
-        quality=PDF_IMAGE_JPEG_QUALITY,
-        optimize=True,
-        progressive=True,
+async def _quality_rejection(pages: list[bytes], corners: list) -> JSONResponse | None:
+    """422 with the quality reports when any page fails the quality gate."""
+    reports = await run_in_threadpool(check_pages, pages, corners)
+    failed = [
+        f"page {number}: {', '.join(report['issues'])}"
+        for number, report in enumerate(reports, start=1)
+        if not report["ok"]
+    ]
+    if not failed:
+        return None
+    return JSONResponse(
+        {
+            "status": "rejected",
+            "message": f"Capture quality check failed ({'; '.join(failed)})",
+            "quality": reports,
+        },
+        status_code=422,
     )
-    compressed.seek(0)
-    return ImageReader(compressed), img.size
 
 
-@router.post("/save-image")
-async def save_image(req: Request):
-    try:
-        data = await req.json()
-        img_data = data["image"]
-        processed_img_data = process_document_image(
-            img_data,
-            **get_image_processing_config(),
-        )
-
-        img_bytes = _decode_data_url(processed_img_data)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = save_scan_bytes(f"doc_{timestamp}.png", img_bytes)
-
-        return JSONResponse(
-            {
-                "status": "saved",
-                "file": str(filename),
-                "timestamp": timestamp,
-                "processed": True,
-            }
-        )
-    except Exception as exc:
-        return JSONResponse({"status": "error", "message": str(exc)}, status_code=500)
+def _accepted_response(job) -> JSONResponse:
+    status_url = f"/api/scan-jobs/{job.job_id}"
+    return JSONResponse(
+        {
+            "status": "accepted",
+            "job_id": job.job_id,
+            "pages": job.pages_total,
+            "status_url": status_url,
+            "events_url": f"{status_url}/events",
+        },
+        status_code=202,
+        headers={"Location": status_url},
+    )
 
 
-@router.post("/save-pdf")
-async def save_pdf(req: Request):
+async def _run_scan(req: Request, field: str, save, job_kind: str | None = None) -> JSONResponse:
+    """Run a save on the bounded scan queue, rejecting early when it is full
+    so the event loop (and the desktop controller) stays responsive.
+
+    With ``async`` set (form field, JSON key or query parameter) and a
+    job_kind, the upload is persisted and 202 Accepted returned right away;
+    progress is available from /api/scan-jobs/{id}. With ``quality_gate``
+    set, pages failing the capture quality check are rejected with 422
+    before any processing.
+    """
+    scan_queue = get_scan_queue()
     try:
-        data = await req.json()
-        pages = data.get("pages", [])
+        scan_queue.check()
+        pages, data = await _read_scan_upload(req, field)
 
         if not pages:
             return JSONResponse(
@@ -96,106 +140,188 @@ async def save_pdf(req: Request):
                 status_code=400,
             )
 
-        processed_pages = _process_pages(pages, data.get("cropped", []))
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        pdf_filename = scan_folder(create=True) / f"doc_{timestamp}.pdf"
-
-        pdf = canvas.Canvas(str(pdf_filename), pagesize=A4)
-        page_width, page_height = A4
-
-        for index, page_data in enumerate(processed_pages):
-            img_reader, (img_width, img_height) = _prepare_pdf_image(page_data)
-            aspect = img_height / float(img_width)
-            margin = 50
-            available_width = page_width - (2 * margin)
-            available_height = page_height - (2 * margin)
-
-            if img_width > img_height:
-                new_width = available_width
-                new_height = new_width * aspect
-                if new_height > available_height:
-                    new_height = available_height
-                    new_width = new_height / aspect
-            else:
-                new_height = available_height
-                new_width = new_height / aspect
-                if new_width > available_width:
-                    new_width = available_width
-                    new_height = new_width * aspect
-
-            x = (page_width - new_width) / 2
-            y = (page_height - new_height) / 2
-
-            pdf.drawImage(img_reader, x, y, width=new_width, height=new_height)
-
-            if index < len(processed_pages) - 1:
-                pdf.showPage()
-
-        pdf.save()
-
-        return JSONResponse(
-            {
-                "status": "saved",
-                "file": str(pdf_filename),
-                "pages": len(processed_pages),
-                "timestamp": timestamp,
-                "processed": True,
-                "compression": {
-                    "max_dimension": PDF_IMAGE_MAX_DIMENSION,
-                    "jpeg_quality": PDF_IMAGE_JPEG_QUALITY,
-                },
-            }
-        )
+        if _flag(req, data, "quality_gate"):
+            rejection = await _quality_rejection(pages, _page_corners(data, field, len(pages)))
+            if rejection is not None:
+                return rejection
+
+        if job_kind is not None and _is_async(req, data):
+            # Writes every page to disk, so off the event loop
+            return _accepted_response(await run_in_threadpool(create_job, job_kind, pages, data))
+
+        return JSONResponse(await scan_queue.run(save, pages, data))
+    except ScanQueueFull as exc:
+        return _busy_response(exc)
+    except UnreadablePageError as exc:
+        return JSONResponse({"status": "error", "message": str(exc)}, status_code=400)
     except Exception as exc:
         return JSONResponse({"status": "error", "message": str(exc)}, status_code=500)
 
 
+@router.post("/save-image")
+async def save_image(req: Request):
+    return await _run_scan(req, "image", lambda pages, data: save_scan_image(pages[0], data))
+
+
+@router.post("/save-pdf")
+async def save_pdf(req: Request):
+    return await _run_scan(req, "pages", save_scan_pdf, job_kind="pdf")
+
+
 @router.post("/save-pages")
 async def save_pages(req: Request):
-    try:
-        data = await req.json()
-        pages = data.get("pages", [])
+    return await _run_scan(req, "pages", save_scan_pages, job_kind="pages")
 
-        if not pages:
-            return JSONResponse(
-                {"status": "error", "message": "No pages provided"},
-                status_code=400,
-            )
 
-        processed_pages = _process_pages(pages, data.get("cropped", []))
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        saved_files = []
+@router.post("/api/quality-check")
+async def quality_check(req: Request):
+    """Score one capture (uploaded like a session page) before saving it."""
+    try:
+        page, hints = await _read_session_page(req)
+        report = await run_in_threadpool(check_page, page, hints.get("corners"))
+        return JSONResponse({"status": "checked", **report})
+    except ValueError as exc:
+        return JSONResponse({"status": "error", "message": str(exc)}, status_code=400)
+    except Exception as exc:
+        return JSONResponse({"status": "error", "message": str(exc)}, status_code=500)
 
-        for index, page_data in enumerate(processed_pages, start=1):
-            image = Image.open(io.BytesIO(_decode_data_url(page_data))).convert("RGB")
-            image.thumbnail(
-                (PAGE_IMAGE_MAX_DIMENSION, PAGE_IMAGE_MAX_DIMENSION),
-                Image.Resampling.LANCZOS,
-            )
-            output = io.BytesIO()
-            image.save(
-                output,
-                format="JPEG",
-                quality=PAGE_IMAGE_JPEG_QUALITY,
-                optimize=True,
-                progressive=True,
-            )
-            filename = save_scan_bytes(f"doc_{timestamp}_page_{index:02d}.jpg", output.getvalue())
-            saved_files.append(str(filename))
-
-        return JSONResponse(
-            {
-                "status": "saved",
-                "files": saved_files,
-                "pages": len(saved_files),
-                "timestamp": timestamp,
-                "processed": True,
-                "compression": {
-                    "format": "jpeg",
-                    "max_dimension": PAGE_IMAGE_MAX_DIMENSION,
-                    "jpeg_quality": PAGE_IMAGE_JPEG_QUALITY,
-                },
-            }
-        )
+
+@router.post("/api/preview")
+async def preview(req: Request):
+    """Low-resolution processed preview of one capture (uploaded like a
+    session page; ``enhance`` / ``doc_type`` may be tried out), with the
+    geometry found as hints to send along with the save."""
+    try:
+        page, hints = await _read_session_page(req)
+        overrides = {key: hints[key] for key in PREVIEW_OVERRIDES if key in hints}
+        result = await run_in_threadpool(render_preview, page, hints, overrides)
+        return JSONResponse({"status": "ok", **result})
+    except ValueError as exc:
+        return JSONResponse({"status": "error", "message": str(exc)}, status_code=400)
     except Exception as exc:
         return JSONResponse({"status": "error", "message": str(exc)}, status_code=500)
+
+
+# Incremental multi-page sessions: each page is uploaded (and processed in the
+# background) as soon as it is captured, so finalize only writes the output.
+
+def _session_error(exc: Exception) -> JSONResponse:
+    if isinstance(exc, ScanQueueFull):
+        return _busy_response(exc)
+    if isinstance(exc, scan_sessions.SessionNotFound):
+        return JSONResponse({"status": "error", "message": "Unknown scan session or page"}, status_code=404)
+    if isinstance(exc, scan_sessions.SessionChanged):
+        return JSONResponse({"status": "error", "message": str(exc)}, status_code=409)
+    if isinstance(exc, ValueError):
+        return JSONResponse({"status": "error", "message": str(exc)}, status_code=400)
+    return JSONResponse({"status": "error", "message": str(exc)}, status_code=500)
+
+
+async def _read_session_page(req: Request) -> tuple[bytes, dict]:
+    pages, hints = await _read_scan_upload(req, "page")
+    if len(pages) != 1:
+        raise ValueError("Upload exactly one page")
+    return pages[0], hints
+
+
+async def _optional_json(req: Request) -> dict:
+    body = await req.body()
+    return json.loads(body) if body else {}
+
+
+@router.post("/api/scan-sessions")
+async def open_scan_session(req: Request):
+    try:
+        data = await _optional_json(req)
+        session = scan_sessions.open_session(data.get("output", scan_sessions.DEFAULT_OUTPUT))
+        return JSONResponse(session, status_code=201)
+    except Exception as exc:
+        return _session_error(exc)
+
+
+@router.get("/api/scan-sessions/{session_id}")
+async def get_scan_session(session_id: str):
+    try:
+        return JSONResponse(scan_sessions.get_session(session_id))
+    except Exception as exc:
+        return _session_error(exc)
+
+
+@router.delete("/api/scan-sessions/{session_id}")
+async def discard_scan_session(session_id: str):
+    try:
+        scan_sessions.discard_session(session_id)
+        return JSONResponse({"status": "discarded"})
+    except Exception as exc:
+        return _session_error(exc)
+
+
+@router.post("/api/scan-sessions/{session_id}/pages")
+async def add_scan_session_page(session_id: str, req: Request):
+    try:
+        scan_sessions.get_session(session_id)
+        page, hints = await _read_session_page(req)
+        if _flag(req, hints, "quality_gate"):
+            rejection = await _quality_rejection([page], [hints.get("corners")])
+            if rejection is not None:
+                return rejection
+        return JSONResponse(scan_sessions.add_page(session_id, page, hints), status_code=201)
+    except Exception as exc:
+        return _session_error(exc)
+
+
+@router.put("/api/scan-sessions/{session_id}/pages/{page_id}")
+async def replace_scan_session_page(session_id: str, page_id: str, req: Request):
+    try:
+        page, hints = await _read_session_page(req)
+        if _flag(req, hints, "quality_gate"):
+            rejection = await _quality_rejection([page], [hints.get("corners")])
+            if rejection is not None:
+                return rejection
+        return JSONResponse(scan_sessions.replace_page(session_id, page_id, page, hints))
+    except Exception as exc:
+        return _session_error(exc)
+
+
+@router.delete("/api/scan-sessions/{session_id}/pages/{page_id}")
+async def delete_scan_session_page(session_id: str, page_id: str):
+    try:
+        return JSONResponse(scan_sessions.delete_page(session_id, page_id))
+    except Exception as exc:
+        return _session_error(exc)
+
+
+@router.put("/api/scan-sessions/{session_id}/order")
+async def reorder_scan_session(session_id: str, req: Request):
+    try:
+        page_ids = (await req.json()).get("pages")
+        if not isinstance(page_ids, list):
+            raise ValueError("pages must be a list of page ids")
+        return JSONResponse(scan_sessions.reorder_pages(session_id, page_ids))
+    except Exception as exc:
+        return _session_error(exc)
+
+
+@router.post("/api/scan-sessions/{session_id}/finalize")
+async def finalize_scan_session(session_id: str, req: Request):
+    try:
+        data = await _optional_json(req)
+        pages = scan_sessions.session_pages(session_id, data.get("pages"))
+        output = data.get("output") or scan_sessions.get_session(session_id)["output"]
+
+        # Wait for background processing here rather than on a scan queue
+        # thread, which the pages themselves may still need. A page replaced
+        # or deleted meanwhile is cancelled, so take the session's pages
+        # again until they stay the same while waiting.
+        while True:
+            await asyncio.gather(*(asyncio.wrap_future(page.encoded) for page in pages), return_exceptions=True)
+            current = scan_sessions.session_pages(session_id)
+            if len(current) == len(pages) and all(new is old for new, old in zip(current, pages)):
+                break
+            pages = current
+
+        result = await get_scan_queue().run(scan_sessions.finalize_pages, pages, output)
+        scan_sessions.close_session(session_id)
+        return JSONResponse(result)
+    except Exception as exc:
+        return _session_error(exc)
@@ -0,0 +1,205 @@
+import asyncio
+import json
+import re
+import shutil
+import threading
+import uuid
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any
+
+from config import BACKEND_DIR
+from scan_output import save_scan_pages, save_scan_pdf
+from scan_queue import get_scan_queue
+
+
+SCAN_JOBS_DIR = BACKEND_DIR / "scan_jobs"
+JOB_RETENTION = timedelta(days=7)
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+TERMINAL_STATUSES = {"done", "error"}
+SAVERS = {
+    "pdf": save_scan_pdf,
+    "pages": save_scan_pages,
+}
+
+_jobs: dict[str, "ScanJob"] = {}
+_subscribers: dict[str, list[tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+_lock = threading.Lock()
+_resumed = False
+
+
+@dataclass
+class ScanJob:
+    job_id: str
+    kind: str
+    pages_total: int
+    status: str = "queued"
+    pages_done: int = 0
+    result: dict[str, Any] | None = None
+    error: str | None = None
+    created_at: str = field(default_factory=lambda: datetime.now().isoformat(timespec="seconds"))
+    updated_at: str | None = None
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+def _job_dir(job_id: str) -> Path:
+    return SCAN_JOBS_DIR / job_id
+
+
+def _page_path(job_id: str, index: int) -> Path:
+    return _job_dir(job_id) / f"page_{index:03d}.bin"
+
+
+def _write_state(job: ScanJob) -> None:
+    state_path = _job_dir(job.job_id) / "job.json"
+    temp_path = state_path.with_suffix(".tmp")
+    with temp_path.open("w", encoding="utf-8") as state_file:
+        json.dump(job.to_dict(), state_file, indent=2, ensure_ascii=False)
+        state_file.write("\n")
+    temp_path.replace(state_path)
+
+
+def _publish(job: ScanJob, event: str) -> None:
+    """Persist the job state and push it to SSE subscribers on any event loop."""
+    job.updated_at = datetime.now().isoformat(timespec="seconds")
+    _write_state(job)
+    message = {"event": event, "job": job.to_dict()}
+    with _lock:
+        subscribers = list(_subscribers.get(job.job_id, []))
+    for loop, queue in subscribers:
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, message)
+        except RuntimeError:
+            # Subscriber's event loop already closed
+            pass
+
+
+def _run_job(job_id: str) -> None:
+    with _lock:
+        job = _jobs[job_id]
+    job_dir = _job_dir(job_id)
+    job.status = "processing"
+    job.pages_done = 0
+    _publish(job, "status")
+
+    def on_page(pages_done: int) -> None:
+        job.pages_done = pages_done
+        _publish(job, "progress")
+
+    try:
+        with (job_dir / "request.json").open("r", encoding="utf-8") as request_file:
+            data = json.load(request_file)
+        pages = [_page_path(job_id, index).read_bytes() for index in range(1, job.pages_total + 1)]
+        job.result = SAVERS[job.kind](pages, data, on_page=on_page)
+        job.status = "done"
+    except Exception as exc:
+        job.status = "error"
+        job.error = str(exc)
+
+    # The raw upload is only kept until the job has finished
+    for index in range(1, job.pages_total + 1):
+        _page_path(job_id, index).unlink(missing_ok=True)
+    _publish(job, job.status)
+
+
+def create_job(kind: str, pages: list[bytes], data: dict[str, Any]) -> ScanJob:
+    """Persist the raw upload and queue it for background processing.
+
+    Raises ScanQueueFull (and discards the upload) when the scan queue is full.
+    """
+    if kind not in SAVERS:
+        raise ValueError(f"kind must be one of: {', '.join(SAVERS)}")
+
+    job = ScanJob(job_id=uuid.uuid4().hex, kind=kind, pages_total=len(pages))
+    job_dir = _job_dir(job.job_id)
+    job_dir.mkdir(parents=True, exist_ok=True)
+    for index, page in enumerate(pages, start=1):
+        _page_path(job.job_id, index).write_bytes(page)
+    with (job_dir / "request.json").open("w", encoding="utf-8") as request_file:
+        json.dump({key: value for key, value in data.items() if key != "async"}, request_file)
+    _write_state(job)
+
+    with _lock:
+        _jobs[job.job_id] = job
+    try:
+        get_scan_queue().submit(_run_job, job.job_id)
+    except Exception:
+        with _lock:
+            _jobs.pop(job.job_id, None)
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise
+    return job
+
+
+def get_job(job_id: str) -> dict[str, Any] | None:
+    with _lock:
+        job = _jobs.get(job_id)
+    if job is not None:
+        return job.to_dict()
+
+    if not JOB_ID_PATTERN.fullmatch(job_id):
+        return None
+    state_path = _job_dir(job_id) / "job.json"
+    if not state_path.exists():
+        return None
+    try:
+        with state_path.open("r", encoding="utf-8") as state_file:
+            return json.load(state_file)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def subscribe(job_id: str) -> asyncio.Queue:
+    """Queue receiving this job's events on the calling event loop."""
+    queue: asyncio.Queue = asyncio.Queue()
+    with _lock:
+        _subscribers.setdefault(job_id, []).append((asyncio.get_running_loop(), queue))
+    return queue
+
+
+def unsubscribe(job_id: str, queue: asyncio.Queue) -> None:
+    with _lock:
+        remaining = [entry for entry in _subscribers.get(job_id, []) if entry[1] is not queue]
+        if remaining:
+            _subscribers[job_id] = remaining
+        else:
+            _subscribers.pop(job_id, None)
+
+
+def resume_pending_jobs() -> None:
+    """Re-queue jobs interrupted by a restart and drop old finished ones."""
+    global _resumed
+    with _lock:
+        if _resumed:
+            return
+        _resumed = True
+
+    if not SCAN_JOBS_DIR.exists():
+        return
+
+    cutoff = datetime.now() - JOB_RETENTION
+    for state_path in SCAN_JOBS_DIR.glob("*/job.json"):
+        try:
+            with state_path.open("r", encoding="utf-8") as state_file:
+                job = ScanJob(**json.load(state_file))
+        except (OSError, TypeError, json.JSONDecodeError):
+            continue
+
+        if job.status in TERMINAL_STATUSES:
+            if datetime.fromisoformat(job.updated_at or job.created_at) < cutoff:
+                shutil.rmtree(state_path.parent, ignore_errors=True)
+            continue
+
+        print(f"Resuming scan job {job.job_id} ({job.kind}, {job.pages_total} pages)")
+        job.status = "queued"
+        with _lock:
+            _jobs[job.job_id] = job
+        try:
+            get_scan_queue().submit(_run_job, job.job_id)
+        except Exception as exc:
+            job.status = "error"
+            job.error = f"Could not resume: {exc}"
+            _publish(job, "error")
@@ -0,0 +1,355 @@
+import io
+import zlib
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from capture_archive import keep_capture
+from config import get_image_processing_config
+from image_processor import is_bilevel
+from metrics import span
+from pdf_writer import StreamingPdfWriter
+from processing_pool import pool_size, submit_page
+from storage import download_path, file_removed, place_bytes, place_download, save_scan_bytes, scan_folder
+
+
+PDF_IMAGE_MAX_DIMENSION = 1800
+PDF_IMAGE_JPEG_QUALITY = 85
+PAGE_IMAGE_MAX_DIMENSION = 2400
+PAGE_IMAGE_JPEG_QUALITY = 92
+SCAN_IMAGE_JPEG_QUALITY = 95
+
+# Output kind -> (max dimension, JPEG quality) of the encoded pages
+OUTPUT_ENCODINGS = {
+    "pdf": (PDF_IMAGE_MAX_DIMENSION, PDF_IMAGE_JPEG_QUALITY),
+    "pages": (PAGE_IMAGE_MAX_DIMENSION, PAGE_IMAGE_JPEG_QUALITY),
+}
+
+
+# Called with the number of pages finished so far
+ProgressCallback = Callable[[int], None]
+# File extension for each page format that can be written as a file
+PAGE_FILE_EXTENSIONS = {"jpeg": ".jpg", "gray-jpeg": ".jpg", "png": ".png"}
+
+
+class EncodedPage(NamedTuple):
+    data: bytes
+    # (width, height) in pixels
+    size: tuple[int, int]
+    # "jpeg" / "gray-jpeg" for photo and mixed pages; bilevel text pages are
+    # "g4" (CCITT Group 4) or "flate1" (1-bit, zlib) in PDFs and "png" as files
+    format: str
+
+
+class UnreadablePageError(ValueError):
+    pass
+
+
+def per_page(values, index: int):
+    if isinstance(values, list) and index < len(values):
+        return values[index]
+    return None
+
+
+def output_config(config: dict, output: str | None) -> dict:
+    """Processing config that warps and enhances at the output's resolution."""
+    if output is None:
+        return config
+    return {**config, "max_output_dimension": OUTPUT_ENCODINGS[output][0]}
+
+
+def page_options(config: dict, cropped=False, corners=None, skew_angle=None) -> dict:
+    """Processing options for one page given the phone's hints for it."""
+    page_config = dict(config)
+    if cropped:
+        page_config["auto_crop"] = False
+    page_config["corners"] = corners
+    page_config["skew_angle"] = skew_angle
+    return page_config
+
+
+def _page_options(config: dict, data: dict, index: int) -> dict:
+    return page_options(
+        config,
+        cropped=per_page(data.get("cropped"), index),
+        corners=per_page(data.get("corners"), index),
+        skew_angle=per_page(data.get("angles"), index),
+    )
+
+
+def iter_processed_pages(pages: list[bytes], data: dict, output: str | None = None,
+                         config: dict | None = None) -> Iterator[np.ndarray]:
+    """Process scanned pages in the worker pool and yield them in page order.
+
+    Auto-crop is skipped for pages the phone already perspective-cropped
+    (re-cropping a clean scan risks cutting into content). Per-page
+    ``corners`` / ``angles`` hints from the phone's detector replace
+    server-side detection and skew estimation when they pass a sanity check.
+    Only a pool-sized window of pages is in flight, so memory stays flat
+    however many pages the document has. With an output kind, pages come
+    back already at that output's size. ``config`` defaults to the current
+    image_processing settings.
+    """
+    config = output_config(config if config is not None else get_image_processing_config(), output)
+    window = pool_size()
+    pending: deque[Future] = deque()
+    next_index = 0
+
+    for index in range(len(pages)):
+        while next_index < len(pages) and len(pending) < window:
+            page_config = _page_options(config, data, next_index)
+            pending.append(submit_page(pages[next_index], **page_config))
+            next_index += 1
+
+        image = pending.popleft().result()
+        if image is None:
+            for future in pending:
+                future.cancel()
+            raise UnreadablePageError(f"Page {index + 1} is not a readable image")
+        yield image
+
+
+def _to_pil(image: np.ndarray) -> Image.Image:
+    if image.ndim == 2:
+        return Image.fromarray(image)
+    return Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+
+
+def _encode_page_jpeg(image: np.ndarray, max_dimension: int | None, quality: int) -> EncodedPage:
+    """Downscale a processed page and encode it to JPEG exactly once."""
+    img = _to_pil(image)
+    if max_dimension:
+        img.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+
+    compressed = io.BytesIO()
+    img.save(
+        compressed,
+        format="JPEG",
+        quality=quality,
+        optimize=True,
+        progressive=True,
+    )
+    return EncodedPage(compressed.getvalue(), img.size, "gray-jpeg" if img.mode == "L" else "jpeg")
+
+
+def _fit_bilevel(image: np.ndarray, max_dimension: int | None) -> np.ndarray:
+    height, width = image.shape
+    if not max_dimension or max(height, width) <= max_dimension:
+        return image
+    scale = max_dimension / float(max(height, width))
+    small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return cv2.threshold(small, 127, 255, cv2.THRESH_BINARY)[1]
+
+
+def _pack_bits(image: np.ndarray, ink: bool = False) -> Image.Image:
+    """1-bit PIL image whose set bits are the white pixels (or the ink)."""
+    height, width = image.shape
+    bits = image < 128 if ink else image >= 128
+    return Image.frombytes("1", (width, height), np.packbits(bits, axis=1).tobytes())
+
+
+def _encode_g4(image: np.ndarray) -> bytes | None:
+    """Raw CCITT Group 4 data for a bilevel page, or None when this Pillow
+    build cannot produce it as a single strip."""
+    height, width = image.shape
+    # libtiff codes zero bits as white runs, so pack the ink as the set bits
+    img = _pack_bits(image, ink=True)
+    buffer = io.BytesIO()
+    try:
+        img.save(buffer, format="TIFF", compression="group4", strip_size=(width + 7) // 8 * height + 1)
+        with Image.open(io.BytesIO(buffer.getvalue())) as tiff:
+            offsets = tiff.tag_v2.get(273)
+            counts = tiff.tag_v2.get(279)
+    except (OSError, ValueError, KeyError):
+        return None
+    if not offsets or len(offsets) != 1:
+        return None
+    return buffer.getvalue()[offsets[0]:offsets[0] + counts[0]]
+
+
+def _encode_bilevel(image: np.ndarray, for_pdf: bool, max_dimension: int | None) -> EncodedPage:
+    image = _fit_bilevel(image, max_dimension)
+    size = (image.shape[1], image.shape[0])
+    if for_pdf:
+        g4_bytes = _encode_g4(image)
+        if g4_bytes is not None:
+            return EncodedPage(g4_bytes, size, "g4")
+        return EncodedPage(zlib.compress(np.packbits(image >= 128, axis=1).tobytes()), size, "flate1")
+
+    compressed = io.BytesIO()
+    _pack_bits(image).save(compressed, format="PNG", optimize=True)
+    return EncodedPage(compressed.getvalue(), size, "png")
+
+
+def encode_output_page(image: np.ndarray, output: str) -> EncodedPage:
+    """Encode a processed page the way the given output kind stores it.
+
+    Bilevel text pages stay 1-bit (CCITT G4 in PDFs, 1-bit PNG as files);
+    everything else becomes a JPEG.
+    """
+    max_dimension, quality = OUTPUT_ENCODINGS[output]
+    with span("encode_output"):
+        if is_bilevel(image):
+            return _encode_bilevel(image, output == "pdf", max_dimension)
+        return _encode_page_jpeg(image, max_dimension, quality)
+
+
+def _encode_scan_image(image: np.ndarray) -> EncodedPage:
+    """Single full-resolution scan: 1-bit PNG for bilevel pages, else JPEG."""
+    if is_bilevel(image):
+        return _encode_bilevel(image, False, None)
+    return _encode_page_jpeg(image, None, SCAN_IMAGE_JPEG_QUALITY)
+
+
+def save_scan_image(page: bytes, data: dict) -> dict:
+    config = get_image_processing_config()
+    processed = submit_page(
+        page,
+        **config,
+        corners=data.get("corners"),
+        skew_angle=data.get("angle"),
+    ).result()
+    if processed is None:
+        raise UnreadablePageError("Image could not be decoded")
+
+    encoded = _encode_scan_image(processed)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = save_scan_bytes(f"doc_{timestamp}{PAGE_FILE_EXTENSIONS[encoded.format]}", encoded.data)
+
+    result = {
+        "status": "saved",
+        "file": str(filename),
+        "timestamp": timestamp,
+        "processed": True,
+    }
+    keep_capture(result, "image", [page], {"corners": [data.get("corners")], "angles": [data.get("angle")]}, config)
+    return result
+
+
+def _add_pdf_page(pdf: StreamingPdfWriter, page: EncodedPage) -> None:
+    width, height = page.size
+    if page.format == "g4":
+        pdf.add_ccitt_page(page.data, width, height)
+    elif page.format == "flate1":
+        pdf.add_bilevel_page(page.data, width, height)
+    else:
+        pdf.add_jpeg_page(page.data, width, height, grayscale=page.format == "gray-jpeg")
+
+
+def write_scan_pdf(encoded_pages: Iterable[EncodedPage], on_page: ProgressCallback | None = None,
+                   path: Path | None = None) -> dict:
+    """Write already-encoded pages (see encode_output_page) to a new PDF,
+    by default a timestamped one in the scan folder."""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    pdf_filename = path or scan_folder(create=True) / f"doc_{timestamp}.pdf"
+    partial = download_path(pdf_filename)
+
+    formats = set()
+
+    # Each page is written and released before the next one is pulled.
+    with StreamingPdfWriter(partial) as pdf:
+        for page in encoded_pages:
+            with span("write_output"):
+                _add_pdf_page(pdf, page)
+            formats.add(page.format)
+            if on_page is not None:
+                on_page(pdf.page_count)
+        page_count = pdf.page_count
+    # Only moved into place once complete, and not at all when the same
+    # scan is already saved (e.g. an upload sent again)
+    pdf_filename = place_download(partial, pdf_filename)["path"]
+
+    return {
+        "status": "saved",
+        "file": str(pdf_filename),
+        "pages": page_count,
+        "timestamp": timestamp,
+        "processed": True,
+        "compression": {
+            "formats": sorted(formats),
+            "max_dimension": PDF_IMAGE_MAX_DIMENSION,
+            "jpeg_quality": PDF_IMAGE_JPEG_QUALITY,
+        },
+    }
+
+
+def write_scan_pages(encoded_pages: Iterable[EncodedPage], on_page: ProgressCallback | None = None,
+                     stem: Path | None = None) -> dict:
+    """Write already-encoded pages (see encode_output_page) as image files
+    named ``<stem>_page_NN``, by default timestamped in the scan folder."""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    stem = stem or scan_folder(create=True) / f"doc_{timestamp}"
+    saved_files = []
+    # Files this save created; pages the folder already had are left alone.
+    # Never taken as a copy, so identical pages of one save (a blank
+    # separator, the same photo picked twice) each get their own file
+    written = []
+    formats = set()
+
+    try:
+        for index, page in enumerate(encoded_pages, start=1):
+            filename = Path(f"{stem}_page_{index:02d}{PAGE_FILE_EXTENSIONS[page.format]}")
+            with span("write_output"):
+                placed = place_bytes(page.data, filename, exclude=written)
+            if placed["action"] != "skipped":
+                written.append(placed["path"])
+            saved_files.append(str(placed["path"]))
+            formats.add(page.format)
+            if on_page is not None:
+                on_page(index)
+    except Exception:
+        # Keep the save all-or-nothing
+        for filename in written:
+            filename.unlink(missing_ok=True)
+            file_removed(filename)
+        raise
+
+    return {
+        "status": "saved",
+        "files": saved_files,
+        "pages": len(saved_files),
+        "timestamp": timestamp,
+        "processed": True,
+        "compression": {
+            "formats": sorted(formats),
+            "max_dimension": PAGE_IMAGE_MAX_DIMENSION,
+            "jpeg_quality": PAGE_IMAGE_JPEG_QUALITY,
+        },
+    }
+
+
+def save_scan_pdf(pages: list[bytes], data: dict, on_page: ProgressCallback | None = None) -> dict:
+    config = get_image_processing_config()
+    encoded = (encode_output_page(image, "pdf") for image in iter_processed_pages(pages, data, "pdf", config))
+    result = write_scan_pdf(encoded, on_page)
+    keep_capture(result, "pdf", pages, data, config)
+    return result
+
+
+def save_scan_pages(pages: list[bytes], data: dict, on_page: ProgressCallback | None = None) -> dict:
+    config = get_image_processing_config()
+    encoded = (encode_output_page(image, "pages") for image in iter_processed_pages(pages, data, "pages", config))
+    result = write_scan_pages(encoded, on_page)
+    keep_capture(result, "pages", pages, data, config)
+    return result
+
+
+def render_scan(output: str, pages: list[bytes], data: dict, config: dict, stem: Path) -> list[Path]:
+    """Render a kept capture again (see capture_archive) with the given
+    settings, writing its files as ``stem`` plus the usual suffixes."""
+    if output == "image":
+        encoded = _encode_scan_image(next(iter_processed_pages(pages, data, None, config)))
+        path = Path(f"{stem}{PAGE_FILE_EXTENSIONS[encoded.format]}")
+        path.write_bytes(encoded.data)
+        return [path]
+    if output == "pdf":
+        encoded = (encode_output_page(image, "pdf") for image in iter_processed_pages(pages, data, "pdf", config))
+        return [Path(write_scan_pdf(encoded, path=Path(f"{stem}.pdf"))["file"])]
+    encoded = (encode_output_page(image, "pages") for image in iter_processed_pages(pages, data, "pages", config))
+    return [Path(filename) for filename in write_scan_pages(encoded, stem=stem)["files"]]
@@ -0,0 +1,66 @@
+# Processed previews: the save pipeline, with the current image_processing
+# settings, run on a reduced decode and rendered at thumbnail size. The
+# geometry it finds is handed back as phone-style hints, so the
+# full-resolution save of the same upload skips detection and deskew.
+
+from typing import Any
+
+from config import get_image_processing_config
+from image_processor import (
+    PREVIEW_MAX_DIMENSION,
+    compute_warp,
+    decode_image_proxy,
+    encode_image_to_base64,
+    render_document,
+    warp_hints,
+)
+from metrics import span
+from scan_output import UnreadablePageError, page_options
+
+
+PREVIEW_JPEG_QUALITY = 80
+# Settings a preview may try out without changing the config
+PREVIEW_OVERRIDES = ("enhance", "doc_type")
+
+
+def render_preview(img_bytes: bytes, hints: dict[str, Any], overrides: dict[str, Any] | None = None) -> dict[str, Any]:
+    config = get_image_processing_config()
+    config.update({key: value for key, value in (overrides or {}).items() if key in PREVIEW_OVERRIDES})
+    options = page_options(
+        config,
+        cropped=hints.get("cropped"),
+        corners=hints.get("corners"),
+        skew_angle=hints.get("angle"),
+    )
+
+    with span("preview"):
+        # Geometry needs the detection proxy's resolution, the output only the preview's
+        detection_dimension = options["detection_max_dimension"] or 0
+        image = decode_image_proxy(img_bytes, max(PREVIEW_MAX_DIMENSION, detection_dimension))
+        if image is None:
+            raise UnreadablePageError("Page is not a readable image")
+        M, size = compute_warp(
+            image,
+            options["auto_crop"],
+            options["auto_rotate_enabled"],
+            options["detection_max_dimension"],
+            options["corners"],
+            options["skew_angle"],
+        )
+        preview = render_document(
+            image,
+            M,
+            size,
+            options["enhance"],
+            options["doc_type"],
+            PREVIEW_MAX_DIMENSION,
+            options["enhance_tile_size"],
+        )
+
+    return {
+        "image": encode_image_to_base64(preview, PREVIEW_JPEG_QUALITY),
+        "width": preview.shape[1],
+        "height": preview.shape[0],
+        "settings": {"enhance": options["enhance"], "doc_type": options["doc_type"]},
+        "geometry": warp_hints(M, size, image.shape),
+    }
@@ -0,0 +1,147 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+from config import config_snapshot
+from metrics import gauge_lines, registry
+
+
+# Recent samples used for the wait/service time figures and the retry hint
+TIMING_SAMPLES = 50
+
+_scan_queue: "ScanQueue | None" = None
+_scan_queue_lock = threading.Lock()
+
+
+class ScanQueueFull(RuntimeError):
+    def __init__(self, retry_after: int):
+        super().__init__("Server is busy processing other scans. Try again shortly.")
+        self.retry_after = retry_after
+
+
+class ScanQueue:
+    """Bounded executor for CPU-bound scan work (pipeline orchestration,
+    encoding, PDF writing).
+
+    Runs at most ``workers`` scans at once and lets at most ``max_queue``
+    more wait; anything beyond that is rejected immediately with a retry
+    hint. Thread-based rather than asyncio-based because the HTTP and HTTPS
+    servers run separate event loops over the same app.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+        self._waits: deque[float] = deque(maxlen=TIMING_SAMPLES)
+        self._service_times: deque[float] = deque(maxlen=TIMING_SAMPLES)
+
+    def _retry_after(self) -> int:
+        service = sum(self._service_times) / len(self._service_times) if self._service_times else 1.0
+        return max(1, math.ceil(service * (self.queued + 1) / self.workers))
+
+    def _admit(self) -> None:
+        # Caller holds the lock
+        if self.active + self.queued >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise ScanQueueFull(self._retry_after())
+
+    def check(self) -> None:
+        """Raise ScanQueueFull if a new scan would not be admitted."""
+        with self._lock:
+            self._admit()
+
+    def submit(self, func: Callable[..., Any], *args, **kwargs) -> Future:
+        with self._lock:
+            self._admit()
+            self.queued += 1
+        enqueued_at = time.monotonic()
+
+        def run():
+            started_at = time.monotonic()
+            with self._lock:
+                self.queued -= 1
+                self.active += 1
+                self._waits.append(started_at - enqueued_at)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    self.completed += 1
+                    self._service_times.append(time.monotonic() - started_at)
+
+        try:
+            future = self._executor.submit(run)
+        except BaseException:
+            with self._lock:
+                self.queued -= 1
+            raise
+        future.add_done_callback(self._release_cancelled)
+        return future
+
+    def _release_cancelled(self, future: Future) -> None:
+        # A future cancelled while still waiting never runs, so never leaves the queue
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            waits = list(self._waits)
+            service_times = list(self._service_times)
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "active": self.active,
+                "queued": self.queued,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(1000 * sum(waits) / len(waits), 1) if waits else 0.0,
+                "max_wait_ms": round(1000 * max(waits), 1) if waits else 0.0,
+                "avg_service_ms": (
+                    round(1000 * sum(service_times) / len(service_times), 1) if service_times else 0.0
+                ),
+            }
+
+
+def get_scan_queue() -> ScanQueue:
+    global _scan_queue
+    with _scan_queue_lock:
+        if _scan_queue is None:
+            queue_config = config_snapshot()["scan_queue"]
+            _scan_queue = ScanQueue(
+                max(1, int(queue_config["workers"])),
+                max(0, int(queue_config["max_queue"])),
+            )
+        return _scan_queue
+
+
+def _collect_metrics():
+    stats = get_scan_queue().stats()
+    yield from gauge_lines("scanner_scan_queue_active", "Scans running now.", [({}, stats["active"])])
+    yield from gauge_lines("scanner_scan_queue_depth", "Scans waiting for a worker.", [({}, stats["queued"])])
+    yield from gauge_lines(
+        "scanner_scan_queue_completed_total", "Scans finished.", [({}, stats["completed"])], kind="counter"
+    )
+    yield from gauge_lines(
+        "scanner_scan_queue_rejected_total",
+        "Scans turned away with 503 because the queue was full.",
+        [({}, stats["rejected"])],
+        kind="counter",
+    )
+
+
+registry.add_collector(_collect_metrics)
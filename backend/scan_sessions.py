@@ -0,0 +1,324 @@
+import math
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any
+
+from capture_archive import keep_capture
+from config import config_snapshot, get_image_processing_config
+from processing_pool import pool_size, submit_page
+from scan_output import (
+    OUTPUT_ENCODINGS,
+    EncodedPage,
+    UnreadablePageError,
+    encode_output_page,
+    output_config,
+    page_options,
+    write_scan_pages,
+    write_scan_pdf,
+)
+from scan_queue import ScanQueueFull
+
+
+# Sessions live in memory only; abandoned ones are dropped after this long
+SESSION_IDLE_SECONDS = 60 * 60
+DEFAULT_OUTPUT = "pdf"
+
+_sessions: dict[str, "ScanSession"] = {}
+_lock = threading.Lock()
+# Encodes pages once the process pool has returned them; sized like the pool,
+# so encoding keeps up with it
+_encoder: ThreadPoolExecutor | None = None
+# Session pages submitted and not encoded yet. Own lock: cancelling a page
+# (done under _lock) releases its count right away
+_processing = 0
+_processing_lock = threading.Lock()
+
+
+class SessionNotFound(KeyError):
+    pass
+
+
+class SessionChanged(RuntimeError):
+    def __init__(self):
+        super().__init__("Session pages changed while finalizing. Try again.")
+
+
+@dataclass
+class SessionPage:
+    page_id: str
+    img_bytes: bytes
+    # The phone's cropped / corners / angle hints and the image_processing
+    # settings they were applied with
+    hints: dict[str, Any]
+    settings: dict[str, Any]
+    options: dict[str, Any]
+    output: str
+    # Resolves to the page encoded for `output`
+    encoded: Future
+
+    @property
+    def status(self) -> str:
+        if not self.encoded.done():
+            return "processing"
+        return "error" if self.encoded.exception() is not None else "ready"
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"page_id": self.page_id, "status": self.status}
+
+
+@dataclass
+class ScanSession:
+    session_id: str
+    output: str = DEFAULT_OUTPUT
+    pages: list[SessionPage] = field(default_factory=list)
+    touched_at: float = field(default_factory=time.monotonic)
+
+    def page_index(self, page_id: str) -> int:
+        for index, page in enumerate(self.pages):
+            if page.page_id == page_id:
+                return index
+        raise SessionNotFound(page_id)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "output": self.output,
+            "pages": [page.to_dict() for page in self.pages],
+        }
+
+
+def _check_output(output: str) -> str:
+    if output not in OUTPUT_ENCODINGS:
+        raise ValueError(f"output must be one of: {', '.join(OUTPUT_ENCODINGS)}")
+    return output
+
+
+def _encode_processed(image, output: str) -> EncodedPage:
+    if image is None:
+        raise UnreadablePageError("Page is not a readable image")
+    return encode_output_page(image, output)
+
+
+def _prepare_page(img_bytes: bytes, options: dict[str, Any], output: str) -> EncodedPage:
+    return _encode_processed(submit_page(img_bytes, **options).result(), output)
+
+
+def _get_encoder() -> ThreadPoolExecutor:
+    global _encoder
+    with _lock:
+        if _encoder is None:
+            _encoder = ThreadPoolExecutor(max_workers=pool_size(), thread_name_prefix="session-encode")
+        return _encoder
+
+
+def _submit_page(img_bytes: bytes, options: dict[str, Any], output: str) -> Future:
+    """Process a page in the pool, then encode it on the session encoder.
+
+    Goes straight to the pool rather than through the scan queue, so pages
+    use every pool worker and a long capture never competes with saves for
+    admission. Cancelling the returned future drops the result.
+    """
+    global _processing
+    encoded: Future = Future()
+    encoder = _get_encoder()
+
+    def encode() -> None:
+        if not encoded.set_running_or_notify_cancel():
+            return
+        try:
+            encoded.set_result(_encode_processed(processed.result(), output))
+        except BaseException as exc:
+            encoded.set_exception(exc)
+
+    def processed_done(_: Future) -> None:
+        if encoded.cancelled():
+            return
+        try:
+            encoder.submit(encode)
+        except RuntimeError as exc:
+            # Encoder shut down with the server
+            if encoded.set_running_or_notify_cancel():
+                encoded.set_exception(exc)
+
+    def release(_: Future) -> None:
+        global _processing
+        with _processing_lock:
+            _processing -= 1
+
+    processed = submit_page(img_bytes, **options)
+    with _processing_lock:
+        _processing += 1
+    encoded.add_done_callback(release)
+    processed.add_done_callback(processed_done)
+    return encoded
+
+
+def _admit(session: ScanSession, adding: bool) -> None:
+    """Raise ScanQueueFull when too many session pages are processing, or
+    ValueError when the session is full. Caller holds the lock."""
+    session_config = config_snapshot()["scan_sessions"]
+    max_pages = max(1, int(session_config["max_pages"]))
+    if adding and len(session.pages) >= max_pages:
+        raise ValueError(f"A scan session holds at most {max_pages} pages")
+    workers = pool_size()
+    max_processing = int(session_config["max_processing"]) or 4 * workers
+    if _processing >= max_processing:
+        # Roughly the time the pool needs to work through what is waiting
+        raise ScanQueueFull(max(1, math.ceil(_processing / workers)))
+
+
+def _start_page(img_bytes: bytes, hints: dict[str, Any], output: str) -> SessionPage:
+    """Start processing a page right away, so it is ready by finalize."""
+    settings = get_image_processing_config()
+    options = page_options(
+        settings,
+        cropped=hints.get("cropped"),
+        corners=hints.get("corners"),
+        skew_angle=hints.get("angle"),
+    )
+    encoded = _submit_page(img_bytes, output_config(options, output), output)
+    page_hints = {key: hints.get(key) for key in ("cropped", "corners", "angle")}
+    return SessionPage(uuid.uuid4().hex, img_bytes, page_hints, settings, options, output, encoded)
+
+
+def _prune_idle() -> None:
+    # Caller holds the lock
+    cutoff = time.monotonic() - SESSION_IDLE_SECONDS
+    for session_id in [key for key, session in _sessions.items() if session.touched_at < cutoff]:
+        for page in _sessions.pop(session_id).pages:
+            page.encoded.cancel()
+
+
+def _get(session_id: str) -> ScanSession:
+    # Caller holds the lock
+    session = _sessions.get(session_id)
+    if session is None:
+        raise SessionNotFound(session_id)
+    session.touched_at = time.monotonic()
+    return session
+
+
+def open_session(output: str = DEFAULT_OUTPUT) -> dict[str, Any]:
+    session = ScanSession(uuid.uuid4().hex, _check_output(output))
+    with _lock:
+        _prune_idle()
+        _sessions[session.session_id] = session
+    return session.to_dict()
+
+
+def get_session(session_id: str) -> dict[str, Any]:
+    with _lock:
+        return _get(session_id).to_dict()
+
+
+def discard_session(session_id: str) -> None:
+    with _lock:
+        session = _sessions.pop(session_id, None)
+    if session is None:
+        raise SessionNotFound(session_id)
+    for page in session.pages:
+        page.encoded.cancel()
+
+
+def add_page(session_id: str, img_bytes: bytes, hints: dict[str, Any]) -> dict[str, Any]:
+    with _lock:
+        session = _get(session_id)
+        _admit(session, adding=True)
+        output = session.output
+    page = _start_page(img_bytes, hints, output)
+    with _lock:
+        session = _sessions.get(session_id)
+        if session is None:
+            page.encoded.cancel()
+            raise SessionNotFound(session_id)
+        session.pages.append(page)
+        return {"page_id": page.page_id, "index": len(session.pages) - 1, **session.to_dict()}
+
+
+def replace_page(session_id: str, page_id: str, img_bytes: bytes, hints: dict[str, Any]) -> dict[str, Any]:
+    """Swap in a retaken or re-cropped capture, keeping the page's position."""
+    with _lock:
+        session = _get(session_id)
+        session.page_index(page_id)
+        _admit(session, adding=False)
+        output = session.output
+    page = _start_page(img_bytes, hints, output)
+    with _lock:
+        session = _get(session_id)
+        try:
+            index = session.page_index(page_id)
+        except SessionNotFound:
+            page.encoded.cancel()
+            raise
+        session.pages[index].encoded.cancel()
+        session.pages[index] = page
+        return {"page_id": page.page_id, "index": index, **session.to_dict()}
+
+
+def delete_page(session_id: str, page_id: str) -> dict[str, Any]:
+    with _lock:
+        session = _get(session_id)
+        page = session.pages.pop(session.page_index(page_id))
+        page.encoded.cancel()
+        return session.to_dict()
+
+
+def reorder_pages(session_id: str, page_ids: list[str]) -> dict[str, Any]:
+    with _lock:
+        session = _get(session_id)
+        by_id = {page.page_id: page for page in session.pages}
+        if sorted(page_ids) != sorted(by_id):
+            raise ValueError("Order must list every page of the session exactly once")
+        session.pages = [by_id[page_id] for page_id in page_ids]
+        return session.to_dict()
+
+
+def session_pages(session_id: str, page_ids: list[str] | None = None) -> list[SessionPage]:
+    """The session's pages in order, applying a last-minute order first."""
+    if page_ids is not None:
+        reorder_pages(session_id, page_ids)
+    with _lock:
+        return list(_get(session_id).pages)
+
+
+def close_session(session_id: str) -> None:
+    """Forget a finalized session."""
+    with _lock:
+        _sessions.pop(session_id, None)
+
+
+def _encoded_pages(pages: list[SessionPage], output: str):
+    for number, page in enumerate(pages, start=1):
+        try:
+            if page.output == output:
+                yield page.encoded.result()
+            else:
+                # Pre-encoded for the other output, so reprocess at this one's size
+                yield _prepare_page(page.img_bytes, output_config(page.options, output), output)
+        except UnreadablePageError:
+            raise UnreadablePageError(f"Page {number} is not a readable image") from None
+        except CancelledError:
+            # Replaced or deleted after the pages were taken
+            raise SessionChanged() from None
+
+
+def finalize_pages(pages: list[SessionPage], output: str) -> dict[str, Any]:
+    """Write the session's processed pages; only the file write is left to do
+    when every page finished processing while the user was still capturing."""
+    if not pages:
+        raise ValueError("Session has no pages")
+    writer = write_scan_pdf if _check_output(output) == "pdf" else write_scan_pages
+    result = writer(_encoded_pages(pages, output))
+    data = {
+        "cropped": [page.hints["cropped"] for page in pages],
+        "corners": [page.hints["corners"] for page in pages],
+        "angles": [page.hints["angle"] for page in pages],
+    }
+    # Pages processed under different settings leave the scan marked stale
+    settings = pages[0].settings if all(page.settings == pages[0].settings for page in pages) else None
+    keep_capture(result, output, [page.img_bytes for page in pages], data, settings)
+    return result
+
@@ -6,8 +6,14 @@ import uvicorn
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 
+import folder_watcher
+import processing_pool
+import rerender_jobs
+import scan_jobs
 from config import BACKEND_DIR, FRONTEND_DIR, get_image_processing_config
-from routes import folder, jobs, pages, processing, runtime, scanner, settings
+from metrics import MetricsMiddleware
+from routes import captures, detection, folder, jobs, metrics, pages, processing, runtime, scanner, settings
+from routes import scan_jobs as scan_job_routes
 
 
 def _install_windows_connection_reset_filter() -> None:
@@ -34,18 +40,47 @@ def _install_windows_connection_reset_filter() -> None:
 
 def create_app() -> FastAPI:
     app = FastAPI(title="Invoice Helper")
+    app.add_middleware(MetricsMiddleware)
 
     @app.on_event("startup")
     async def install_asyncio_exception_filter() -> None:
         _install_windows_connection_reset_filter()
 
+    @app.on_event("startup")
+    async def start_processing_pool() -> None:
+        # Spawn the workers up front so the first scan doesn't pay for it.
+        processing_pool.get_executor()
+
+    @app.on_event("startup")
+    async def resume_scan_jobs() -> None:
+        scan_jobs.resume_pending_jobs()
+        rerender_jobs.resume_pending_jobs()
+
+    @app.on_event("startup")
+    async def watch_active_folder() -> None:
+        folder_watcher.start_watcher()
+
+    @app.on_event("shutdown")
+    async def stop_processing_pool() -> None:
+        processing_pool.shutdown()
+
+    @app.on_event("shutdown")
+    async def stop_folder_watcher() -> None:
+        # Ends the open event streams too, which would otherwise hold up
+        # the shutdown
+        folder_watcher.stop_watcher()
+
     app.include_router(pages.router)
     app.include_router(scanner.router)
+    app.include_router(scan_job_routes.router)
+    app.include_router(detection.router)
     app.include_router(processing.router)
+    app.include_router(captures.router)
     app.include_router(settings.router)
     app.include_router(folder.router)
     app.include_router(jobs.router)
     app.include_router(runtime.router)
+    app.include_router(metrics.router)
 
     app.mount(
         "/scan-static",
@@ -78,6 +113,8 @@ def run_server() -> None:
     print(f"  Enhancement: {processing_config['enhance']}")
     print(f"  Document type: {processing_config['doc_type']}")
     print(f"  Auto-rotate: {processing_config['auto_rotate_enabled']}")
+    print(f"  Detection proxy size: {processing_config['detection_max_dimension']}")
+    print(f"  Worker processes: {processing_pool.pool_size()}")
 
     cert_path = BACKEND_DIR / "cert.pem"
     key_path = BACKEND_DIR / "key.pem"
@@ -1,27 +1,28 @@
 import json
+import os
+import threading
 from datetime import datetime
 from pathlib import Path
-from typing import Any
-
-from config import BACKEND_DIR, load_config
-
-
-DOCUMENT_EXTENSIONS = {
-    ".bmp",
-    ".gif",
-    ".jpeg",
-    ".jpg",
-    ".pdf",
-    ".png",
-    ".tif",
-    ".tiff",
-    ".webp",
-}
+from typing import Any, Collection
+
+import content_index
+import file_index
+from config import BACKEND_DIR, config_snapshot
+from file_index import CAPTURES_DIRNAME, DOCUMENT_EXTENSIONS, FileQuery
+
+
 JOB_STATE_PATH = BACKEND_DIR / "job_state.json"
+# Listings return at most this many of the newest files
+RECENT_FILES_LIMIT = 200
+
+# job_state.json as last read, keyed by its (mtime_ns, size); polls only
+# stat the file
+_job_state: tuple[tuple[int, int] | None, dict[str, Any]] = (None, {})
+_job_state_lock = threading.Lock()
 
 
 def active_folder(create: bool = False) -> Path:
-    config = load_config()
+    config = config_snapshot()
     path = Path(config["active_folder"]).expanduser()
     if create:
         path.mkdir(parents=True, exist_ok=True)
@@ -29,7 +30,7 @@ def active_folder(create: bool = False) -> Path:
 
 
 def scan_folder(create: bool = False) -> Path:
-    config = load_config()
+    config = config_snapshot()
     path = active_folder(create=create) / config["scan_subfolder"]
     if create:
         path.mkdir(parents=True, exist_ok=True)
@@ -37,7 +38,7 @@ def scan_folder(create: bool = False) -> Path:
 
 
 def source_folder(source_name: str, create: bool = False) -> Path:
-    config = load_config()
+    config = config_snapshot()
     sources = config.get("sources", {})
     source_config = sources.get(source_name, {})
     subfolder = source_config.get("subfolder", source_name)
@@ -48,49 +49,109 @@ def source_folder(source_name: str, create: bool = False) -> Path:
 
 
 def save_scan_bytes(filename: str, content: bytes) -> Path:
-    destination = scan_folder(create=True) / filename
-    with destination.open("wb") as output_file:
-        output_file.write(content)
-    return destination
+    """Save a scan file; returns where its content is, which is an existing
+    file when the active folder already has the same scan."""
+    return place_bytes(content, scan_folder(create=True) / filename)["path"]
 
 
-def _file_info(path: Path) -> dict[str, Any]:
-    stat = path.stat()
-    return {
-        "name": path.name,
-        "path": str(path),
-        "extension": path.suffix.lower(),
-        "size": stat.st_size,
-        "modified_at": datetime.fromtimestamp(stat.st_mtime).isoformat(timespec="seconds"),
-    }
+def download_path(destination: Path) -> Path:
+    """Where to write a file meant for destination before place_download."""
+    return content_index.partial_path(destination)
+
+
+def place_download(temp_path: Path, destination: Path) -> dict[str, Any]:
+    """Move a finished download into place unless the active folder already
+    has its content (see content_index.place_file)."""
+    return content_index.place_file(active_folder(), temp_path, destination)
+
 
+def place_bytes(content: bytes, destination: Path, exclude: Collection[Path] = ()) -> dict[str, Any]:
+    return content_index.place_bytes(active_folder(), content, destination, exclude)
 
-def list_document_files(limit: int | None = None) -> list[dict[str, Any]]:
+
+def duplicate_report() -> dict[str, Any]:
     folder = active_folder()
     if not folder.exists():
-        return []
-    files = [
-        _file_info(path)
-        for path in folder.rglob("*")
-        if path.is_file() and path.suffix.lower() in DOCUMENT_EXTENSIONS
-    ]
-    files.sort(key=lambda item: item["modified_at"], reverse=True)
-    if limit is not None:
-        return files[:limit]
-    return files
+        return {"active_folder": str(folder), "groups": [], "duplicate_files": 0, "wasted_bytes": 0}
+    return content_index.duplicate_report(folder)
 
 
-def load_job_state() -> dict[str, Any]:
-    if not JOB_STATE_PATH.exists():
-        return {}
+def file_written(path: Path) -> None:
+    """Tell the file index about a document file the server wrote."""
+    file_index.record(active_folder(), path)
+
+
+def file_removed(path: Path) -> None:
+    file_index.forget(active_folder(), path)
+
 
+def refresh_file_index() -> None:
+    folder = active_folder()
+    if folder.exists():
+        file_index.refresh(folder)
+
+
+def count_document_files(query: FileQuery = FileQuery()) -> int:
+    folder = active_folder()
+    return file_index.count_files(folder, query) if folder.exists() else 0
+
+
+def list_document_files(query: FileQuery = FileQuery(), limit: int | None = None, cursor: str | None = None,
+                        offset: int = 0) -> tuple[list[dict[str, Any]], str | None]:
+    """One page of document files in the active folder (newest first by
+    default) and the cursor for the next page. Comes from the file index,
+    which only re-lists directories that changed."""
+    folder = active_folder()
+    if not folder.exists():
+        return [], None
+    return file_index.query_files(folder, query, limit=limit, cursor=cursor, offset=offset)
+
+
+def scans_query(query: FileQuery = FileQuery()) -> FileQuery:
+    """The same filter and order, limited to the scan folder."""
+    return FileQuery(None, query.extensions, str(scan_folder()), query.sort, query.descending)
+
+
+def file_generation() -> int:
+    """Generation of the file index; it changes whenever a file under the
+    active folder is added, changed or removed."""
+    folder = active_folder()
+    return file_index.generation(folder) if folder.exists() else 0
+
+
+def file_changes(since: int) -> dict[str, Any]:
+    folder = active_folder()
+    if not folder.exists():
+        return {"generation": 0, "since": since, "reset": since != 0, "added": [], "removed": []}
+    return file_index.changes_since(folder, since)
+
+
+def job_state_version() -> tuple[int, int] | None:
+    """(mtime_ns, size) of job_state.json, None while there is none."""
     try:
-        with JOB_STATE_PATH.open("r", encoding="utf-8") as state_file:
-            state = json.load(state_file)
-    except Exception:
-        return {}
+        stat = JOB_STATE_PATH.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
 
-    return state if isinstance(state, dict) else {}
+
+def load_job_state() -> dict[str, Any]:
+    global _job_state
+    stamp = job_state_version()
+    cached_stamp, state = _job_state
+    if stamp != cached_stamp:
+        state = {}
+        if stamp is not None:
+            try:
+                with JOB_STATE_PATH.open("r", encoding="utf-8") as state_file:
+                    state = json.load(state_file)
+            except Exception:
+                state = {}
+            if not isinstance(state, dict):
+                state = {}
+        _job_state = (stamp, state)
+
+    return dict(state)
 
 
 def _job_summary(source: str, result: dict[str, Any]) -> dict[str, Any]:
@@ -107,6 +168,7 @@ def _job_summary(source: str, result: dict[str, Any]) -> dict[str, Any]:
         "skipped_non_pdf": result.get("skipped_non_pdf"),
         "skipped_excluded_sender": result.get("skipped_excluded_sender"),
         "skipped_outside_date_range": result.get("skipped_outside_date_range"),
+        "skipped_duplicates": result.get("skipped_duplicates"),
         "subscriptions_count": len(result.get("subscriptions") or []),
         "next_invoice": result.get("next_invoice"),
         "completed_at": datetime.now().isoformat(timespec="seconds"),
@@ -114,32 +176,38 @@ def _job_summary(source: str, result: dict[str, Any]) -> dict[str, Any]:
 
 
 def save_job_summary(source: str, result: dict[str, Any]) -> dict[str, Any]:
-    state = load_job_state()
-    state[source] = _job_summary(source, result)
-    JOB_STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with JOB_STATE_PATH.open("w", encoding="utf-8") as state_file:
-        json.dump(state, state_file, indent=2, ensure_ascii=False)
-        state_file.write("\n")
+    global _job_state
+    with _job_state_lock:
+        state = load_job_state()
+        state[source] = _job_summary(source, result)
+        JOB_STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = JOB_STATE_PATH.with_name(f"{JOB_STATE_PATH.name}.{os.getpid()}.tmp")
+        with temp_path.open("w", encoding="utf-8") as state_file:
+            json.dump(state, state_file, indent=2, ensure_ascii=False)
+            state_file.write("\n")
+        temp_path.replace(JOB_STATE_PATH)
+        _job_state = (job_state_version(), state)
     return state[source]
 
 
-def folder_status() -> dict[str, Any]:
+def folder_status(query: FileQuery = FileQuery(), limit: int = RECENT_FILES_LIMIT, cursor: str | None = None,
+                  scans_cursor: str | None = None) -> dict[str, Any]:
+    """Folder summary with the first page (or the page after a cursor) of
+    its files and of its scans. Counts honour the query's filters."""
     folder = active_folder()
-    scans = scan_folder()
-    files = list_document_files()
-    scan_files = [
-        _file_info(path)
-        for path in (scans.iterdir() if scans.exists() else [])
-        if path.is_file() and path.suffix.lower() in DOCUMENT_EXTENSIONS
-    ]
-    scan_files.sort(key=lambda item: item["modified_at"], reverse=True)
+    scans = scans_query(query)
+    recent_files, next_cursor = list_document_files(query, limit=limit, cursor=cursor)
+    recent_scans, next_scans_cursor = list_document_files(scans, limit=limit, cursor=scans_cursor)
 
     return {
         "active_folder": str(folder),
-        "scan_folder": str(scans),
-        "document_count": len(files),
-        "scan_count": len(scan_files),
+        "scan_folder": scans.directory,
+        "generation": file_generation(),
+        "document_count": count_document_files(query),
+        "scan_count": count_document_files(scans),
         "job_state": load_job_state(),
-        "recent_files": files,
-        "recent_scans": scan_files,
+        "recent_files": recent_files,
+        "next_cursor": next_cursor,
+        "recent_scans": recent_scans,
+        "next_scans_cursor": next_scans_cursor,
     }
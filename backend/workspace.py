@@ -0,0 +1,75 @@
+# Per-thread scratch space for the image pipeline. Intermediate arrays
+# (grayscale, blurred, edge maps, LAB planes) are handed out from named
+# buffers that are kept between pages and only grow, and OpenCV writes into
+# them through dst= instead of allocating. Structuring elements and CLAHE
+# instances are built once. Pool workers are single-threaded processes, so in
+# practice this is one workspace per worker.
+
+import threading
+
+import cv2
+import numpy as np
+
+
+# Scratch arrays larger than this are allocated per call rather than kept, so
+# an occasional huge page does not pin its memory in every worker
+MAX_RETAINED_BUFFER_BYTES = 32 * 1024 * 1024
+
+
+class Workspace:
+    def __init__(self, max_retained_bytes: int = MAX_RETAINED_BUFFER_BYTES):
+        self.max_retained_bytes = max_retained_bytes
+        self._buffers: dict[str, np.ndarray] = {}
+        self._kernels: dict[tuple[int, int, int], np.ndarray] = {}
+        self._clahes: dict[tuple[float, tuple[int, int]], cv2.CLAHE] = {}
+
+    def buffer(self, name: str, shape: tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        """Uninitialised array of exactly this shape.
+
+        Valid until the same name is requested again on this thread, so it
+        must never be returned to a caller outside the pipeline step using it.
+        """
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        if nbytes > self.max_retained_bytes:
+            return np.empty(shape, dtype)
+        backing = self._buffers.get(name)
+        if backing is None or backing.nbytes < nbytes:
+            backing = self._buffers[name] = np.empty(nbytes, np.uint8)
+        return backing[:nbytes].view(dtype).reshape(shape)
+
+    def like(self, name: str, image: np.ndarray) -> np.ndarray:
+        return self.buffer(name, image.shape, image.dtype)
+
+    def kernel(self, size: int, shape: int = cv2.MORPH_RECT) -> np.ndarray:
+        key = (shape, size, size)
+        kernel = self._kernels.get(key)
+        if kernel is None:
+            kernel = self._kernels[key] = cv2.getStructuringElement(shape, (size, size))
+        return kernel
+
+    def clahe(self, clip_limit: float, tile_grid: tuple[int, int] = (8, 8)) -> cv2.CLAHE:
+        # CLAHE objects keep internal state while applying, hence per thread
+        key = (clip_limit, tile_grid)
+        clahe = self._clahes.get(key)
+        if clahe is None:
+            clahe = self._clahes[key] = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid)
+        return clahe
+
+    @property
+    def retained_bytes(self) -> int:
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+    def release(self) -> None:
+        """Drop the scratch buffers (kernels and CLAHE instances are kept)."""
+        self._buffers.clear()
+
+
+_local = threading.local()
+
+
+def get_workspace() -> Workspace:
+    workspace = getattr(_local, "workspace", None)
+    if workspace is None:
+        workspace = _local.workspace = Workspace()
+    return workspace
@@ -25,6 +25,10 @@ const dropboxRunBtn = document.getElementById("dropbox-run-btn");
 const dropboxResult = document.getElementById("dropbox-result");
 const toast = document.getElementById("toast");
 
+// The status lists at most this many of the newest files
+const FILE_LIST_LIMIT = 200;
+let currentStatus = null;
+
 function showToast(message) {
   toast.textContent = message;
   toast.classList.add("show");
@@ -38,8 +42,14 @@ function formatSize(bytes) {
 }
 
 function renderStatus(status) {
+  renderFiles(status);
+  renderJobState(status.job_state || {});
+}
+
+function renderFiles(status) {
+  currentStatus = status;
   const files = status.recent_files || [];
-  if (filesHeading) filesHeading.textContent = `Files (${files.length})`;
+  if (filesHeading) filesHeading.textContent = `Files (${status.document_count ?? files.length})`;
   filesBody.innerHTML = "";
   filesEmpty.style.display = files.length ? "none" : "block";
   filesTable.style.display = files.length ? "table" : "none";
@@ -54,13 +64,12 @@ function renderStatus(status) {
     `;
     filesBody.appendChild(row);
   });
-
-  renderJobState(status.job_state || {});
 }
 
-function renderJobState(jobState) {
+// justRan: the job whose run function already showed its detailed result
+function renderJobState(jobState, justRan = null) {
   const outlook = jobState.outlook;
-  if (outlook) {
+  if (outlook && justRan !== "outlook") {
     outlookResult.textContent =
       `Last run ${outlook.completed_at}: downloaded ${outlook.downloaded_count || 0} PDF attachment(s) ` +
       `for ${outlook.date_from || "?"} to ${outlook.date_to || "?"}. ` +
@@ -71,6 +80,8 @@ function renderJobState(jobState) {
   const wix = jobState.wix;
   if (wix) {
     renderWixNextInvoice(wix.next_invoice);
+  }
+  if (wix && justRan !== "wix") {
     wixResult.textContent =
       `Last run ${wix.completed_at}: downloaded ${wix.downloaded_count || 0} Wix invoice PDF(s) ` +
       `for ${wix.date_from || "?"} to ${wix.date_to || "?"}. ` +
@@ -80,7 +91,7 @@ function renderJobState(jobState) {
   }
 
   const dropbox = jobState.dropbox;
-  if (dropbox) {
+  if (dropbox && justRan !== "dropbox") {
     dropboxResult.textContent =
       `Last run ${dropbox.completed_at}: downloaded ${dropbox.downloaded_count || 0} Dropbox invoice PDF(s) ` +
       `for ${dropbox.date_from || "?"} to ${dropbox.date_to || "?"}. ` +
@@ -118,6 +129,62 @@ async function loadDashboard() {
   renderStatus(status);
 }
 
+async function loadStatus() {
+  const response = await fetch("/api/folder/status");
+  renderStatus(await response.json());
+}
+
+async function syncAfterJob(source) {
+  // The event stream only carries file changes, so job_state is fetched
+  // here (cheap: the status answers 304 when nothing changed)
+  const response = await fetch("/api/folder/status");
+  const status = await response.json();
+  renderFiles(status);
+  renderJobState(status.job_state || {}, source);
+}
+
+function applyFolderChanges(change) {
+  if (!currentStatus || change.reset || change.active_folder !== currentStatus.active_folder) {
+    loadStatus().catch(() => showToast("Could not refresh files."));
+    return;
+  }
+
+  const replaced = new Set([...change.removed, ...change.added.map((file) => file.path)]);
+  const files = (currentStatus.recent_files || [])
+    .filter((file) => !replaced.has(file.path))
+    .concat(change.added)
+    .sort((a, b) => b.modified_at.localeCompare(a.modified_at) || b.path.localeCompare(a.path))
+    .slice(0, FILE_LIST_LIMIT);
+  if (files.length < Math.min(change.document_count, FILE_LIST_LIMIT)) {
+    // Removals uncovered older files the list never had
+    loadStatus().catch(() => showToast("Could not refresh files."));
+    return;
+  }
+  // Only the file list: the cached job_state predates any job run since
+  renderFiles({
+    ...currentStatus,
+    generation: change.generation,
+    document_count: change.document_count,
+    recent_files: files,
+  });
+}
+
+function watchFolder() {
+  if (!window.EventSource) return;
+  const events = new EventSource("/api/folder/events");
+  events.addEventListener("ready", (event) => {
+    // Also sent after a reconnect: catch up on anything missed meanwhile
+    const state = JSON.parse(event.data);
+    if (
+      currentStatus &&
+      (state.generation !== currentStatus.generation || state.active_folder !== currentStatus.active_folder)
+    ) {
+      loadStatus().catch(() => showToast("Could not refresh files."));
+    }
+  });
+  events.addEventListener("changes", (event) => applyFolderChanges(JSON.parse(event.data)));
+}
+
 async function loadRuntimeUrls() {
   const response = await fetch("/api/runtime/urls");
   const urls = await response.json();
@@ -197,8 +264,9 @@ async function runOutlookDownload() {
       `Skipped ${result.skipped_non_pdf} non-PDF attachment(s). ` +
       `Skipped ${result.skipped_excluded_sender || 0} excluded sender message(s). ` +
       `Skipped ${result.skipped_outside_date_range || 0} outside date range. ` +
+      `Skipped ${result.skipped_duplicates || 0} already saved. ` +
       `Errors: ${result.error_count || 0}.`;
-    await loadDashboard();
+    await syncAfterJob("outlook");
     showToast("Outlook download complete.");
   } catch (error) {
     outlookResult.textContent = error.message;
@@ -264,8 +332,9 @@ async function runWixDownload() {
       `Downloaded ${result.downloaded_count} Wix invoice PDF(s) to ${result.output_dir}. ` +
       `Inspected ${result.inspected_rows || 0} invoice row(s). ` +
       `Subscriptions found: ${(result.subscriptions || []).length}. ` +
+      `Skipped ${result.skipped_duplicates || 0} already saved. ` +
       `Errors: ${result.error_count || 0}.`;
-    await loadDashboard();
+    await syncAfterJob("wix");
     showToast("Wix download complete.");
   } catch (error) {
     wixResult.textContent = error.message;
@@ -312,8 +381,9 @@ async function runDropboxDownload() {
     dropboxResult.textContent =
       `Downloaded ${result.downloaded_count} Dropbox invoice PDF(s) to ${result.output_dir}. ` +
       `Inspected ${result.inspected_rows || 0} invoice row(s). ` +
+      `Skipped ${result.skipped_duplicates || 0} already saved. ` +
       `Errors: ${result.error_count || 0}.`;
-    await loadDashboard();
+    await syncAfterJob("dropbox");
     showToast("Dropbox download complete.");
   } catch (error) {
     dropboxResult.textContent = error.message;
@@ -351,3 +421,4 @@ loadRuntimeUrls().catch(() => {
   if (phoneUrl) phoneUrl.textContent = "Could not load scanner URL.";
 });
 loadDashboard().catch(() => showToast("Could not load dashboard."));
+watchFolder();